@@ -1,5 +1,5 @@
 import re
-import os
+import asyncio
 from typing import List, Dict, Any, AsyncGenerator, Optional
 import logging
 from datetime import datetime
@@ -9,9 +9,14 @@ from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI # Hoặc LLM bạn dùng
 
 # Import từ các module mới tạo
+from configs.logging_config import PAYLOAD
 from modules.data_utils import load_table_metadata
-from modules.db_executor import execute_sql_with_retry, format_sql_result_for_llm_analysis
-from modules.llm_invoker import invoke_llm_for_full_response
+from modules.db_executor import execute_sql_query, execute_sql_with_retry, format_sql_result_for_llm_analysis
+from modules.indexer import build_embeddings
+from modules.llm_invoker import ChatModelPool, invoke_llm_for_full_response
+from modules.metrics import LLM_SQL_GEN_MS
+from modules.sql_cache import SqlPlanCache
+from modules.tracing import current_span, traced
 
 from utils.questions_handle import extract_and_format_from_selected_tables
 
@@ -24,24 +29,43 @@ from configs.prompt import (
 
 class SqlAgent:
     def __init__(self):
-        pass
-
-    async def process( self, message: str, cfg: dict, table_name: str = "data_ndh") -> str:
+        # client LLM dùng lại giữa các request, khởi tạo ở lần gọi đầu tiên
+        self.llm_pool: Optional[ChatModelPool] = None
+        # cache SQL đã chạy thành công, khởi tạo theo config ở lần gọi đầu tiên
+        self.sql_cache: Optional[SqlPlanCache] = None
+        self._sql_cache_initialized = False
+
+    def init_sql_cache(self, cfg: Dict[str, Any]) -> None:
+        if self._sql_cache_initialized:
+            return
+        self._sql_cache_initialized = True
+        cache_cfg = cfg.get('sql_cache', {})
+        embeddings = None
+        if cache_cfg.get('similarity_threshold'):
+            embeddings = build_embeddings(cfg['llm'].get('openai_api_key'), cfg.get('embedding_cache'))
+        self.sql_cache = SqlPlanCache.from_config(cache_cfg, embeddings=embeddings)
+
+    def get_llm(self, llm_cfg: Dict[str, Any], model_name: Optional[str] = None, temperature: Optional[float] = None):
+        if self.llm_pool is None:
+            self.llm_pool = ChatModelPool(llm_cfg)
+        return self.llm_pool.get(model_name, temperature)
+
+    async def aclose(self) -> None:
+        if self.llm_pool is not None:
+            await self.llm_pool.aclose()
+            self.llm_pool = None
+
+    async def process( self, message: str, cfg: dict, table_name: str = "data_ndh",
+                       model_name: Optional[str] = None, temperature: Optional[float] = None) -> str:
         start_time = datetime.now()
         logger.info(f"============== SQL RETRIEVAL PROCESS ==============")
         logger.info(f"MESSAGE = '{message}'")
         logger.info(f"TABLE_NAMES = '{table_name}'")
 
         try:
-            # === Init LLM ===
-            llm_cfg = cfg['llm']
-            if llm_cfg.get('openai_api_key'):
-                os.environ['OPENAI_API_KEY'] = llm_cfg['openai_api_key']
-            model_4_1 = ChatOpenAI(
-                model_name=llm_cfg['model_4_1'],
-                temperature=llm_cfg['temperature'],
-                streaming=llm_cfg['streaming'],
-            )
+            # === LLM (client dùng chung, override model/temperature theo request nếu có) ===
+            model_4_1 = self.get_llm(cfg['llm'], model_name=model_name, temperature=temperature)
+            self.init_sql_cache(cfg)
             result = await self.handle_db_query(model_4_1=model_4_1,
                             original_query=message,
                             target_table_names=[table_name],
@@ -53,6 +77,7 @@ class SqlAgent:
             logger.exception(f"Lỗi trong quá trình xử lý pipline: {e})")
             return ""
 
+    @traced()
     async def handle_db_query(self,
         model_4_1: ChatOpenAI,
         original_query: str,
@@ -72,44 +97,71 @@ class SqlAgent:
         # 2. Lấy ra thông tin bảng để truy vấn
         selected_table_info = metadata[ 0 ]
 
-        # 3. Chuẩn bị thông tin cho prompt sinh SQL
-        columns_details = "\n".join([
-            f"  - {col.get('column_name')} ({col.get('data_type')}): {col.get('description')}"
-            for col in selected_table_info.get('columns', [])
-        ])
-
-        sql_samples = "".join(extract_and_format_from_selected_tables(metadata,target_table_names,max_questions=4))
+        table_name = selected_table_info['table_name']
+
+        # 3. Tra cache: câu hỏi đã từng được trả lời bằng một câu SQL chạy thành công
+        query_result = None
+        question_embedding = None
+        if self.sql_cache is not None:
+            cached_sql, question_embedding, cached_key = await self.sql_cache.lookup(original_query, table_name)
+            if cached_sql:
+                logger.info(f"SQL (cache) = '{cached_sql}'")
+                cached_result = await asyncio.to_thread(execute_sql_query, cached_sql)
+                if cached_result["status"] == "success":
+                    query_result = cached_result
+                    current_span().set(sql_cache_hit=True)
+                    if cached_key != self.sql_cache.make_key(original_query, table_name):
+                        # semantic hit: lưu thêm khóa exact cho câu hỏi mới
+                        self.sql_cache.store(original_query, table_name, cached_sql, question_embedding)
+                else:
+                    logger.info("SQL trong cache không còn lấy được dữ liệu, sinh lại SQL bằng LLM")
+                    self.sql_cache.invalidate(cached_key)
+
+        if query_result is None:
+            # 4. Chuẩn bị thông tin cho prompt sinh SQL
+            columns_details = "\n".join([
+                f"  - {col.get('column_name')} ({col.get('data_type')}): {col.get('description')}"
+                for col in selected_table_info.get('columns', [])
+            ])
+
+            sql_samples = "".join(extract_and_format_from_selected_tables(metadata,target_table_names,max_questions=4))
         
-        # 4. Sinh câu lệnh SQL
-        prompt_input_sql = {
-            'question': original_query,
-            'tables_name': selected_table_info['table_name'],
-            'table_description': selected_table_info.get('description', 'N/A'),
-            'sql_samples': sql_samples,
-            'columns_info': columns_details if columns_details else '  (Không có thông tin cột chi tiết)',
-        }
-        sql_generation_prompt_str = SQL_GENERATION_PROMPT.format(**prompt_input_sql)
-
-        llm_sql_response = await invoke_llm_for_full_response(model_4_1, [HumanMessage(content=sql_generation_prompt_str)])
-        # check sql được sinh ra bằng regex
-        sql_match = re.search(r"```sql\s*([\s\S]+?)\s*```", llm_sql_response)
+            # 5. Sinh câu lệnh SQL
+            prompt_input_sql = {
+                'question': original_query,
+                'tables_name': selected_table_info['table_name'],
+                'table_description': selected_table_info.get('description', 'N/A'),
+                'sql_samples': sql_samples,
+                'columns_info': columns_details if columns_details else '  (Không có thông tin cột chi tiết)',
+            }
+            sql_generation_prompt_str = SQL_GENERATION_PROMPT.format(**prompt_input_sql)
+
+            with LLM_SQL_GEN_MS.time(stage="generate"):
+                llm_sql_response = await invoke_llm_for_full_response(model_4_1, [HumanMessage(content=sql_generation_prompt_str)])
+            # check sql được sinh ra bằng regex
+            sql_match = re.search(r"```sql\s*([\s\S]+?)\s*```", llm_sql_response)
         
-        if not sql_match:
-            logger.info("câu hỏi đầu vào không thể tạo truy vấn SQL")
-            return "Unknown"
+            if not sql_match:
+                logger.info("câu hỏi đầu vào không thể tạo truy vấn SQL")
+                return "Unknown"
 
         
-        generated_sql = sql_match.group(1).strip()
-        logger.info(f"SQL = '{generated_sql}'")
-        
-        # 5. Thực thi câu lệnh SQL
-        query_result = await execute_sql_with_retry(model_4_1, 
-                                                    original_query,
-                                                    selected_table_info['table_name'], 
-                                                    generated_sql , 
-                                                    prompt_input_sql,
-                                                    max_attempts = cfg['bot']['sql_double_check'] )
+            generated_sql = sql_match.group(1).strip()
+            logger.info(f"SQL = '{generated_sql}'")
         
+            # 6. Thực thi câu lệnh SQL
+            query_result = await execute_sql_with_retry(model_4_1, 
+                                                        original_query,
+                                                        selected_table_info['table_name'], 
+                                                        generated_sql , 
+                                                        prompt_input_sql,
+                                                        max_attempts = cfg['bot']['sql_double_check'] )
+
+            # 7. Lưu lại câu SQL đã chạy thành công để dùng cho các câu hỏi lặp lại
+            if self.sql_cache is not None and query_result["status"] == "success":
+                self.sql_cache.store(original_query, table_name, query_result["sql"], question_embedding)
+
+        current_span().set(status=query_result['status'])
         final_respone = {
             "status": query_result['status'],
             "message": query_result['message'],
@@ -123,7 +175,7 @@ class SqlAgent:
             logger.info(f"Lỗi khi thực thi SQL: {query_result['message']}")
             final_respone['sql_result_summary'] = "N/A"
         else:
-            logger.info(f'DATA: {query_result["data"]}')
+            logger.info('DATA: %s', query_result["data"], extra=PAYLOAD)
             final_respone['sql_result_summary'] = format_sql_result_for_llm_analysis(query_result)
         return final_respone
     
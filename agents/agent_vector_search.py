@@ -1,5 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
 from langchain_core.documents import Document
-import logging 
+from pymilvus import AnnSearchRequest, RRFRanker, WeightedRanker
+import logging
+
+from modules.chunker import collapse_chunks
+from modules.metrics import EMBED_MS, MILVUS_SEARCH_MS
+from modules.retrieval_cache import RetrievalCache
 
 
 logger = logging.getLogger("ChatbotNDH")
@@ -16,31 +26,194 @@ hybrid_search_params = [
     },
     {
         "anns_field": "sparse",    # Trường vector thưa (sparse)
-        "metric_type": "BM25",     # Metric BM25 cho vector thưa  
+        "metric_type": "BM25",     # Metric BM25 cho vector thưa
         "params": {
             "k1": 1.2,             # Tham số k1 của BM25 (thường từ 1.2-2.0)
             "b": 0.75              # Tham số b của BM25 (thường từ 0.5-0.8)
         }
     }
 ]
+# Số kết quả tối thiểu lấy ở mỗi nhánh (dense / sparse) trước khi gộp, giống mặc định của langchain_milvus
+HYBRID_FETCH_K = 4
+# Cách gộp kết quả hai nhánh: weighted (tổng có trọng số của điểm đã chuẩn hóa) hoặc rrf (reciprocal rank fusion)
+FUSION_WEIGHTED = "weighted"
+FUSION_RRF = "rrf"
+DEFAULT_RRF_K = 60
+# bài dài được lưu thành nhiều chunk: lấy dư top_k * hệ số này rồi gộp chunk theo bài để vẫn đủ top_k bài
+CHUNK_FETCH_FACTOR = 3
+VECTOR_FIELDS = ("vector", "sparse")
+TEXT_FIELD = "text"
+
+
 class VecterSearchAgent:
-    def __init__(self, vector_store ):
-        """Initialize the Retriever with a vector store."""
+    def __init__(self, vector_store, search_workers: int = 8, max_pending: int = 64,
+                 cache: Optional[RetrievalCache] = None, chunk_fetch_factor: int = CHUNK_FETCH_FACTOR,
+                 vector_search_params: Optional[dict] = None, fusion: str = FUSION_WEIGHTED,
+                 weights: Optional[Dict[str, float]] = None, rrf_k: int = DEFAULT_RRF_K,
+                 leg_top_k: Optional[Dict[str, int]] = None):
+        """Initialize the Retriever with a vector store.
+
+        search_workers: số thread tối đa dùng để chạy truy vấn Milvus (blocking) ngoài event loop.
+        max_pending: số truy vấn tối đa được phép chờ/chạy cùng lúc trên executor.
+        cache: cache kết quả tìm kiếm (None = không cache).
+        chunk_fetch_factor: số chunk lấy về cho mỗi bài cần trả, trước khi gộp các chunk cùng bài.
+        vector_search_params: metric / tham số tìm kiếm của nhánh dense, khớp với index của trường vector
+            (xem modules.vector_index.vector_search_params); None = dùng `hybrid_search_params`.
+        fusion: "weighted" hoặc "rrf"; weights: trọng số mỗi nhánh theo tên trường ("vector", "sparse"),
+            chỉ dùng với weighted; rrf_k: hằng số k của RRF.
+        leg_top_k: số kết quả lấy ở mỗi nhánh theo tên trường (mặc định: số bản ghi cần trả sau khi gộp).
+        """
+        if fusion not in (FUSION_WEIGHTED, FUSION_RRF):
+            raise ValueError(f"fusion không hợp lệ: {fusion} (chọn '{FUSION_WEIGHTED}' hoặc '{FUSION_RRF}')")
         self.vector_store = vector_store
-        self.search_params = hybrid_search_params
-    def retrieve(self, query: str, top_k : int ) -> list[Document]:
-        """Retrieve documents from the vector store based on the query."""
+        self.search_params = [
+            {**param, **vector_search_params} if vector_search_params and param["anns_field"] == "vector" else param
+            for param in hybrid_search_params
+        ]
+        self.fusion = fusion
+        self.weights = [float((weights or {}).get(param["anns_field"], 1.0)) for param in self.search_params]
+        self.rrf_k = rrf_k
+        self.leg_top_k = dict(leg_top_k or {})
+        self.cache = cache
+        self.chunk_fetch_factor = max(1, chunk_fetch_factor)
+        self._executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="milvus_search")
+        self._max_pending = max_pending
+        self._pending: Optional[asyncio.Semaphore] = None
+
+    @property
+    def embeddings(self):
+        return self.vector_store.embeddings
+
+    def retrieve(self, query: str, top_k : int, score_threshold: float = 0,
+                 filter: Optional[str] = None) -> list[Tuple[Document, float]]:
+        """Retrieve documents from the vector store based on the query.
+
+        filter: biểu thức lọc metadata của Milvus áp dụng cho cả hai nhánh; score_threshold so với điểm đã chuẩn hóa [0, 1].
+        """
+        key = RetrievalCache.make_key(query, top_k, score_threshold, (filter,) if filter else ())
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
         try:
-            result = self.vector_store.similarity_search_with_score(
-                query=query,
-                k = top_k,  # Số lượng tài liệu trả về
-                param = self.search_params  # Truyền các tham số tìm kiếm hybrid vào đây
-            )
-            return result
+            with EMBED_MS.time(op="query"):
+                embedding = self.embeddings.embed_query(query)
+            if self.cache is not None:
+                cached = self.cache.get_similar(key, embedding)
+                if cached is not None:
+                    return cached
+            result = self._filter_by_score(self.hybrid_search(query, embedding, top_k, filter), score_threshold)
+        except Exception as e:
+            logger.info(f"lỗi: search vector trong vectorstore: {e}")
+            return []
+        if self.cache is not None:
+            self.cache.set(key, result, embedding)
+        return result
+
+    async def aretrieve(self, query: str, top_k: int, score_threshold: float = 0,
+                        filter: Optional[str] = None) -> list[Tuple[Document, float]]:
+        """Phiên bản bất đồng bộ của `retrieve`: embedding gọi async, truy vấn Milvus
+        được đẩy sang thread pool giới hạn để không chặn event loop."""
+        key = RetrievalCache.make_key(query, top_k, score_threshold, (filter,) if filter else ())
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self._max_pending)
+        try:
+            async with self._pending:
+                with EMBED_MS.time(op="query"):
+                    embedding = await self.embeddings.aembed_query(query)
+                if self.cache is not None:
+                    cached = self.cache.get_similar(key, embedding)
+                    if cached is not None:
+                        return cached
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._executor,
+                    partial(self.hybrid_search, query, embedding, top_k, filter),
+                )
         except Exception as e:
-            logger.info("lỗi: search vector trong vectorstore")
+            logger.info(f"lỗi: search vector trong vectorstore: {e}")
             return []
-    
+        result = self._filter_by_score(result, score_threshold)
+        if self.cache is not None:
+            self.cache.set(key, result, embedding)
+        return result
+
+    @staticmethod
+    def _filter_by_score(results: list[Tuple[Document, float]], score_threshold: float) -> list[Tuple[Document, float]]:
+        if not score_threshold:
+            return results
+        return [(doc, score) for doc, score in results if score >= score_threshold]
+
+    def _ranker(self):
+        if self.fusion == FUSION_RRF:
+            return RRFRanker(self.rrf_k)
+        # norm_score: Milvus đưa điểm từng nhánh về [0, 1] trước khi cộng có trọng số
+        return WeightedRanker(*self.weights, norm_score=True)
+
+    def _max_score(self) -> float:
+        """Điểm gộp lớn nhất có thể, dùng để chuẩn hóa điểm về [0, 1]."""
+        if self.fusion == FUSION_RRF:
+            return len(self.search_params) / (self.rrf_k + 1)
+        return sum(self.weights)
+
+    def hybrid_search(self, query: str, embedding: List[float], top_k: int,
+                      filter: Optional[str] = None) -> list[Tuple[Document, float]]:
+        """Hybrid search (dense + BM25) với embedding đã tính sẵn, mỗi bài viết trả về một bản ghi.
+
+        Mỗi nhánh lấy `leg_top_k[trường]` kết quả (lọc trước theo biểu thức Milvus `filter` nếu có), gộp bằng
+        `fusion`; điểm trả về được chuẩn hóa về [0, 1] (1 = đứng đầu / điểm tối đa ở mọi nhánh) nên
+        `score_threshold` có cùng thang đo với mọi cách gộp.
+        """
+        limit = top_k * self.chunk_fetch_factor
+        search_data = {"vector": embedding, "sparse": query}
+        requests = []
+        for param in self.search_params:
+            leg_limit = self.leg_top_k.get(param["anns_field"]) or max(HYBRID_FETCH_K, limit)
+            requests.append(AnnSearchRequest(
+                data=[search_data[param["anns_field"]]],
+                anns_field=param["anns_field"],
+                param=self._with_min_ef(param, leg_limit),
+                limit=leg_limit,
+                expr=filter,
+            ))
+        with MILVUS_SEARCH_MS.time():
+            search_result = self.vector_store.client.hybrid_search(
+                self.vector_store.collection_name,
+                reqs=requests,
+                ranker=self._ranker(),
+                limit=limit,
+                output_fields=["*"],
+            )
+        if not search_result:
+            return []
+        max_score = self._max_score() or 1.0
+        hits = [
+            (self._to_document(hit["entity"]), min(1.0, max(0.0, hit["distance"] / max_score)))
+            for hit in search_result[0]
+        ]
+        return collapse_chunks(hits, top_k)
+
+    @staticmethod
+    def _with_min_ef(param: dict, limit: int) -> dict:
+        # HNSW yêu cầu ef >= số kết quả cần lấy
+        ef = param.get("params", {}).get("ef")
+        if ef is None or ef >= limit:
+            return param
+        return {**param, "params": {**param["params"], "ef": limit}}
+
+    @staticmethod
+    def _to_document(entity: dict) -> Document:
+        for field in VECTOR_FIELDS:
+            entity.pop(field, None)
+        return Document(page_content=entity.pop(TEXT_FIELD, ""), metadata=entity)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
 # if __name__ == "__main__":
 #     # Example usage
 #     from indexer import create_vectorstore
@@ -49,7 +222,7 @@ class VecterSearchAgent:
 
 #     vector_store = create_vectorstore(URI, API_KEY=API_KEY)
 #     retriever = Retriever(vector_store)
-    
+
 #     query = "vcc là gì"
 #     results = retriever.retrieve(query, top_k=5)
-#     print(results)
\ No newline at end of file
+#     print(results)
@@ -0,0 +1,135 @@
+"""
+Benchmark recall@k và độ trễ tìm kiếm của các loại index cho trường vector dày (FLAT, HNSW, IVF_FLAT, IVF_SQ8).
+
+Sinh tập vector chuẩn hóa dạng cụm (giống embedding thật: nhiều bài cùng chủ đề nằm gần nhau),
+tính kết quả đúng bằng brute force (numpy), rồi với mỗi loại index: tạo collection tạm trên Milvus,
+build index bằng cùng hàm với IndexService (`modules.vector_index`), quét các giá trị ef / nprobe
+và in recall@k, p50/p95 độ trễ mỗi truy vấn, thời gian build.
+
+Milvus Lite (uri là file .db) chỉ hỗ trợ FLAT / IVF_FLAT; HNSW và IVF_SQ8 cần Milvus server.
+
+Chạy:
+    python benchmarks/bench_ann_index.py --uri http://localhost:19530 --vectors 50000 --dim 1024 \\
+        --indexes FLAT HNSW IVF_FLAT IVF_SQ8
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules.vector_index import (  # noqa: E402
+    VECTOR_FIELD, add_vector_index, vector_index_config, vector_index_name, vector_search_params, wait_for_index,
+)
+
+
+def make_vectors(n: int, dim: int, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ground_truth(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    truth = []
+    for start in range(0, len(queries), 256):
+        scores = queries[start:start + 256] @ data.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        truth.append(top)
+    return np.vstack(truth)
+
+
+def sweep_values(index_type: str, args) -> list:
+    if index_type == "HNSW":
+        return [("ef", v) for v in args.ef]
+    if index_type.startswith("IVF"):
+        return [("nprobe", v) for v in args.nprobe]
+    return [(None, None)]
+
+
+def build_collection(client: MilvusClient, name: str, index_cfg: dict, data: np.ndarray, batch: int) -> float:
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = MilvusClient.create_schema()
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field(VECTOR_FIELD, DataType.FLOAT_VECTOR, dim=data.shape[1])
+    client.create_collection(name, schema=schema)
+    for start in range(0, len(data), batch):
+        client.insert(name, [{"id": start + i, VECTOR_FIELD: v.tolist()} for i, v in enumerate(data[start:start + batch])])
+    client.flush(name)
+    start = time.perf_counter()
+    index_params = client.prepare_index_params()
+    add_vector_index(index_params, index_cfg)
+    client.create_index(name, index_params)
+    wait_for_index(client, name, vector_index_name(index_cfg["index_type"]), poll=0.5)
+    client.load_collection(name)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="http://localhost:19530", help="Milvus server hoặc file .db của Milvus Lite")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--indexes", nargs="+", default=["FLAT", "HNSW", "IVF_FLAT", "IVF_SQ8"])
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--M", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None, help="mặc định ~ 4 * sqrt(số vector)")
+    parser.add_argument("--insert-batch", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--keep", action="store_true", help="giữ lại các collection benchmark")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    data = make_vectors(args.vectors, args.dim, args.clusters, rng)
+    queries = make_vectors(args.queries, args.dim, args.clusters, np.random.default_rng(args.seed + 1))
+    truth = ground_truth(data, queries, args.k)
+    nlist = args.nlist or max(16, int(4 * np.sqrt(args.vectors)))
+    build_params = {"HNSW": {"M": args.M, "efConstruction": args.ef_construction},
+                    "IVF_FLAT": {"nlist": nlist}, "IVF_SQ8": {"nlist": nlist}, "FLAT": {}}
+
+    client = MilvusClient(uri=args.uri)
+    print(f"{args.vectors} vector x {args.dim} chiều, {args.queries} truy vấn, recall@{args.k}, uri={args.uri}")
+    print(f"{'index':>9}{'build':>20}{'build s':>9}{'search':>14}{'recall':>8}{'p50 ms':>8}{'p95 ms':>8}{'qps':>8}")
+    collections = []
+    for index_type in args.indexes:
+        index_cfg = vector_index_config({"type": index_type, "params": build_params.get(index_type.upper(), {})})
+        name = f"ann_bench_{index_cfg['index_type'].lower()}"
+        try:
+            build_s = build_collection(client, name, index_cfg, data, args.insert_batch)
+        except Exception as e:
+            print(f"{index_cfg['index_type']:>9}  bỏ qua: {e}")
+            continue
+        collections.append(name)
+        for key, value in sweep_values(index_cfg["index_type"], args):
+            search_params = vector_search_params(index_cfg)
+            if key:
+                search_params["params"][key] = value
+            latencies, hits = [], 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                result = client.search(name, data=[query.tolist()], anns_field=VECTOR_FIELD, limit=args.k,
+                                       search_params=search_params)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += len({hit["id"] for hit in result[0]} & set(expected.tolist()))
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            print(f"{index_cfg['index_type']:>9}{str(index_cfg['params']):>20}{build_s:>9.1f}"
+                  f"{f'{key}={value}' if key else '-':>14}{hits / (args.k * len(queries)):>8.3f}"
+                  f"{statistics.median(latencies):>8.2f}{p95:>8.2f}{1000 * len(latencies) / sum(latencies):>8.0f}")
+    if not args.keep:
+        for name in collections:
+            client.drop_collection(name)
+
+
+if __name__ == "__main__":
+    main()
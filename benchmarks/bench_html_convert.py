@@ -0,0 +1,53 @@
+"""
+Benchmark chuyển đổi HTML -> Markdown song song (process pool) so với tuần tự.
+
+Dùng corpus sinh từ `benchmarks/html_corpus.py` (cấu trúc giống bài viết NDH) và
+đo thời gian/throughput với số process khác nhau, đồng thời kiểm tra kết quả
+song song trùng khớp với chạy tuần tự.
+
+Chạy:
+    python benchmarks/bench_html_convert.py --articles 2000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.html_corpus import generate_corpus  # noqa: E402
+from modules.parser import convert_html_to_markdown_v4, convert_many_html_to_markdown  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 4])
+    parser.add_argument("--chunksize", type=int, default=16)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.articles)
+    size_mb = sum(len(html) for html in corpus) / 1e6
+    print(f"corpus: {len(corpus)} bài, {size_mb:.1f} MB HTML, {os.cpu_count()} CPU")
+
+    start = time.perf_counter()
+    baseline = [convert_html_to_markdown_v4(html) for html in corpus]
+    serial_s = time.perf_counter() - start
+    print(f"{'workers':>8}{'seconds':>10}{'docs/s':>10}{'speedup':>10}{'same':>6}")
+    print(f"{'serial':>8}{serial_s:>10.2f}{len(corpus) / serial_s:>10.1f}{1.0:>10.2f}{'yes':>6}")
+
+    for workers in sorted(set(args.workers)):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # khởi động worker trước để không tính chi phí fork vào thời gian đo
+            list(pool.map(convert_html_to_markdown_v4, corpus[:workers]))
+            start = time.perf_counter()
+            result = convert_many_html_to_markdown(corpus, chunksize=args.chunksize, executor=pool)
+            elapsed = time.perf_counter() - start
+        same = "yes" if result == baseline else "NO"
+        print(f"{workers:>8}{elapsed:>10.2f}{len(corpus) / elapsed:>10.1f}{serial_s / elapsed:>10.2f}{same:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+So khớp và micro-benchmark `convert_html_to_markdown_v4` với `convert_html_to_markdown_v3`.
+
+- Golden: v4 phải cho kết quả giống hệt v3 trên corpus sinh tất định (`benchmarks/html_corpus.py`)
+  và các ca biên (danh sách lồng, ô bảng, <pre>, URL quá dài, &nbsp;...). Lệch là thoát với mã 1.
+- Benchmark: thời gian trung bình mỗi bài cho bài ngắn và bài rất dài.
+
+Chạy:
+    python benchmarks/bench_html_converter_v4.py
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.html_corpus import generate_corpus  # noqa: E402
+from modules.parser import convert_html_to_markdown_v3, convert_html_to_markdown_v4  # noqa: E402
+
+LONG_URL = "https://nguoidonghanh.viettel.vn/" + "z" * 400
+
+EDGE_CASES = [
+    "<ul><li><div>Mục <b>một</b></div><ul><li><p>con</p></li></ul></li><li>hai</li></ul><p>sau</p>",
+    f"<ol start='3'><li><p>a_b*c</p></li><li><div>x <a href='{LONG_URL}'>dài</a> y</div></li></ol>",
+    "<table><tr><td><p>ô 1</p></td><td><div>ô <i>2</i></div></td></tr></table>",
+    "<pre><div>  code\n   giữ</div></pre><h2><div>tiêu đề</div></h2>",
+    f"<div>a <a href='{LONG_URL}'> b </a> c<!-- cm --> d &amp; &lt;tag&gt; &nbsp;e</div>",
+    "<div><div><div><p>sâu <img src='/" + "q" * 400 + "'> x</p> đuôi</div></div></div>",
+    "<div>x<img> y <img src='/a b.png'> z</div><p><br>dòng<br>hai</p>",
+    "<div><p>&nbsp;</p><p></p><div><span></span></div></div>",
+    "<div>trước<ul><li>1</li></ul>sau<blockquote><p>trích</p></blockquote></div><div><code>c_d</code></div>",
+    f"<p>A <a href='/rel'>rel</a> <a href='{LONG_URL}'>long1</a><a href='{LONG_URL}'>long2</a> end</p>",
+    "<div>  \n  <p>  x  </p>  \n </div><div>x</div><div>x</div>",
+    "<h3>h</h3><div><h1>H1 <div>in</div></h1></div><dl><dt><div>t</div></dt><dd><p>d</p></dd></dl>",
+]
+
+
+def check_golden(corpus) -> int:
+    mismatches = 0
+    for i, html in enumerate(corpus):
+        if convert_html_to_markdown_v3(html) != convert_html_to_markdown_v4(html):
+            mismatches += 1
+            print(f"  lệch kết quả ở bài #{i}")
+    return mismatches
+
+
+def time_per_article(fn, corpus, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for html in corpus:
+            fn(html)
+        runs.append((time.perf_counter() - start) / len(corpus))
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden-articles", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    golden = generate_corpus(args.golden_articles) + EDGE_CASES
+    mismatches = check_golden(golden)
+    print(f"golden: {len(golden) - mismatches}/{len(golden)} bài giống hệt v3")
+    if mismatches:
+        sys.exit(1)
+
+    suites = {
+        "nhỏ (3-8 khối)": generate_corpus(300, seed=1, min_blocks=3, max_blocks=8),
+        "vừa (20-60 khối)": generate_corpus(100, seed=2, min_blocks=20, max_blocks=60),
+        "rất dài (800-1200 khối)": generate_corpus(5, seed=3, min_blocks=800, max_blocks=1200),
+    }
+    print(f"{'bài':<26}{'KB/bài':>8}{'v3 ms':>10}{'v4 ms':>10}{'speedup':>9}")
+    for name, corpus in suites.items():
+        kb = sum(len(html) for html in corpus) / len(corpus) / 1024
+        v3 = time_per_article(convert_html_to_markdown_v3, corpus, args.repeat)
+        v4 = time_per_article(convert_html_to_markdown_v4, corpus, args.repeat)
+        print(f"{name:<26}{kb:>8.1f}{v3 * 1000:>10.2f}{v4 * 1000:>10.2f}{v3 / v4:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
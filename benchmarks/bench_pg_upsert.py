@@ -0,0 +1,172 @@
+"""
+Benchmark UPSERT bài viết vào PostgreSQL: ghi đè mọi bản ghi (cách cũ) so với bỏ qua
+các bản ghi có content_hash không đổi (`WHERE t.content_hash IS DISTINCT FROM EXCLUDED.content_hash`).
+
+Mỗi vòng mô phỏng một lần quét toàn bộ của db_ndh_sync: toàn bộ bài viết được UPSERT lại,
+chỉ `--changed` phần trăm số bài thực sự thay đổi. Với mỗi chế độ đo thời gian chạy và lượng
+WAL sinh ra (`pg_wal_lsn_diff` trước/sau), kèm số bài mới / cập nhật / không đổi.
+
+Cần một PostgreSQL cục bộ (>= 10). Script tạo schema riêng (mặc định `bench_upsert`) và xóa nó khi xong.
+
+Chạy:
+    python benchmarks/bench_pg_upsert.py --dsn "dbname=postgres user=postgres host=localhost" \\
+        --articles 5000 --changed 1 --rounds 3
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import Json
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.html_corpus import generate_corpus  # noqa: E402
+from modules.article_store import COLS, ensure_article_table, upsert_articles, upsert_query  # noqa: E402
+from modules.sync_state import content_hash  # noqa: E402
+
+MODES = {"overwrite": False, "skip_unchanged": True}
+
+
+def _default_dsn() -> str:
+    return os.getenv("PG_DSN") or " ".join(
+        f"{key}={os.environ[env]}"
+        for key, env in (("host", "NDH_PG_HOST"), ("port", "NDH_PG_PORT"), ("user", "NDH_PG_USER"),
+                         ("password", "NDH_PG_PW"), ("dbname", "NDH_PG_DB"))
+        if os.getenv(env)
+    )
+
+
+def make_articles(n_articles: int, seed: int) -> list:
+    rng = random.Random(seed)
+    bodies = generate_corpus(min(n_articles, 300), seed=seed)
+    base_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    articles = []
+    for i in range(n_articles):
+        created_at = base_time + timedelta(minutes=i)
+        related = [{"title": f"Bài liên quan {rng.randint(1, 9999)}", "link": f"https://nguoidonghanh.viettel.vn/a/{i}"}]
+        articles.append({
+            "id": i + 1,
+            "link": f"https://nguoidonghanh.viettel.vn/tin-tuc/doi-song/bai-viet-{i + 1}",
+            "category_name": rng.choice(["Đời sống", "Tin tức", "Chuyển đổi số"]),
+            "title": f"Bài viết {i + 1}",
+            "header": f"Tóm tắt bài viết {i + 1}",
+            "body": bodies[i % len(bodies)],
+            "author": "NDH",
+            **{k: rng.randint(0, 1) for k in ("is_comment", "is_active", "is_hot", "is_important", "is_top", "has_video")},
+            **{k: rng.randint(0, 500) for k in ("comment_count", "like_count", "dislike_count", "hit_count")},
+            "created_at": created_at,
+            "updated_at": created_at,
+            "published_time": created_at,
+            "related": related,
+        })
+    return articles
+
+
+def to_records(articles: list) -> list:
+    records = []
+    for art in articles:
+        row = dict(art)
+        row["content_hash"] = content_hash([art[col] for col in COLS[:-2]] + [art["related"]])
+        row["article_json"] = Json(art["related"])
+        records.append(tuple(row[col] for col in COLS))
+    return records
+
+
+def mutate(articles: list, fraction: float, rng: random.Random) -> None:
+    for art in rng.sample(articles, int(len(articles) * fraction)):
+        art["hit_count"] += 1
+        art["updated_at"] = art["updated_at"] + timedelta(seconds=1)
+
+
+def run_upsert(conn, query: str, records: list, batch_size: int) -> dict:
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn();")
+        (lsn_before,) = cur.fetchone()
+    inserted = updated = unchanged = 0
+    start = time.perf_counter()
+    for i in range(0, len(records), batch_size):
+        with conn.cursor() as cur:
+            new_ids, batch_updated, batch_unchanged = upsert_articles(cur, query, records[i:i + batch_size])
+        conn.commit()
+        inserted += len(new_ids)
+        updated += batch_updated
+        unchanged += batch_unchanged
+    seconds = time.perf_counter() - start
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s);", (lsn_before,))
+        (wal_bytes,) = cur.fetchone()
+    return {"seconds": seconds, "wal_bytes": int(wal_bytes), "inserted": inserted,
+            "updated": updated, "unchanged": unchanged}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=_default_dsn(), help="chuỗi kết nối libpq (mặc định PG_DSN hoặc NDH_PG_*)")
+    parser.add_argument("--schema", default="bench_upsert")
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--changed", type=float, default=1.0, help="phần trăm bài thay đổi mỗi vòng")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--keep", action="store_true", help="giữ lại schema benchmark sau khi chạy")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    articles = make_articles(args.articles, args.seed)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SHOW server_version;")
+            print(f"PostgreSQL {cur.fetchone()[0]}, {args.articles} bài, {args.changed}% thay đổi mỗi vòng")
+            cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE;").format(sql.Identifier(args.schema)))
+            queries = {}
+            for mode, skip_unchanged in MODES.items():
+                ensure_article_table(cur, args.schema, mode)
+                queries[mode] = upsert_query(args.schema, mode, skip_unchanged).as_string(conn)
+        conn.commit()
+
+        records = to_records(articles)
+        for mode in MODES:
+            load = run_upsert(conn, queries[mode], records, args.batch_size)
+            print(f"nạp ban đầu {mode:>15}: {load['inserted']} bài, {load['seconds']:.2f}s, "
+                  f"WAL {load['wal_bytes'] / 1e6:.1f} MB")
+
+        results = {mode: [] for mode in MODES}
+        print(f"{'round':>5}{'mode':>16}{'seconds':>10}{'WAL MB':>10}{'new':>8}{'updated':>9}{'unchanged':>11}")
+        for round_no in range(1, args.rounds + 1):
+            mutate(articles, args.changed / 100, rng)
+            records = to_records(articles)
+            # đổi thứ tự chạy mỗi vòng để checkpoint / cache không thiên vị một chế độ
+            order = list(MODES) if round_no % 2 else list(reversed(MODES))
+            for mode in order:
+                result = run_upsert(conn, queries[mode], records, args.batch_size)
+                results[mode].append(result)
+                print(f"{round_no:>5}{mode:>16}{result['seconds']:>10.2f}{result['wal_bytes'] / 1e6:>10.2f}"
+                      f"{result['inserted']:>8}{result['updated']:>9}{result['unchanged']:>11}")
+
+        base_s = statistics.median(r["seconds"] for r in results["overwrite"])
+        base_wal = statistics.median(r["wal_bytes"] for r in results["overwrite"])
+        print("median:")
+        for mode, rounds in results.items():
+            seconds = statistics.median(r["seconds"] for r in rounds)
+            wal = statistics.median(r["wal_bytes"] for r in rounds)
+            print(f"{mode:>16}: {seconds:.2f}s ({base_s / seconds:.1f}x), WAL {wal / 1e6:.2f} MB "
+                  f"({wal / max(base_wal, 1):.1%} của overwrite)")
+    finally:
+        if not args.keep:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE;").format(sql.Identifier(args.schema)))
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
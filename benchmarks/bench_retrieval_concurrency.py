@@ -0,0 +1,115 @@
+"""
+Benchmark tải cho đường tìm kiếm /retrieval.
+
+So sánh đường cũ (gọi `VecterSearchAgent.retrieve` đồng bộ ngay trong coroutine,
+chặn event loop) với đường mới `aretrieve` (embedding async + Milvus chạy trên
+thread pool giới hạn) dưới 1, 10 và 50 client đồng thời.
+
+Milvus và OpenAI embeddings được thay bằng stand-in cục bộ có độ trễ cố định,
+nên kết quả chỉ phản ánh cách xử lý đồng thời của API, không phụ thuộc mạng.
+Ở chế độ blocking, độ trễ từng request trông bình thường nhưng req/s không tăng
+theo số client vì các request bị xử lý tuần tự trên event loop.
+
+Chạy:
+    python benchmarks/bench_retrieval_concurrency.py --embed-ms 40 --search-ms 25
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from agents.agent_vector_search import VecterSearchAgent  # noqa: E402
+
+
+class StandInEmbeddings:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+
+    def embed_query(self, text: str):
+        time.sleep(self.latency_s)
+        return [0.0] * 1024
+
+    async def aembed_query(self, text: str):
+        await asyncio.sleep(self.latency_s)
+        return [0.0] * 1024
+
+
+class StandInMilvusClient:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+
+    def hybrid_search(self, collection_name, reqs, ranker, limit, output_fields, **kwargs):
+        # time.sleep nhả GIL giống như chờ gRPC thật
+        time.sleep(self.latency_s)
+        return [[
+            {"id": i, "distance": 1.0 - i * 0.01, "entity": {"id": i, "text": f"doc {i}", "title": f"title {i}"}}
+            for i in range(limit)
+        ]]
+
+
+class StandInVectorStore:
+    def __init__(self, embed_s: float, search_s: float):
+        self.embeddings = StandInEmbeddings(embed_s)
+        self.client = StandInMilvusClient(search_s)
+        self.collection_name = "bench"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+async def run_load(agent: VecterSearchAgent, mode: str, concurrency: int, requests_per_client: int):
+    latencies = []
+
+    async def call():
+        if mode == "blocking":
+            # đường cũ: hàm đồng bộ gọi thẳng trong coroutine
+            return agent.retrieve("vcc là gì", top_k=2)
+        return await agent.aretrieve("vcc là gì", top_k=2)
+
+    async def client():
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-ms", type=float, default=40.0)
+    parser.add_argument("--search-ms", type=float, default=25.0)
+    parser.add_argument("--requests", type=int, default=20, help="số request mỗi client")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--search-workers", type=int, default=16)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    store = StandInVectorStore(args.embed_ms / 1000, args.search_ms / 1000)
+    agent = VecterSearchAgent(store, search_workers=args.search_workers, max_pending=args.max_pending)
+
+    print(f"{'mode':<10}{'clients':>8}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for mode in ("blocking", "async"):
+        for concurrency in args.concurrency:
+            latencies, elapsed = await run_load(agent, mode, concurrency, args.requests)
+            print(
+                f"{mode:<10}{concurrency:>8}"
+                f"{statistics.median(latencies):>10.1f}"
+                f"{percentile(latencies, 99):>10.1f}"
+                f"{len(latencies) / elapsed:>10.1f}"
+            )
+    agent.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
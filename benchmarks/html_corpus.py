@@ -0,0 +1,101 @@
+"""
+Sinh corpus HTML có cấu trúc giống bài viết trên Người Đồng Hành (đoạn văn có định dạng,
+ảnh dạng `table.table-image` kèm chú thích, div lồng nhau, link tương đối/tuyệt đối,
+URL quá dài, đoạn `&nbsp;`, danh sách, bảng số liệu...) để benchmark và so khớp bộ chuyển đổi.
+
+Corpus sinh ra là tất định theo seed nên có thể dùng làm bộ golden.
+"""
+import random
+from typing import List
+
+WORDS = (
+    "Viettel công trình VCC người đồng hành cán bộ nhân viên dự án hạ tầng viễn thông trạm "
+    "BTS triển khai thi công an toàn lao động chuyển đổi số khách hàng giải pháp năng lượng "
+    "mặt trời tòa nhà văn phòng kỹ thuật đội ngũ chi nhánh tỉnh thành phố tháng năm quý kế hoạch "
+    "doanh thu tăng trưởng phong trào thi đua văn hóa đoàn thanh niên công đoàn sức khỏe"
+).split()
+
+
+def _sentence(rng: random.Random, min_words: int = 8, max_words: int = 30) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice([".", ".", ".", "!", "?"])
+
+
+def _inline(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 4)):
+        text = _sentence(rng)
+        roll = rng.random()
+        if roll < 0.15:
+            text = f"<strong>{text}</strong>"
+        elif roll < 0.25:
+            text = f"<em>{text}</em>"
+        elif roll < 0.35:
+            text = f'<a href="/tin-tuc/doi-song/bai-viet-{rng.randint(1, 99999)}">{text}</a>'
+        elif roll < 0.40:
+            text = f'<a href="https://nguoidonghanh.viettel.vn/{"x" * 320}">{text}</a>'
+        elif roll < 0.45:
+            text = f'<a href="https://www.viettelconstruction.com.vn/trang/{rng.randint(1, 999)}">{text}</a>'
+        parts.append(text)
+    return " ".join(parts)
+
+
+def _image_table(rng: random.Random) -> str:
+    src = rng.choice([
+        f"/uploads/images/{rng.randint(2019, 2025)}/{rng.randint(1, 12):02d}/anh {rng.randint(1, 999)}.jpg",
+        f"https://cdn.nguoidonghanh.viettel.vn/images/{rng.randint(1, 99999)}.png",
+        "/uploads/" + "y" * 400 + ".jpg",
+    ])
+    caption = _sentence(rng, 5, 15)
+    return (
+        '<table class="table-image" align="center"><tbody>'
+        f'<tr><td><img src="{src}" alt="{caption[:20]}" caption="{caption}"></td></tr>'
+        f'<tr><td class="image-caption">{caption}</td></tr>'
+        "</tbody></table>"
+    )
+
+
+def _data_table(rng: random.Random) -> str:
+    rows = "".join(
+        f"<tr><td>{rng.choice(WORDS)}</td><td>{rng.randint(1, 1000)}</td><td>{rng.randint(1, 100)}%</td></tr>"
+        for _ in range(rng.randint(2, 6))
+    )
+    return f"<table><thead><tr><th>Hạng mục</th><th>Số lượng</th><th>Tỷ lệ</th></tr></thead><tbody>{rows}</tbody></table>"
+
+
+def _block(rng: random.Random, depth: int = 0) -> str:
+    roll = rng.random()
+    if roll < 0.45:
+        return f"<p>{_inline(rng)}</p>"
+    if roll < 0.55:
+        return _image_table(rng)
+    if roll < 0.62:
+        return "<p>&nbsp;</p>"
+    if roll < 0.68:
+        src = f"/uploads/images/inline-{rng.randint(1, 999)}.jpg"
+        return f'<p style="text-align:center"><img src="{src}" alt="{rng.choice(WORDS)}"></p><p>{_sentence(rng)}</p>'
+    if roll < 0.74:
+        items = "".join(f"<li>{_sentence(rng, 4, 12)}</li>" for _ in range(rng.randint(2, 5)))
+        tag = rng.choice(["ul", "ol"])
+        return f"<{tag}>{items}</{tag}>"
+    if roll < 0.78:
+        return _data_table(rng)
+    if roll < 0.82:
+        level = rng.randint(2, 4)
+        return f"<h{level}>{_sentence(rng, 3, 10)}</h{level}>"
+    if depth < 2:
+        inner = "".join(_block(rng, depth + 1) for _ in range(rng.randint(1, 4)))
+        return f'<div class="content-block">{inner}</div>'
+    return f"<div>{_inline(rng)}</div>"
+
+
+def generate_article(rng: random.Random, n_blocks: int) -> str:
+    body = "".join(_block(rng) for _ in range(n_blocks))
+    return f'<div class="article-body">{body}</div>'
+
+
+def generate_corpus(n_articles: int = 200, seed: int = 2024, min_blocks: int = 5, max_blocks: int = 60) -> List[str]:
+    """Sinh `n_articles` bài HTML với số khối nội dung trong [min_blocks, max_blocks]."""
+    rng = random.Random(seed)
+    return [generate_article(rng, rng.randint(min_blocks, max_blocks)) for _ in range(n_articles)]
@@ -1,15 +1,131 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import random
 import sys
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from modules.tracing import current_trace_id
+
+# Đánh dấu log chứa dữ liệu lớn (vd các dòng DATA của SQL) để được lấy mẫu / cắt bớt:
+#   logger.info("DATA: %s", rows, extra=PAYLOAD)
+# Dùng tham số %s thay vì f-string để bản ghi bị bỏ qua khi lấy mẫu không tốn công format.
+PAYLOAD = {"payload": True}
+
+# listener đang chạy theo tên logger, dừng lại khi setup_logging được gọi lại hoặc khi thoát process
+_listeners: Dict[str, Tuple[QueueListener, "_BoundedQueueHandler"]] = {}
+
+
+class _ContextFilter(logging.Filter):
+    """Gắn trace id của request hiện tại (nếu tracing bật), lấy mẫu và cắt bớt các log payload.
+    Chạy ở thread ghi log, trước khi bản ghi được format / đưa vào hàng đợi."""
+
+    def __init__(self, payload_sample_ratio: float = 1.0, payload_max_chars: Optional[int] = None):
+        super().__init__()
+        self.payload_sample_ratio = payload_sample_ratio
+        self.payload_max_chars = payload_max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "payload", False):
+            if random.random() >= self.payload_sample_ratio:
+                return False
+            message = record.getMessage()
+            if self.payload_max_chars and len(message) > self.payload_max_chars:
+                record.msg = f"{message[:self.payload_max_chars]}... (+{len(message) - self.payload_max_chars} ký tự)"
+                record.args = None
+        if not hasattr(record, "trace_id"):
+            record.trace_id = current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi một dòng JSON: ts, level, logger, file:line, message, trace_id, exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "source": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _BoundedQueueHandler(QueueHandler):
+    """QueueHandler với hàng đợi có giới hạn: khi console / ổ đĩa ghi chậm và hàng đợi đầy thì bỏ bản ghi
+    (đếm ở `dropped`) thay vì chặn request."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # chỉ ghép message (tham số có thể bị thay đổi sau khi trả về) và traceback ở đây;
+        # định dạng (text / JSON) do các handler của listener đảm nhận
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _stop_listener(logger_name: str) -> None:
+    entry = _listeners.pop(logger_name, None)
+    if entry is not None:
+        listener, queue_handler = entry
+        listener.stop()
+        if queue_handler.dropped:
+            sys.stderr.write(f"{logger_name}: đã bỏ {queue_handler.dropped} bản ghi log do hàng đợi đầy\n")
+
+
+def _stop_all_listeners() -> None:
+    for logger_name in list(_listeners):
+        _stop_listener(logger_name)
+
+
+atexit.register(_stop_all_listeners)
+
+
+def logging_options(log_cfg: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Tham số cho setup_logging lấy từ mục `logging` của config."""
+    log_cfg = log_cfg or {}
+    return {
+        "level": log_cfg.get("level", "INFO"),
+        "json_format": log_cfg.get("json", False),
+        "queue_size": log_cfg.get("queue_size", 0) if log_cfg.get("async", False) else 0,
+        "payload_sample_ratio": log_cfg.get("payload_sample_ratio", 1.0),
+        "payload_max_chars": log_cfg.get("payload_max_chars"),
+    }
 
 
 def setup_logging(
     logger_name: str = "AppLogger",
     log_dir: str = "logs",
     filename_prefix: str = "app",
-    level: str = "INFO"
+    level: str = "INFO",
+    json_format: bool = False,
+    queue_size: int = 0,
+    payload_sample_ratio: float = 1.0,
+    payload_max_chars: Optional[int] = None,
 ) -> logging.Logger:
     """
     Thiết lập logging đơn giản và tái sử dụng được.
@@ -24,6 +140,15 @@ def setup_logging(
         Tiền tố tên file log.
     level : str
         Mức độ log: DEBUG, INFO, WARNING, ERROR, CRITICAL.
+    json_format : bool
+        Ghi mỗi bản ghi thành một dòng JSON (kèm trace_id của request nếu tracing bật).
+    queue_size : int
+        > 0: ghi log bất đồng bộ, request chỉ đưa bản ghi vào hàng đợi có giới hạn này, một thread nền
+        (QueueListener) ghi ra console / file; hàng đợi đầy thì bỏ bản ghi. 0: ghi trực tiếp như trước.
+    payload_sample_ratio : float
+        Tỉ lệ giữ lại các log payload (đánh dấu bằng extra=PAYLOAD).
+    payload_max_chars : int, optional
+        Cắt bớt log payload dài hơn số ký tự này.
 
     Returns
     -------
@@ -42,19 +167,23 @@ def setup_logging(
         "%(asctime)s - %(levelname)s - %(name)s - "
         "%(filename)s:%(lineno)d - %(message)s"
     )
-    formatter = logging.Formatter(log_format)
+    formatter = JsonFormatter() if json_format else logging.Formatter(log_format)
 
     logger = logging.getLogger(logger_name)
     logger.setLevel(log_level)
     logger.propagate = False
 
+    _stop_listener(logger_name)
     if logger.hasHandlers():
         logger.handlers.clear()
+    for old_filter in [f for f in logger.filters if isinstance(f, _ContextFilter)]:
+        logger.removeFilter(old_filter)
+    # filter gắn ở logger để mỗi bản ghi chỉ được lấy mẫu một lần cho cả console và file
+    logger.addFilter(_ContextFilter(payload_sample_ratio, payload_max_chars))
 
     # Console
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
 
     # File
     file_handler = TimedRotatingFileHandler(
@@ -66,7 +195,16 @@ def setup_logging(
     )
     file_handler.suffix = "%Y-%m-%d.log"
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    if queue_size > 0:
+        queue_handler = _BoundedQueueHandler(queue.Queue(maxsize=queue_size))
+        logger.addHandler(queue_handler)
+        listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+        listener.start()
+        _listeners[logger_name] = (listener, queue_handler)
+    else:
+        logger.addHandler(console_handler)
+        logger.addHandler(file_handler)
 
     logger.info("Logger initialized.")
     return logger
@@ -1,30 +1,45 @@
 from __future__ import annotations
-import json
 import os
+import queue
+import threading
 import time
 import logging
-from typing import Any, Dict, List, Tuple
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
 from dotenv import load_dotenv
 from pathlib import Path
 import schedule
 import pymysql
 import psycopg2
 from psycopg2 import sql, extras
-from psycopg2.extras import Json, execute_values
+from psycopg2.extras import Json
 
-from configs.logging_config import setup_logging
+from configs.logging_config import logging_options, setup_logging
 from configs.config import load_config
+from modules.article_store import COLS, ensure_article_table, to_index_item, upsert_articles, upsert_query
+from modules.category_tree import CategoryTreeCache
+from modules.chunker import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE
 from modules.indexer import IndexService
+from modules.metrics import SYNC_DOCS, SYNC_DOCS_PER_SEC, SYNC_RUN_MS, export_snapshot
+from modules.retrieval_cache import DEFAULT_GENERATION_FILE, invalidate_retrieval_cache
+from modules.sync_state import content_hash, load_sync_state, save_sync_state
 
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"), override=False)
 
-logger = setup_logging(logger_name="db_sync_ndh", filename_prefix="db_sync_ndh")
 cfg = load_config()
+logger = setup_logging(logger_name="db_sync_ndh", filename_prefix="db_sync_ndh", **logging_options(cfg.get("logging")))
 
 indexservice = IndexService(
     cfg["vector_db"].get("uri"),
     collection_name=cfg["vector_db"].get("collection_name"),
     API_KEY=cfg["llm"].get("openai_api_key"),
+    embedding_cache=cfg.get("embedding_cache"),
+    convert_workers=cfg.get("indexing", {}).get("convert_workers", 1),
+    convert_chunksize=cfg.get("indexing", {}).get("convert_chunksize", 16),
+    chunk_size=cfg.get("indexing", {}).get("chunk_size", DEFAULT_CHUNK_SIZE),
+    chunk_overlap=cfg.get("indexing", {}).get("chunk_overlap", DEFAULT_CHUNK_OVERLAP),
+    vector_index=cfg["vector_db"].get("index"),
 )
 
 
@@ -53,65 +68,17 @@ TABLE_NAME = "data_ndh"
 # --------------------------------------------------
 # Câu lệnh lấy bài viết từ MariaDB
 # --------------------------------------------------
+# Quét thẳng bảng bài viết; link và tên chuyên mục được ghép trong Python từ cây chuyên mục đã cache
+# (modules/category_tree.py) thay vì CTE đệ quy leo cây chuyên mục cho từng bài ở mỗi lần chạy.
 ARTICLE_QUERY = """
-
-WITH RECURSIVE related AS (                 
-    SELECT DISTINCT related_article_id AS id
-    FROM   db_nguoidonghanh.vtp_article_related
-),
-
-article_base AS (                           
-    SELECT a.id,
-           a.slug,
-           c.id        AS category_id,
-           c.parent_id,
-           c.slug      AS cat_slug,
-           1           AS level
-    FROM   vtp_article  a
-    JOIN   vtp_category c  ON a.category_id = c.id
-    LEFT JOIN   related      r  ON r.id = a.id
-),
-category_path AS (                          
-    SELECT id          AS article_id,
-           category_id,
-           parent_id,
-           cat_slug     AS slug,
-           level
-    FROM   article_base
-    UNION ALL
-    SELECT cp.article_id,
-           p.id, p.parent_id, p.slug,
-           cp.level + 1
-    FROM   vtp_category p
-    JOIN   category_path cp ON cp.parent_id = p.id
-),
-slug_root AS (                              -- slug gốc (không cha)
-    SELECT article_id,
-           slug AS root_slug
-    FROM   category_path
-    WHERE  parent_id IS NULL
-),
-slug_leaf AS (                              -- slug lá (sâu nhất)
-    SELECT article_id,
-           slug AS leaf_slug
-    FROM (
-        SELECT article_id,
-               slug,
-               ROW_NUMBER() OVER (PARTITION BY article_id ORDER BY level ASC) AS rn
-        FROM   category_path
-    ) t
-    WHERE  rn = 1
-)
-
-/* ---------- Trả kết quả ---------- */
 SELECT
-	a.id,
-    c.name  AS category_name,
+    a.id,
+    a.category_id,
+    a.slug,
     a.title,
     a.header,
     a.body,
     a.author,
-    CONCAT('https://nguoidonghanh.viettel.vn/', sr.root_slug, '/', sl.leaf_slug, '/', a.slug) AS link,
     a.is_comment,
     a.is_active,
     a.is_hot,
@@ -124,304 +91,394 @@ SELECT
     a.hit_count,
     a.created_at,
     a.updated_at,
-    a.published_time,
-
-    /* --------- Cột JSON thu gọn --------- */
-	JSON_OBJECT(
-	    'id',   a.id,
-	    'title', a.title,
-	    'link', CONCAT('https://nguoidonghanh.viettel.vn/',
-	                   sr.root_slug, '/', sl.leaf_slug, '/', a.slug)
-	) AS article_json
-
-FROM   vtp_article  a
-JOIN   vtp_category c  ON c.id          = a.category_id
-JOIN   slug_root    sr ON sr.article_id = a.id
-JOIN   slug_leaf    sl ON sl.article_id = a.id
-WHERE a.published_time IS NOT NULL AND  a.is_delete = 0;
+    a.published_time
+FROM   vtp_article a
+WHERE  a.published_time IS NOT NULL AND a.is_delete = 0 {id_filter}
 """
 
+# Bài liên quan (chỉ tiêu đề + slug + chuyên mục để ghép link)
 RELATED_QUERY = """
-WITH RECURSIVE
-/* 1️⃣  Bảng quan hệ gốc, bỏ bản ghi trùng */
-related_full AS (
-    SELECT DISTINCT               -- MariaDB cho phép DISTINCT
-           r.article_id      AS parent_id,
-           r.related_article_id AS id
-    FROM   vtp_article_related r
-),
-
-/* 2️⃣  Thông tin tối thiểu của bài liên quan */
-article_base AS (
-    SELECT  a.id,
-            a.title,
-            a.slug,
-            c.id        AS category_id,
-            c.parent_id,
-            c.slug      AS cat_slug,
-            1           AS level
-    FROM    vtp_article a
-    JOIN    vtp_category c ON a.category_id = c.id
-    JOIN    related_full  rf ON rf.id = a.id
-),
-
-/* 3️⃣  Truy vết cây chuyên mục */
-category_path AS (
-    -- gốc (level = 1)
-    SELECT  id AS article_id,
-            category_id,
-            parent_id,
-            cat_slug AS slug,
-            level
-    FROM    article_base
-
-    UNION ALL
-
-    -- leo lên cha
-    SELECT  cp.article_id,
-            p.id           AS category_id,
-            p.parent_id,
-            p.slug,
-            cp.level + 1
-    FROM    vtp_category  p
-    JOIN    category_path cp ON cp.parent_id = p.id
-),
-
-/* 4️⃣  Slug gốc (cha = NULL) – chọn 1 slug duy nhất bằng MIN() */
-slug_root AS (
-    SELECT  cp.article_id,
-            MIN(cp.slug) AS root_slug        -- bảo đảm chỉ 1 hàng/article
-    FROM    category_path cp
-    WHERE   cp.parent_id IS NULL
-    GROUP BY cp.article_id
-),
-
-/* 5️⃣  Slug lá sâu nhất – lấy slug ở độ sâu MAX(level) */
-slug_leaf AS (
-    SELECT  cp.article_id,
-            cp.slug AS leaf_slug
-    FROM    category_path cp
-    JOIN (
-        SELECT  article_id, MAX(level) AS max_level
-        FROM    category_path
-        GROUP BY article_id
-    ) mx ON mx.article_id = cp.article_id
-        AND mx.max_level  = cp.level
-)
-
-/*--------------------------------------------------
- 6️⃣  Kết quả cuối – DISTINCT bảo đảm không trùng
---------------------------------------------------*/
 SELECT DISTINCT
-       rf.parent_id AS article_id,
-       a.id         AS related_id,
-       a.title      AS related_title,
-       CASE
-           WHEN sr.root_slug <> sl.leaf_slug THEN
-               CONCAT('https://nguoidonghanh.viettel.vn/',
-                      sr.root_slug, '/', sl.leaf_slug, '/', a.slug)
-           ELSE
-               CONCAT('https://nguoidonghanh.viettel.vn/tin-tuc/',
-                      sl.leaf_slug, '/', a.slug)
-       END AS related_link
-FROM   related_full rf
-JOIN   vtp_article  a  ON a.id = rf.id
-JOIN   slug_root    sr ON sr.article_id = a.id
-JOIN   slug_leaf    sl ON sl.article_id = a.id
-ORDER BY rf.parent_id DESC
+       r.article_id,
+       a.id          AS related_id,
+       a.title       AS related_title,
+       a.slug,
+       a.category_id
+FROM   vtp_article_related r
+JOIN   vtp_article         a ON a.id = r.related_article_id
+WHERE  1 = 1 {id_filter}
+ORDER BY r.article_id DESC, a.id
 """
 
-COLS: Tuple[str, ...] = (
-    "id",
-    "link",
-    "category_name",
-    "title",
-    "header",
-    "body",
-    "author",
-    "is_comment",
-    "is_active",
-    "is_hot",
-    "is_important",
-    "is_top",
-    "has_video",
-    "comment_count",
-    "like_count",
-    "dislike_count",
-    "hit_count",
-    "created_at",
-    "updated_at",
-    "published_time",
-    "article_json",  # list[dict]
-)
-# --------------------------------------------------
-# Hàm đồng bộ
-# --------------------------------------------------
-def sync_articles() -> None:
-    """Main scheduled job."""
-
-    logger.info("🔄  Bắt đầu đồng bộ …")
+# Bài viết mới / sửa kể từ checkpoint (kèm thời điểm thay đổi để tiến checkpoint)
+CHANGED_ARTICLES_QUERY = """
+SELECT id, GREATEST(created_at, COALESCE(updated_at, created_at)) AS changed_at
+FROM   vtp_article
+WHERE  (updated_at >= %(since)s OR created_at >= %(since)s)
+  AND  published_time IS NOT NULL AND is_delete = 0
+"""
 
-    # 1️⃣  Read main articles + related links from MariaDB
-    with pymysql.connect(**MARIADB_CONFIG) as mariadb_conn, mariadb_conn.cursor() as cur:
-        cur.execute(ARTICLE_QUERY)
-        articles: List[Dict[str, Any]] = cur.fetchall()
+# id các bài còn hiệu lực (cùng điều kiện với ARTICLE_QUERY), dùng để dọn bài đã xóa / bỏ xuất bản
+LIVE_ARTICLE_IDS_QUERY = """
+SELECT id, category_id
+FROM   vtp_article
+WHERE  published_time IS NOT NULL AND is_delete = 0
+"""
 
-        if not articles:
-            logger.info("⏭️  Không có bản ghi bài viết nào được trả về, bỏ qua.")
+DB_SYNC_CFG = cfg.get("db_sync", {})
+# giữ giữa các lần chạy theo lịch của process
+category_cache = CategoryTreeCache()
+# số bài đọc từ MariaDB / ghi vào PostgreSQL mỗi lô, và số lô được đọc trước trong lúc lô hiện tại đang ghi
+STREAM_BATCH_SIZE = DB_SYNC_CFG.get("stream_batch_size", 500)
+PREFETCH_BATCHES = DB_SYNC_CFG.get("prefetch_batches", 2)
+# con trỏ unbuffered giữ kết quả trên MariaDB cho tới khi đọc hết: nới timeout phía server phòng khi ghi chậm
+NET_WRITE_TIMEOUT = DB_SYNC_CFG.get("net_write_timeout", 600)
+# đồng bộ tăng dần theo checkpoint updated_at/created_at của MariaDB
+STATE_FILE = DB_SYNC_CFG.get("state_file", "cache/db_sync_state.json")
+SYNC_INTERVAL_MINUTES = DB_SYNC_CFG.get("interval_minutes", 1)
+# đọc lùi thêm một khoảng trước checkpoint để không sót bản ghi commit trễ / lệch đồng hồ
+LOOKBACK_MINUTES = DB_SYNC_CFG.get("lookback_minutes", 10)
+# quét toàn bộ định kỳ: bắt các thay đổi không làm đổi updated_at (bài liên quan, chuyên mục, lượt xem...)
+FULL_SWEEP_INTERVAL_MINUTES = DB_SYNC_CFG.get("full_sweep_interval_minutes", 360)
+# metrics của mỗi lần chạy được ghi ra <metrics.snapshot_dir>/db_sync.json để /metrics của retrieval_app đọc
+METRICS_SNAPSHOT_DIR = cfg.get("metrics", {}).get("snapshot_dir", "cache/metrics")
+# dọn bài đã xóa ở mỗi lần quét toàn bộ: số id mỗi lệnh DELETE của PostgreSQL / số bài mỗi biểu thức xóa của Milvus
+RECONCILE_PG_BATCH_SIZE = DB_SYNC_CFG.get("reconcile_pg_batch_size", 1000)
+RECONCILE_VDB_BATCH_SIZE = DB_SYNC_CFG.get("reconcile_vdb_batch_size", 100)
+# không xóa nếu số bài cần xóa vượt tỉ lệ này (truy vấn nguồn trả thiếu do sự cố sẽ không xóa sạch dữ liệu)
+RECONCILE_MAX_DELETE_RATIO = DB_SYNC_CFG.get("reconcile_max_delete_ratio", 0.2)
+
+
+def _fetch_batches(cur, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
             return
+        yield rows
 
-        cur.execute(RELATED_QUERY)
-        related_rows: List[Dict[str, Any]] = cur.fetchall()
-
-    # Build map {article_id: [ {title, link}, … ] }
-    related_map: Dict[int, List[Dict[str, str]]] = {}
-    for r in related_rows:
-        related_map.setdefault(r["article_id"], []).append(
-            {"title": r["related_title"], "link": r["related_link"]}
-        )
 
-    # Merge JSON + collect records for PG insert
-    records: List[Tuple[Any, ...]] = []
-    for art in articles:
-        art["article_json"] = Json(related_map.get(art["id"], []))
-        records.append(tuple(art[col] for col in COLS))
+def _prefetch(batches: Iterator[Any], depth: int) -> Iterator[Any]:
+    """Chạy `batches` ở thread nền, giữ tối đa `depth` lô chờ xử lý để đọc và ghi chạy song song
+    mà bộ nhớ vẫn bị chặn trên."""
+    buffer: queue.Queue = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
 
-    incoming_ids = [rec[0] for rec in records]  # list[int]
+    def put(item) -> None:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
 
-    # 2️⃣  Upsert into PostgreSQL
-    with psycopg2.connect(**POSTGRES_CONFIG) as pg_conn, pg_conn.cursor() as cur:
-        # 2.1 – ensure schema / table
-        cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {};").format(sql.Identifier(SCHEMA_NAME)))
-        cur.execute(
-            sql.SQL(
-                """
-                CREATE TABLE IF NOT EXISTS {}.{} (
-                    id              INTEGER      PRIMARY KEY,
-                    link            TEXT,
-                    category_name   TEXT,
-                    title           TEXT,
-                    header          TEXT,
-                    body            TEXT,
-                    author          TEXT,
-                    is_comment      INTEGER,
-                    is_active       INTEGER,
-                    is_hot          INTEGER,
-                    is_important    INTEGER,
-                    is_top          INTEGER,
-                    has_video       INTEGER,
-                    comment_count   INTEGER,
-                    like_count      INTEGER,
-                    dislike_count   INTEGER,
-                    hit_count       INTEGER,
-                    created_at      TIMESTAMPTZ,
-                    updated_at      TIMESTAMPTZ,
-                    published_time  TIMESTAMPTZ,
-                    article_json    JSONB
-                );
-                """
-            ).format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME))
+    def produce() -> None:
+        try:
+            for batch in batches:
+                put(batch)
+                if stop.is_set():
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    worker = threading.Thread(target=produce, name="mariadb_reader", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # consumer dừng sớm (lỗi / đóng generator): chờ thread đọc thoát trước khi đóng kết nối MariaDB
+        stop.set()
+        worker.join()
+
+
+def index_new_articles(pg_conn, new_ids: List[int]) -> None:
+    """Đẩy các bài viết mới vào vector store, đọc lại từ PostgreSQL theo từng lô để bộ nhớ không phụ thuộc số bài."""
+    indexing_cfg = cfg.get("indexing", {})
+    inserted = failed = 0
+    seconds = 0.0
+    with pg_conn.cursor(cursor_factory=extras.RealDictCursor) as cur:
+        for start in range(0, len(new_ids), STREAM_BATCH_SIZE):
+            batch_ids = new_ids[start:start + STREAM_BATCH_SIZE]
+            cur.execute(
+                sql.SQL("SELECT {} FROM {}.{} WHERE id = ANY(%s) ORDER BY id;").format(
+                    sql.SQL(", ").join(map(sql.Identifier, COLS[:-1])),
+                    sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME),
+                ),
+                (batch_ids,),
+            )
+            # chuyển HTML -> Markdown song song trên process pool
+            documents = indexservice.load_many_html_to_markdown([to_index_item(art) for art in cur.fetchall()])
+            # upsert thay vì insert: vdb_ndh_sync (bài có ở PostgreSQL mà chưa có trong Milvus) hoặc lần bù sau khi
+            # đổi alias của rebuild_collection có thể đã ghi bài này trước, Milvus không chống trùng khóa khi insert
+            report = indexservice.store_articles(
+                documents,
+                batch_size=indexing_cfg.get("batch_size", 64),
+                max_workers=indexing_cfg.get("embed_workers", 4),
+                max_retries=indexing_cfg.get("max_retries", 5),
+                replace=True,
+            )
+            inserted += report["inserted"]
+            failed += report["failed"]
+            seconds += report["seconds"]
+    SYNC_DOCS.inc(inserted, sync="db_sync", result="indexed")
+    SYNC_DOCS.inc(failed, sync="db_sync", result="index_failed")
+    if seconds > 0:
+        SYNC_DOCS_PER_SEC.set(inserted / seconds, sync="db_sync")
+    logger.info("✅ Đã đồng bộ %d/%d bản ghi mới vào Vector Store.", inserted, len(new_ids))
+    if inserted:
+        invalidate_retrieval_cache(cfg.get("retrieval_cache", {}).get("generation_file", DEFAULT_GENERATION_FILE))
+
+
+def reconcile_deletions(cur, pg_conn, tree) -> Dict[str, Any]:
+    """Xóa khỏi PostgreSQL và vector store các bài không còn hiệu lực ở MariaDB
+    (đã xóa, bỏ xuất bản hoặc không còn xác định được cây chuyên mục).
+
+    Mỗi nguồn được quét id hàng loạt đúng một lần (MariaDB bằng con trỏ unbuffered, PostgreSQL bằng
+    con trỏ phía server, Milvus bằng query_iterator chỉ lấy khóa chính), phần chênh lệch được tính bằng
+    hiệu tập hợp rồi xóa theo lô. Bỏ qua cả lượt nếu số bài cần xóa vượt `db_sync.reconcile_max_delete_ratio`.
+
+    Returns thống kê: live, postgres, vector_store, postgres_deleted, vector_deleted, vector_failed, seconds
+    (hoặc thêm aborted=True nếu lượt dọn bị bỏ qua).
+    """
+    start = time.perf_counter()
+    cur.execute(LIVE_ARTICLE_IDS_QUERY)
+    live_ids = set()
+    for rows in _fetch_batches(cur, STREAM_BATCH_SIZE * 10):
+        live_ids.update(row["id"] for row in rows if tree.path(row["category_id"]) is not None)
+    with pg_conn.cursor(name="reconcile_article_ids") as pg_cur:
+        pg_cur.itersize = RECONCILE_PG_BATCH_SIZE * 10
+        pg_cur.execute(sql.SQL("SELECT id FROM {}.{};").format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)))
+        pg_ids = {row[0] for row in pg_cur}
+    pg_conn.commit()
+    vdb_ids = indexservice.scan_article_ids()
+
+    stale_pg = sorted(pg_ids - live_ids)
+    stale_vdb = sorted(vdb_ids - live_ids)
+    report: Dict[str, Any] = {
+        "live": len(live_ids), "postgres": len(pg_ids), "vector_store": len(vdb_ids),
+        "postgres_deleted": 0, "vector_deleted": 0, "vector_failed": 0,
+    }
+    stale = len(set(stale_pg) | set(stale_vdb))
+    if stale > RECONCILE_MAX_DELETE_RATIO * len(pg_ids | vdb_ids):
+        logger.info(
+            f"⚠️  Bỏ qua dọn bài viết đã xóa: {stale}/{len(pg_ids | vdb_ids)} bài cần xóa vượt ngưỡng "
+            f"{RECONCILE_MAX_DELETE_RATIO:.0%} ({len(live_ids)} bài còn hiệu lực ở MariaDB)"
         )
-
-        # 2.2 – fetch existing ids
+        report.update(aborted=True, seconds=time.perf_counter() - start)
+        return report
+
+    delete_query = sql.SQL("DELETE FROM {}.{} WHERE id = ANY(%s);").format(
+        sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)
+    )
+    with pg_conn.cursor() as pg_cur:
+        for offset in range(0, len(stale_pg), RECONCILE_PG_BATCH_SIZE):
+            pg_cur.execute(delete_query, (stale_pg[offset:offset + RECONCILE_PG_BATCH_SIZE],))
+            report["postgres_deleted"] += pg_cur.rowcount
+            pg_conn.commit()
+    if stale_vdb:
+        failed = indexservice.delete_articles(stale_vdb, batch_size=RECONCILE_VDB_BATCH_SIZE)
+        report["vector_deleted"] = len(stale_vdb) - len(failed)
+        report["vector_failed"] = len(failed)
+    SYNC_DOCS.inc(report["postgres_deleted"], sync="db_sync", result="deleted_postgres")
+    SYNC_DOCS.inc(report["vector_deleted"], sync="db_sync", result="deleted_vector_store")
+    if report["vector_deleted"]:
+        invalidate_retrieval_cache(cfg.get("retrieval_cache", {}).get("generation_file", DEFAULT_GENERATION_FILE))
+    report["seconds"] = time.perf_counter() - start
+    logger.info(
+        f"🧹 Dọn bài viết đã xóa / bỏ xuất bản: {report['live']} bài còn hiệu lực, "
+        f"xóa {report['postgres_deleted']}/{len(pg_ids)} ở PostgreSQL, "
+        f"{report['vector_deleted']}/{len(vdb_ids)} ở vector store (lỗi: {report['vector_failed']}) "
+        f"trong {report['seconds']:.1f}s"
+    )
+    return report
+
+
+def _full_sweep_due(state: Dict[str, Any]) -> bool:
+    last_full_sweep = state.get("last_full_sweep")
+    if not state.get("checkpoint") or not last_full_sweep:
+        return True
+    elapsed = datetime.now() - datetime.fromisoformat(last_full_sweep)
+    return elapsed.total_seconds() >= FULL_SWEEP_INTERVAL_MINUTES * 60
+
+
+def sync_articles(full: bool | None = None) -> None:
+    """Main scheduled job.
+
+    Tăng dần (mặc định): chỉ đọc các bài có `updated_at`/`created_at` >= checkpoint - `db_sync.lookback_minutes`
+    (checkpoint = thời điểm thay đổi lớn nhất đã đồng bộ, lưu ở `db_sync.state_file`), truy vấn bài
+    liên quan chỉ chạy trên các bài đó. Quét toàn bộ khi `full=True`, khi chưa có checkpoint hoặc đã quá
+    `db_sync.full_sweep_interval_minutes` kể từ lần quét toàn bộ gần nhất.
+
+    Đọc bài viết từ MariaDB bằng con trỏ unbuffered (SSDictCursor) theo lô `db_sync.stream_batch_size`,
+    mỗi lô được ghép link / tên chuyên mục từ cây chuyên mục trong bộ nhớ (chỉ nạp lại khi checksum
+    `vtp_category` đổi) và JSON liên quan rồi UPSERT ngay vào PostgreSQL (commit theo lô) trong khi thread nền
+    đọc sẵn lô kế tiếp; sau đó bài mới được đọc lại từ PostgreSQL theo lô để đẩy vào vector store.
+    Bộ nhớ chỉ phụ thuộc kích thước lô, không phụ thuộc tổng số bài viết.
+    """
+
+    state = load_sync_state(STATE_FILE)
+    if full is None:
+        full = _full_sweep_due(state)
+    started_at = datetime.now()
+    checkpoint = datetime.fromisoformat(state["checkpoint"]) if state.get("checkpoint") else None
+
+    with pymysql.connect(**MARIADB_CONFIG) as mariadb_conn, \
+            mariadb_conn.cursor(pymysql.cursors.SSDictCursor) as cur, \
+            psycopg2.connect(**POSTGRES_CONFIG) as pg_conn:
+
+        # 0️⃣  Tăng dần: lấy id các bài thay đổi từ checkpoint (trừ lookback)
+        query_args = None
+        id_filter = {"id_filter": ""}
+        latest_change = None
+        if full:
+            logger.info("🔄  Bắt đầu đồng bộ toàn bộ …")
+        else:
+            since = checkpoint - timedelta(minutes=LOOKBACK_MINUTES)
+            cur.execute(CHANGED_ARTICLES_QUERY, {"since": since})
+            changed = list(cur)
+            if not changed:
+                logger.info(f"⏭️  Không có bài viết nào thay đổi từ {since.isoformat()}, bỏ qua.")
+                return
+            logger.info(f"🔄  Bắt đầu đồng bộ {len(changed)} bài viết thay đổi từ {since.isoformat()} …")
+            query_args = {"ids": tuple(row["id"] for row in changed)}
+            latest_change = max((row["changed_at"] for row in changed if row["changed_at"]), default=None)
+            id_filter = {"id_filter": "AND a.id IN %(ids)s"}
+
+        # 1️⃣  Cây chuyên mục (chỉ đọc lại khi vtp_category thay đổi) + related links -> map {article_id: [ {title, link}, … ] }
+        tree = category_cache.get(cur)
         cur.execute(
-            sql.SQL("SELECT id FROM {}.{} WHERE id = ANY(%s);").format(
-                sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)
-            ),
-            (incoming_ids,),
+            RELATED_QUERY.format(id_filter="AND r.article_id IN %(ids)s" if query_args else ""),
+            query_args,
         )
-        existing: set[int] = {row[0] for row in cur.fetchall()}
-
-        new_articles = [a for a in articles if a["id"] not in existing]
-
-        logger.info(f"🆕 Đang đồng bộ {len(records)} bài viết, trong đó có {len(new_articles)} bài viết mới!", )
-
-        insert_query = sql.SQL(
-            """
-            INSERT INTO {}.{} (
-                id, link, category_name, title, header, body, author,
-                is_comment, is_active, is_hot, is_important, is_top, has_video,
-                comment_count, like_count, dislike_count, hit_count,
-                created_at, updated_at, published_time, article_json
-            ) VALUES %s
-            ON CONFLICT (id) DO UPDATE SET
-                link           = EXCLUDED.link,
-                category_name  = EXCLUDED.category_name,
-                title          = EXCLUDED.title,
-                header         = EXCLUDED.header,
-                body           = EXCLUDED.body,
-                author         = EXCLUDED.author,
-                is_comment     = EXCLUDED.is_comment,
-                is_active      = EXCLUDED.is_active,
-                is_hot         = EXCLUDED.is_hot,
-                is_important   = EXCLUDED.is_important,
-                is_top         = EXCLUDED.is_top,
-                has_video      = EXCLUDED.has_video,
-                comment_count  = EXCLUDED.comment_count,
-                like_count     = EXCLUDED.like_count,
-                dislike_count  = EXCLUDED.dislike_count,
-                hit_count      = EXCLUDED.hit_count,
-                created_at     = EXCLUDED.created_at,
-                updated_at     = EXCLUDED.updated_at,
-                published_time = EXCLUDED.published_time,
-                article_json   = EXCLUDED.article_json;
-            """
-        ).format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME))
+        related_map: Dict[int, List[Dict[str, str]]] = {}
+        for r in cur:
+            if tree.path(r["category_id"]) is None:
+                continue
+            related_map.setdefault(r["article_id"], []).append(
+                {"title": r["related_title"], "link": tree.related_link(r["category_id"], r["slug"])}
+            )
 
+        # 2️⃣  Ensure schema / table
+        with pg_conn.cursor() as pg_cur:
+            ensure_article_table(pg_cur, SCHEMA_NAME, TABLE_NAME)
+        pg_conn.commit()
+
+        # 3️⃣  Stream main articles: MariaDB -> transform -> UPSERT PostgreSQL theo lô
+        cur.execute(f"SET SESSION net_write_timeout = {int(NET_WRITE_TIMEOUT)}")
+        cur.execute(ARTICLE_QUERY.format(**id_filter), query_args)
+        insert_query = upsert_query(SCHEMA_NAME, TABLE_NAME).as_string(pg_conn)
+        total = updated = unchanged = skipped = 0
+        new_ids: List[int] = []
+        batches = _prefetch(_fetch_batches(cur, STREAM_BATCH_SIZE), PREFETCH_BATCHES)
         try:
-            execute_values(cur, insert_query.as_string(pg_conn), records, page_size=1000)
-            logger.info("✅ Đồng bộ xong %d bản ghi vào PostgreSQL.", len(records))
-        except Exception:
-            logger.info("⭕ Lỗi khi UPSERT vào PostgreSQL")
+            for articles in batches:
+                # Merge JSON + collect records for PG insert
+                records: List[Tuple[Any, ...]] = []
+                for art in articles:
+                    if tree.path(art["category_id"]) is None:
+                        skipped += 1
+                        continue
+                    art["category_name"] = tree.name(art["category_id"])
+                    art["link"] = tree.article_link(art["category_id"], art["slug"])
+                    related = related_map.get(art["id"], [])
+                    art["content_hash"] = content_hash([art[col] for col in COLS[:-2]] + [related])
+                    art["article_json"] = Json(related)
+                    records.append(tuple(art[col] for col in COLS))
+
+                with pg_conn.cursor() as pg_cur:
+                    batch_new_ids, batch_updated, batch_unchanged = upsert_articles(pg_cur, insert_query, records)
+                pg_conn.commit()
+                total += len(records)
+                updated += batch_updated
+                unchanged += batch_unchanged
+                for art in articles:
+                    for changed_at in (art["created_at"], art["updated_at"]):
+                        if changed_at and (checkpoint is None or changed_at > checkpoint):
+                            checkpoint = changed_at
+                new_ids.extend(batch_new_ids)
+                logger.info(
+                    f"📦 PostgreSQL: {total} bài viết, {len(new_ids)} mới / {updated} cập nhật / {unchanged} không đổi"
+                )
+        except Exception as e:
+            pg_conn.rollback()
+            logger.info(f"⭕ Lỗi khi UPSERT vào PostgreSQL: {e}")
             return  # skip vector‑store step if DB failed
+        finally:
+            batches.close()
+        if skipped:
+            logger.info(f"⚠️  Bỏ qua {skipped} bài viết không xác định được cây chuyên mục.")
+        for result, count in (("new", len(new_ids)), ("updated", updated), ("unchanged", unchanged), ("skipped", skipped)):
+            SYNC_DOCS.inc(count, sync="db_sync", result=result)
+
+        # PostgreSQL đã cập nhật xong: tiến checkpoint
+        if latest_change is not None and (checkpoint is None or latest_change > checkpoint):
+            checkpoint = latest_change
+        if checkpoint is not None:
+            state["checkpoint"] = checkpoint.isoformat()
+        if full:
+            state["last_full_sweep"] = started_at.isoformat()
+        save_sync_state(STATE_FILE, state)
+
+        # 3️⃣b Quét toàn bộ: dọn các bài đã bị xóa / bỏ xuất bản khỏi PostgreSQL và vector store
+        if full:
+            try:
+                reconcile_deletions(cur, pg_conn, tree)
+            except Exception as e:
+                pg_conn.rollback()
+                logger.info(f"⭕ Lỗi khi dọn bài viết đã xóa: {e}")
+
+        if not total:
+            logger.info("⏭️  Không có bản ghi bài viết nào được trả về, bỏ qua.")
+            return
+        logger.info(
+            "✅ Đồng bộ xong %d bản ghi vào PostgreSQL: %d mới, %d cập nhật, %d không đổi (checkpoint %s).",
+            total, len(new_ids), updated, unchanged, state.get("checkpoint"),
+        )
 
-    # 3️⃣  Push new rows to the vector store
-    try:
-        for idx, art in enumerate(new_articles, start=1):
-            chunk = indexservice.load_html_to_markdown(
-                html_data=art["body"] or "",
-                metadata={
-                    'id': int(art['id']),
-                    "title": art.get("title", ""),
-                    "header": art.get("header", ""),
-                    "author": art.get("author", ""),
-                    "category_name": art.get("category_name", ""),
-                    "link": art.get("link", ""),
-                    "created_at": art["created_at"].isoformat() if art["created_at"] else "",
-                    "updated_at": art["updated_at"].isoformat() if art["updated_at"] else "",
-                    "published_time": art["published_time"].isoformat() if art["published_time"] else "",
-                    'article_json': json.dumps(art.get("article_json").adapted, ensure_ascii=False, indent=2 ),
-                    **{k: art.get(k) or 0  for k in (
-                        "is_comment",
-                        "is_active",
-                        "is_hot",
-                        "is_important",
-                        "is_top",
-                        "has_video",
-                        "comment_count",
-                        "like_count",
-                        "dislike_count",
-                        "hit_count",
-                    )},
-                },
-            )
-            indexservice.store_chunks([chunk])
-            logger.info("📥  VectorStore %d/%d", idx, len(new_articles))                
-        if len(new_articles):
-            logger.info("✅ Đã đồng bộ %d bản ghi mới vào Vector Store.", len(new_articles))
-        else : 
+        # 4️⃣  Push new rows to the vector store (batch + embed song song)
+        if not new_ids:
             logger.info("🔔 Không có bản ghi mới nào cần đồng bộ vào vector store.")
-    except Exception as e:
-        logger.info(f"⭕ Lỗi khi đẩy dữ liệu vào Vector Store , lỗi cụ thể: {e}")
+            return
+        try:
+            index_new_articles(pg_conn, new_ids)
+        except Exception as e:
+            logger.info(f"⭕ Lỗi khi đẩy dữ liệu vào Vector Store , lỗi cụ thể: {e}")
+
+def sync_job(full: bool | None = None) -> None:
+    """`sync_articles` kèm ghi thời gian chạy và metrics của process ra `metrics.snapshot_dir`."""
+    start = time.perf_counter()
+    try:
+        sync_articles(full)
+    finally:
+        SYNC_RUN_MS.observe((time.perf_counter() - start) * 1000, sync="db_sync")
+        export_snapshot(METRICS_SNAPSHOT_DIR, "db_sync")
 
 ##############################
-# Schedule: every 1 minute
+# Schedule: every db_sync.interval_minutes (mặc định 1 phút)
 ##############################
 
-schedule.every(1).minutes.do(sync_articles)
+schedule.every(SYNC_INTERVAL_MINUTES).minutes.do(sync_job)
 
 if __name__ == "__main__":
-    sync_articles()  # run once immediately
+    parser = argparse.ArgumentParser(description="Đồng bộ MariaDB sang PostgreSQL")
+    parser.add_argument("--full", action="store_true", help="quét toàn bộ bài viết ở lần chạy đầu")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="chỉ dọn các bài đã xóa / bỏ xuất bản khỏi PostgreSQL và vector store rồi thoát")
+    args = parser.parse_args()
+    if args.reconcile:
+        with pymysql.connect(**MARIADB_CONFIG) as mariadb_conn, \
+                mariadb_conn.cursor(pymysql.cursors.SSDictCursor) as cur, \
+                psycopg2.connect(**POSTGRES_CONFIG) as pg_conn:
+            reconcile_deletions(cur, pg_conn, category_cache.get(cur))
+        raise SystemExit(0)
+    sync_job(full=True if args.full else None)  # run once immediately
     while True:
         schedule.run_pending()
         time.sleep(1)
\ No newline at end of file
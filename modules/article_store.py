@@ -0,0 +1,166 @@
+import json
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from psycopg2 import sql
+from psycopg2.extras import Json, execute_values
+
+logger = logging.getLogger("ChatbotNDH")
+
+COLS: Tuple[str, ...] = (
+    "id",
+    "link",
+    "category_name",
+    "title",
+    "header",
+    "body",
+    "author",
+    "is_comment",
+    "is_active",
+    "is_hot",
+    "is_important",
+    "is_top",
+    "has_video",
+    "comment_count",
+    "like_count",
+    "dislike_count",
+    "hit_count",
+    "created_at",
+    "updated_at",
+    "published_time",
+    "article_json",  # list[dict]
+    "content_hash",  # hash các cột trên, vdb_ndh_sync dùng để nhận biết bài đã đổi
+)
+
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {}.{} (
+    id              INTEGER      PRIMARY KEY,
+    link            TEXT,
+    category_name   TEXT,
+    title           TEXT,
+    header          TEXT,
+    body            TEXT,
+    author          TEXT,
+    is_comment      INTEGER,
+    is_active       INTEGER,
+    is_hot          INTEGER,
+    is_important    INTEGER,
+    is_top          INTEGER,
+    has_video       INTEGER,
+    comment_count   INTEGER,
+    like_count      INTEGER,
+    dislike_count   INTEGER,
+    hit_count       INTEGER,
+    created_at      TIMESTAMPTZ,
+    updated_at      TIMESTAMPTZ,
+    published_time  TIMESTAMPTZ,
+    article_json    JSONB,
+    content_hash    TEXT,
+    indexed_hash    TEXT,
+    fingerprint     TEXT
+);
+"""
+
+# {2}: điều kiện bỏ qua update không đổi gì; RETURNING chỉ trả các dòng thực sự được ghi,
+# xmax = 0 nghĩa là dòng vừa INSERT (dòng UPDATE mang xmax của transaction hiện tại)
+UPSERT_QUERY = """
+INSERT INTO {0}.{1} AS t (
+    id, link, category_name, title, header, body, author,
+    is_comment, is_active, is_hot, is_important, is_top, has_video,
+    comment_count, like_count, dislike_count, hit_count,
+    created_at, updated_at, published_time, article_json, content_hash
+) VALUES %s
+ON CONFLICT (id) DO UPDATE SET
+    link           = EXCLUDED.link,
+    category_name  = EXCLUDED.category_name,
+    title          = EXCLUDED.title,
+    header         = EXCLUDED.header,
+    body           = EXCLUDED.body,
+    author         = EXCLUDED.author,
+    is_comment     = EXCLUDED.is_comment,
+    is_active      = EXCLUDED.is_active,
+    is_hot         = EXCLUDED.is_hot,
+    is_important   = EXCLUDED.is_important,
+    is_top         = EXCLUDED.is_top,
+    has_video      = EXCLUDED.has_video,
+    comment_count  = EXCLUDED.comment_count,
+    like_count     = EXCLUDED.like_count,
+    dislike_count  = EXCLUDED.dislike_count,
+    hit_count      = EXCLUDED.hit_count,
+    created_at     = EXCLUDED.created_at,
+    updated_at     = EXCLUDED.updated_at,
+    published_time = EXCLUDED.published_time,
+    article_json   = EXCLUDED.article_json,
+    content_hash   = EXCLUDED.content_hash
+{2}
+RETURNING t.id, (t.xmax = 0) AS inserted;
+"""
+
+# Cột số / cờ của bài viết được đưa vào metadata của vector store (NULL -> 0)
+INDEX_NUMERIC_FIELDS: Tuple[str, ...] = (
+    "is_comment", "is_active", "is_hot", "is_important", "is_top", "has_video",
+    "comment_count", "like_count", "dislike_count", "hit_count",
+)
+
+# content_hash phủ toàn bộ các cột được ghi nên so hash là đủ, không cần so từng cột
+UNCHANGED_GUARD = "WHERE t.content_hash IS DISTINCT FROM EXCLUDED.content_hash"
+
+
+def ensure_article_table(pg_cur, schema: str, table: str) -> None:
+    """Tạo schema / bảng bài viết nếu chưa có, bổ sung các cột theo dõi thay đổi cho bảng tạo từ phiên bản cũ."""
+    pg_cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {};").format(sql.Identifier(schema)))
+    pg_cur.execute(sql.SQL(TABLE_DDL).format(sql.Identifier(schema), sql.Identifier(table)))
+    pg_cur.execute(
+        sql.SQL(
+            "ALTER TABLE {}.{} ADD COLUMN IF NOT EXISTS content_hash TEXT, "
+            "ADD COLUMN IF NOT EXISTS indexed_hash TEXT, "
+            "ADD COLUMN IF NOT EXISTS fingerprint TEXT;"
+        ).format(sql.Identifier(schema), sql.Identifier(table))
+    )
+
+
+def to_index_item(row: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """(html, metadata) của một bài viết (dòng via_ndh.data_ndh) để đẩy vào vector store.
+
+    Dùng chung cho db_ndh_sync, vdb_ndh_sync và rebuild_collection: metadata là đầu vào của fingerprint,
+    chỉ cần khác nhau một chút là mọi bài bị coi là đã đổi và bị embed lại.
+    """
+    article_json = row.get("article_json")
+    if isinstance(article_json, Json):
+        article_json = article_json.adapted
+    return (
+        row["body"] or "",
+        {
+            "id": int(row["id"]),
+            "title": row.get("title", ""),
+            "header": row.get("header", ""),
+            "author": row.get("author", ""),
+            "category_name": row.get("category_name", ""),
+            "link": row.get("link", ""),
+            "created_at": row["created_at"].isoformat() if row["created_at"] else "",
+            "updated_at": row["updated_at"].isoformat() if row["updated_at"] else "",
+            "published_time": row["published_time"].isoformat() if row["published_time"] else "",
+            "article_json": json.dumps(article_json, ensure_ascii=False, indent=2),
+            **{k: row.get(k) or 0 for k in INDEX_NUMERIC_FIELDS},
+        },
+    )
+
+
+def upsert_query(schema: str, table: str, skip_unchanged: bool = True) -> sql.Composed:
+    return sql.SQL(UPSERT_QUERY).format(
+        sql.Identifier(schema), sql.Identifier(table), sql.SQL(UNCHANGED_GUARD if skip_unchanged else "")
+    )
+
+
+def upsert_articles(pg_cur, query, records: Sequence[Tuple[Any, ...]], page_size: int = 1000) -> Tuple[List[int], int, int]:
+    """UPSERT một lô bản ghi (theo thứ tự COLS), trả về (id các bài mới, số bài cập nhật, số bài không đổi).
+
+    Bài đã có mà content_hash không đổi không bị cập nhật: không sinh tuple mới
+    (dòng trùng vẫn bị khóa nên vẫn ghi một ít WAL; số đo trong README, benchmarks/bench_pg_upsert.py).
+    """
+    if not records:
+        return [], 0, 0
+    rows = execute_values(pg_cur, query, records, page_size=page_size, fetch=True)
+    inserted_ids = [row[0] for row in rows if row[1]]
+    updated = len(rows) - len(inserted_ids)
+    return inserted_ids, updated, len(records) - len(rows)
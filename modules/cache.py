@@ -0,0 +1,87 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCT = re.compile(r"^[\s\"'“”‘’.,;:!?…]+|[\s\"'“”‘’.,;:!?…]+$")
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa câu hỏi để làm khóa cache: NFC (tránh lệch dấu tiếng Việt dựng sẵn/tổ hợp),
+    chữ thường, gộp khoảng trắng và bỏ dấu câu ở hai đầu."""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = _SPACES.sub(" ", text)
+    return _EDGE_PUNCT.sub("", text)
+
+
+class TTLCache:
+    """Cache LRU trong bộ nhớ có thời gian sống (TTL), an toàn khi dùng từ nhiều thread.
+
+    max_entries: số phần tử tối đa, vượt quá sẽ loại phần tử ít được dùng gần đây nhất.
+    ttl_seconds: thời gian sống của mỗi phần tử (None/0 = không hết hạn).
+    """
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - stored_at > self.ttl_seconds
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0], now):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item else None
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Snapshot các phần tử còn hạn (không tính vào hit/miss)."""
+        now = time.monotonic()
+        with self._lock:
+            snapshot = [(k, v) for k, (ts, v) in self._data.items() if not self._expired(ts, now)]
+        return iter(snapshot)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,94 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("ChatbotNDH")
+
+BASE_URL = "https://nguoidonghanh.viettel.vn/"
+
+CATEGORY_QUERY = "SELECT id, parent_id, slug, name FROM vtp_category"
+# InnoDB tính checksum bằng cách quét bảng phía server: rẻ với bảng chuyên mục (vài trăm dòng),
+# không phải kéo dữ liệu về chỉ để biết bảng có đổi hay không
+CATEGORY_CHECKSUM_QUERY = "CHECKSUM TABLE vtp_category"
+
+
+def _join_link(*parts: Optional[str]) -> Optional[str]:
+    # giống CONCAT của MariaDB: một phần NULL thì cả link là NULL
+    if any(part is None for part in parts):
+        return None
+    return BASE_URL + "/".join(parts)
+
+
+class CategoryTree:
+    """Cây chuyên mục `vtp_category` trong bộ nhớ, thay cho CTE đệ quy `category_path` chạy lại trên từng bài viết.
+
+    `path(category_id)` là danh sách slug từ chuyên mục của bài lên tới chuyên mục gốc (`parent_id IS NULL`),
+    hoặc None khi chuyên mục không tồn tại / chuỗi cha bị đứt / có vòng lặp: các bài đó trước đây bị loại
+    bởi phép JOIN với `slug_root`, nên cũng bị bỏ qua ở đây.
+    """
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        self._categories: Dict[int, Dict[str, Any]] = {row["id"]: row for row in rows}
+        self._paths: Dict[int, Optional[List[Optional[str]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def name(self, category_id: int) -> Optional[str]:
+        category = self._categories.get(category_id)
+        return category["name"] if category else None
+
+    def path(self, category_id: int) -> Optional[List[Optional[str]]]:
+        if category_id in self._paths:
+            return self._paths[category_id]
+        slugs: List[Optional[str]] = []
+        seen = set()
+        current = self._categories.get(category_id)
+        while current is not None and current["id"] not in seen:
+            seen.add(current["id"])
+            slugs.append(current["slug"])
+            if current["parent_id"] is None:
+                self._paths[category_id] = slugs
+                return slugs
+            current = self._categories.get(current["parent_id"])
+        self._paths[category_id] = None
+        return None
+
+    def article_link(self, category_id: int, article_slug: Optional[str]) -> Optional[str]:
+        """Link bài viết: <gốc>/<chuyên mục của bài>/<slug bài> (như `ARTICLE_QUERY` cũ)."""
+        path = self.path(category_id)
+        if path is None:
+            return None
+        return _join_link(path[-1], path[0], article_slug)
+
+    def related_link(self, category_id: int, article_slug: Optional[str]) -> Optional[str]:
+        """Link bài liên quan: tin-tuc/<gốc>/<slug bài>.
+
+        `RELATED_QUERY` cũ lấy "slug lá" ở độ sâu MAX(level) của phép leo cây, tức chính chuyên mục gốc,
+        nên nhánh CASE `root_slug <> leaf_slug` không bao giờ xảy ra; giữ nguyên kết quả đó để link không đổi.
+        """
+        path = self.path(category_id)
+        if path is None:
+            return None
+        return _join_link("tin-tuc", path[-1], article_slug)
+
+
+class CategoryTreeCache:
+    """Giữ CategoryTree giữa các lần đồng bộ, chỉ đọc lại `vtp_category` khi checksum của bảng thay đổi."""
+    def __init__(self):
+        self._tree: Optional[CategoryTree] = None
+        self._checksum: Optional[int] = None
+
+    def get(self, cur) -> CategoryTree:
+        """`cur` là DictCursor (hoặc SSDictCursor) của MariaDB."""
+        checksum = None
+        try:
+            cur.execute(CATEGORY_CHECKSUM_QUERY)
+            rows = cur.fetchall()
+            checksum = rows[0]["Checksum"] if rows else None
+        except Exception as e:
+            logger.info(f"⭕ Không lấy được checksum vtp_category, đọc lại cây chuyên mục: {e}")
+        if self._tree is None or checksum is None or checksum != self._checksum:
+            cur.execute(CATEGORY_QUERY)
+            self._tree = CategoryTree(cur.fetchall())
+            self._checksum = checksum
+            logger.info(f"🌳 Đã nạp cây chuyên mục: {len(self._tree)} chuyên mục")
+        return self._tree
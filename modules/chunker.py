@@ -0,0 +1,108 @@
+import logging
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+
+logger = logging.getLogger("ChatbotNDH")
+
+# Khóa chính của chunk = CHUNK_ID_BASE + article_id * CHUNK_ID_STRIDE + chunk_index:
+# luôn lớn hơn id bài viết (khóa chính của bản ghi nguyên bài, chưa chia chunk) nên hai kiểu không đụng nhau,
+# và các chunk của một bài nằm trong một khoảng id liên tục (xóa chunk thừa bằng một biểu thức khoảng).
+CHUNK_ID_BASE = 10 ** 15
+CHUNK_ID_STRIDE = 1000
+
+ARTICLE_ID_FIELD = "article_id"
+CHUNK_INDEX_FIELD = "chunk_index"
+CHUNK_COUNT_FIELD = "chunk_count"
+CHUNK_FIELDS = (ARTICLE_ID_FIELD, CHUNK_INDEX_FIELD, CHUNK_COUNT_FIELD)
+
+# Không có indexing.chunk_size / chunk_overlap trong config: lưu nguyên bài như trước khi có chia chunk,
+# để collection đang chạy không bị ghi lại (và embed lại) toàn bộ chỉ vì nâng cấp code
+DEFAULT_CHUNK_SIZE = 0
+DEFAULT_CHUNK_OVERLAP = 0
+
+
+def chunk_id(article_id: int, chunk_index: int) -> int:
+    return CHUNK_ID_BASE + int(article_id) * CHUNK_ID_STRIDE + chunk_index
+
+
+def article_id_of(pk: int) -> int:
+    """id bài viết của một khóa chính (chunk hoặc bản ghi nguyên bài)."""
+    pk = int(pk)
+    return (pk - CHUNK_ID_BASE) // CHUNK_ID_STRIDE if pk >= CHUNK_ID_BASE else pk
+
+
+def is_chunk_id(pk: int) -> bool:
+    return int(pk) >= CHUNK_ID_BASE
+
+
+def make_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Cắt Markdown ưu tiên theo heading, rồi đoạn văn, dòng, câu... (độ dài tính theo ký tự)."""
+    return RecursiveCharacterTextSplitter.from_language(
+        Language.MARKDOWN, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+def _context_prefix(title: str) -> str:
+    return f"# {title}\n\n" if title else ""
+
+
+def split_article(document: Document, splitter: RecursiveCharacterTextSplitter) -> List[Document]:
+    """Chia document của một bài viết thành các chunk mang metadata của bài + article_id / chunk_index / chunk_count.
+
+    Chunk đầu đã chứa tiêu đề, header, tác giả (xem IndexService._build_document); các chunk sau được
+    thêm lại dòng tiêu đề để embedding / BM25 của từng chunk vẫn biết chunk thuộc bài nào.
+    """
+    article_id = int(document.metadata["id"])
+    texts = splitter.split_text(document.page_content) or [document.page_content]
+    if len(texts) > CHUNK_ID_STRIDE:
+        logger.info(f"⚠️  Bài viết id={article_id} có {len(texts)} chunk, chỉ giữ {CHUNK_ID_STRIDE} chunk đầu")
+        texts = texts[:CHUNK_ID_STRIDE]
+    prefix = _context_prefix(document.metadata.get("title") or "")
+    return [
+        Document(
+            page_content=text if index == 0 else prefix + text,
+            metadata={
+                **document.metadata,
+                "id": chunk_id(article_id, index),
+                ARTICLE_ID_FIELD: article_id,
+                CHUNK_INDEX_FIELD: index,
+                CHUNK_COUNT_FIELD: len(texts),
+            },
+        )
+        for index, text in enumerate(texts)
+    ]
+
+
+def collapse_chunks(results: List[Tuple[Document, float]], top_k: int) -> List[Tuple[Document, float]]:
+    """Gộp các chunk cùng bài viết trong kết quả tìm kiếm thành một bản ghi / bài.
+
+    Điểm của bài = điểm cao nhất trong các chunk của nó, thứ tự giữ theo điểm đó; nội dung là các chunk
+    khớp được nối theo thứ tự trong bài. Bản ghi nguyên bài (chưa chia chunk) giữ nguyên.
+    """
+    groups: Dict[int, List[Tuple[Document, float]]] = {}
+    for doc, score in results:
+        article_id = doc.metadata.get(ARTICLE_ID_FIELD)
+        if article_id is None:
+            article_id = article_id_of(doc.metadata.get("id", 0))
+        groups.setdefault(int(article_id), []).append((doc, score))
+
+    collapsed: List[Tuple[Document, float]] = []
+    for article_id, hits in groups.items():
+        best_doc, best_score = max(hits, key=lambda hit: hit[1])
+        if len(hits) == 1 and CHUNK_INDEX_FIELD not in best_doc.metadata:
+            collapsed.append((best_doc, best_score))
+            continue
+        prefix = _context_prefix(best_doc.metadata.get("title") or "")
+        texts = []
+        for doc, _ in sorted(hits, key=lambda hit: hit[0].metadata.get(CHUNK_INDEX_FIELD) or 0):
+            text = doc.page_content
+            if doc.metadata.get(CHUNK_INDEX_FIELD) and prefix and text.startswith(prefix):
+                text = text[len(prefix):]
+            texts.append(text)
+        metadata = {key: value for key, value in best_doc.metadata.items() if key not in CHUNK_FIELDS}
+        metadata["id"] = article_id
+        collapsed.append((Document(page_content="\n\n".join(texts), metadata=metadata), best_score))
+    collapsed.sort(key=lambda hit: hit[1], reverse=True)
+    return collapsed[:top_k]
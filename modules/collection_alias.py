@@ -0,0 +1,51 @@
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
+
+logger = logging.getLogger("ChatbotNDH")
+
+
+def resolve_alias(client, alias: str) -> Optional[str]:
+    """Collection mà alias đang trỏ tới (None nếu `alias` không phải alias, vd còn là tên collection thật
+    hoặc Milvus Lite không hỗ trợ alias)."""
+    try:
+        return client.describe_alias(alias).get("collection_name")
+    except Exception:
+        return None
+
+
+def live_collection(client, alias: str) -> Optional[str]:
+    """Collection đang phục vụ dưới tên `alias`: đích của alias, hoặc chính collection tên `alias`
+    khi chưa chuyển sang dùng alias. None nếu chưa có gì."""
+    target = resolve_alias(client, alias)
+    if target:
+        return target
+    return alias if client.has_collection(alias) else None
+
+
+def shadow_collection_name(alias: str) -> str:
+    return f"{alias}_{datetime.now():%Y%m%d%H%M%S}"
+
+
+def swap_alias(client, alias: str, collection_name: str) -> Tuple[bool, Optional[str]]:
+    """Trỏ `alias` sang `collection_name`, trả về (có đổi không, collection trước đó hoặc None nếu chưa có).
+    Alias đã trỏ sẵn tới `collection_name` thì không làm gì và trả về (False, None): không có collection cũ
+    nào để giữ lại hay xóa đi.
+
+    Alias đã có: `alter_alias` đổi đích nguyên tử, truy vấn đang chạy trên collection cũ vẫn hoàn tất.
+    Lần đầu (tên `alias` còn là collection thật): đổi tên collection đó thành `<alias>_legacy_<thời điểm>`
+    rồi tạo alias; giữa hai lệnh có một khoảng rất ngắn tên `alias` không tồn tại.
+    """
+    previous = resolve_alias(client, alias)
+    if previous == collection_name:
+        logger.info(f"🔀 Alias '{alias}' đã trỏ tới {collection_name}, không đổi gì")
+        return False, None
+    if previous:
+        client.alter_alias(collection_name, alias)
+    else:
+        if client.has_collection(alias):
+            previous = f"{alias}_legacy_{datetime.now():%Y%m%d%H%M%S}"
+            client.rename_collection(alias, previous)
+        client.create_alias(collection_name, alias)
+    logger.info(f"🔀 Alias '{alias}': {previous or 'chưa có'} -> {collection_name}")
+    return True, previous
@@ -1,9 +1,13 @@
 import psycopg2
 from psycopg2 import sql, DatabaseError
+from psycopg2.pool import ThreadedConnectionPool
 from typing import Optional
+from contextlib import contextmanager
 from configs.config import load_config
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
+import threading
+import time
 import logging
 
 logger = logging.getLogger("ChatbotNDH")
@@ -13,15 +17,110 @@ config = load_config()
 
 
 class Database_data: # Database_data
+    """Pool kết nối PostgreSQL (read-only) dùng chung cho SQL agent.
+
+    Kết nối được tạo lazy ở lần dùng đầu tiên, không mở kết nối lúc import.
+    Các tham số pool đọc từ `database_data` trong config.yaml:
+    pool_min_size, pool_max_size, pool_timeout (giây chờ khi pool hết kết nối),
+    statement_timeout_ms, health_check_interval (giây), read_only.
+    """
     def __init__(self):
-        self.host = config['database_data']["host"]
-        self.dbname = config['database_data']["database"]
-        self.user = config['database_data']["user"]
-        self.password = config['database_data']["password"]
-        self.port = config['database_data']["port"]
-        self.conn, self.cursor = self.connect()
-    
+        db_cfg = config['database_data']
+        self.host = db_cfg["host"]
+        self.dbname = db_cfg["database"]
+        self.user = db_cfg["user"]
+        self.password = db_cfg["password"]
+        self.port = db_cfg["port"]
+
+        self.min_size = db_cfg.get("pool_min_size", 1)
+        self.max_size = db_cfg.get("pool_max_size", 10)
+        self.pool_timeout = db_cfg.get("pool_timeout", 10)
+        self.statement_timeout_ms = db_cfg.get("statement_timeout_ms", 15000)
+        self.health_check_interval = db_cfg.get("health_check_interval", 30)
+        self.read_only = db_cfg.get("read_only", True)
+
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool báo lỗi ngay khi hết kết nối -> dùng semaphore để caller chờ
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._last_used: dict[int, float] = {}
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        self.min_size,
+                        self.max_size,
+                        host=self.host,
+                        database=self.dbname,
+                        user=self.user,
+                        password=self.password,
+                        port=self.port,
+                        options=f"-c statement_timeout={int(self.statement_timeout_ms)}",
+                    )
+                    logger.info(f"✅ DB {self.dbname} pool created (min={self.min_size}, max={self.max_size}).")
+        return self._pool
+
+    def _prepare(self, conn) -> bool:
+        """Đặt session read-only/autocommit và kiểm tra kết nối còn sống (health check)."""
+        if conn.closed:
+            return False
+        try:
+            if not conn.autocommit or conn.readonly != self.read_only:
+                conn.set_session(readonly=self.read_only, autocommit=True)
+            last_used = self._last_used.get(id(conn), 0)
+            if time.monotonic() - last_used >= self.health_check_interval:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self):
+        pool = self._get_pool()
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise DatabaseError(f"Hết kết nối trong pool DB {self.dbname} sau {self.pool_timeout}s")
+        try:
+            # thử tối đa max_size lần để bỏ qua các kết nối đã chết
+            for _ in range(self.max_size + 1):
+                conn = pool.getconn()
+                if self._prepare(conn):
+                    break
+                logger.info(f"⚠️ DB {self.dbname}: bỏ kết nối không còn sống, tạo kết nối mới.")
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+            else:
+                raise DatabaseError(f"Không lấy được kết nối hợp lệ tới DB {self.dbname}")
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken: bool = False):
+        try:
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+                self._get_pool().putconn(conn, close=True)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._get_pool().putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        """Mượn một kết nối từ pool và trả về cursor; kết nối được trả lại pool khi xong."""
+        conn = self._acquire()
+        try:
+            with conn.cursor() as cur:
+                yield cur
+        finally:
+            # kết nối bị đứt (conn.closed != 0) sẽ bị loại khỏi pool trong _release
+            self._release(conn)
+
     def connect(self):
+        """Tạo kết nối riêng (không qua pool), giữ lại cho các script cần kết nối độc lập."""
         try:
             conn = psycopg2.connect(
                 host=self.host,
@@ -34,13 +133,12 @@ class Database_data: # Database_data
             logger.info(f"✅ DB {self.dbname} connected.")
             return conn, cursor
         except Exception as e:
-            logger.info(f"❌ DB {self.dbname} connect failed", e)
+            logger.info(f"❌ DB {self.dbname} connect failed: {e}")
             return None, None
 
     def close(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+        self._last_used.clear()
         logger.info(f"🔒 DB {self.dbname} close!")
-
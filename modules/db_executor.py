@@ -1,12 +1,16 @@
+import asyncio
 import logging
 from typing import Dict, Any, List, Optional
 from modules.db import Database_data
 from modules.llm_invoker import invoke_llm_for_full_response
+from modules.metrics import LLM_SQL_GEN_MS, SQL_EXEC_MS, SQL_RETRIES
+from modules.tracing import current_span, traced
 from configs.config import load_config
 from configs.prompt import SQL_GENERATION_DOUBLE_CHECK
 from langchain_core.messages import HumanMessage
 import json
 import re
+import time
 
 
 config = load_config()
@@ -19,6 +23,7 @@ FORBIDDEN_KEYWORDS = [
 
 DB = Database_data()
 
+@traced()
 async def sql_double_check(llm, previous_sql: str, sql_error: str, attempt: int, prompt_input_sql: str) -> str:
 
     # Enhanced prompt with previous attempt information
@@ -31,14 +36,17 @@ async def sql_double_check(llm, previous_sql: str, sql_error: str, attempt: int,
         'previous_sql': previous_sql,
     }
     sql_generation_prompt = SQL_GENERATION_DOUBLE_CHECK.format(**prompt_input)
+    current_span().set(attempt=attempt)
     
     try:
-        llm_sql_response = await invoke_llm_for_full_response(llm, [HumanMessage(content=sql_generation_prompt)])
+        with LLM_SQL_GEN_MS.time(stage="double_check"):
+            llm_sql_response = await invoke_llm_for_full_response(llm, [HumanMessage(content=sql_generation_prompt)])
         return llm_sql_response
     except Exception as e:
         logger.error(f"LLM invocation failed: {str(e)}")
         return f"Lỗi khi gọi LLM: {str(e)}"
 
+@traced()
 def execute_sql_query(sql_query: str) -> Dict[str, Any]:
     result = {
         "status": "error",
@@ -59,17 +67,14 @@ def execute_sql_query(sql_query: str) -> Dict[str, Any]:
         result["message"] = "Lỗi: Chỉ cho phép thực thi câu lệnh SELECT."
         # return result
 
+    start = time.perf_counter()
     try:
-        conn, cur = DB.connect()
-        if conn is None or cur is None:
-            result["message"] = "Không thể kết nối database!"
-            logger.error('Không thể kết nối database!')
-            # return result
+        with DB.cursor() as cur:
+            # Execute query
+            cur.execute(sql_query)
+            rows = cur.fetchall() if cur.description else None
+            columns = [desc[0] for desc in cur.description] if cur.description else None
 
-        # Execute query
-        cur.execute(sql_query)
-        rows = cur.fetchall() if cur.description else None
-        
         if rows is None:
             result["message"] = "Câu lệnh đã được thực thi nhưng không trả về dữ liệu."
             result["status"] = "success_no_data"
@@ -79,7 +84,7 @@ def execute_sql_query(sql_query: str) -> Dict[str, Any]:
         else:
             result["row_count"] = len(rows)
             result["data"] = rows[:20]  # Limit to 20 rows
-            result["columns"] = [desc[0] for desc in cur.description]
+            result["columns"] = columns
 
             if result["row_count"] > 20:
                 result["message"] = f"Thành công. Hiển thị 20 dòng đầu tiên trong tổng số {result['row_count']} dòng."
@@ -92,14 +97,11 @@ def execute_sql_query(sql_query: str) -> Dict[str, Any]:
         result["status"] = "db_error"
         logger.error(f"SQL execution error: {str(e)}")
 
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
-
+    SQL_EXEC_MS.observe((time.perf_counter() - start) * 1000, status=result["status"])
+    current_span().set(status=result["status"], row_count=result["row_count"])
     return result
 
+@traced()
 async def execute_sql_with_retry(llm, query: str, tables: List[str], initial_sql: str, prompt_input_sql: str, max_attempts: int = 3) -> Dict[str, Any]:
     result = {
         "status": "error",
@@ -112,8 +114,11 @@ async def execute_sql_with_retry(llm, query: str, tables: List[str], initial_sql
     
     current_sql = initial_sql
     for attempt in range(1, max_attempts + 1):
-        result = execute_sql_query(current_sql)
+        # chạy trong thread để không chặn event loop khi chờ PostgreSQL
+        result = await asyncio.to_thread(execute_sql_query, current_sql)
         result["attempts_made"] = attempt
+        current_span().set(attempts=attempt)
+        result["sql"] = current_sql
         
         if result["status"] == "success":
             return result
@@ -121,6 +126,7 @@ async def execute_sql_with_retry(llm, query: str, tables: List[str], initial_sql
         if result["status"] in ["success_no_data", "db_error"]:
             error_message = result["message"]
             logger.info(f"Attempt {attempt} failed: {error_message}. Generating new SQL...")
+            SQL_RETRIES.inc()
             
             new_sql = await sql_double_check(llm, current_sql, error_message, attempt, prompt_input_sql)
             new_sql = re.search(r"```sql\s*([\s\S]+?)\s*```", new_sql)
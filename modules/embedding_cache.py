@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("ChatbotNDH")
+
+DEFAULT_CACHE_PATH = "cache/embeddings.sqlite3"
+
+
+class CachedEmbeddings(Embeddings):
+    """Bọc một đối tượng Embeddings bằng cache trên đĩa (SQLite, WAL) dùng chung giữa các process.
+
+    - Khóa: sha256(model + dimensions + text), giá trị: vector float32 dạng BLOB.
+    - Nhiều worker uvicorn và các job đồng bộ có thể cùng trỏ tới một file cache.
+    - Khi số bản ghi vượt max_entries, xóa các bản ghi lâu không được truy cập nhất.
+    - hits / misses được đếm trong process, xem qua `stats()`.
+    """
+    def __init__(
+        self,
+        underlying: Embeddings,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 50000,
+        cache_documents: bool = True,
+        prune_every: int = 500,
+        touch_interval: float = 300,
+    ):
+        self.underlying = underlying
+        self.path = path
+        self.max_entries = max_entries
+        self.cache_documents = cache_documents
+        self.prune_every = prune_every
+        # chỉ cập nhật last_access khi lần truy cập trước đã cũ hơn ngưỡng này, tránh ghi đĩa mỗi lần hit
+        self.touch_interval = touch_interval
+        self.namespace = f"{getattr(underlying, 'model', type(underlying).__name__)}:{getattr(underlying, 'dimensions', '')}"
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_prune = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+
+    @classmethod
+    def from_config(cls, underlying: Embeddings, cache_cfg: Optional[Dict[str, Any]]) -> Embeddings:
+        """Trả về embeddings có cache nếu `embedding_cache.enabled`, ngược lại trả nguyên bản."""
+        if not cache_cfg or not cache_cfg.get("enabled", False):
+            return underlying
+        try:
+            return cls(
+                underlying,
+                path=cache_cfg.get("path", DEFAULT_CACHE_PATH),
+                max_entries=cache_cfg.get("max_entries", 50000),
+                cache_documents=cache_cfg.get("cache_documents", True),
+            )
+        except Exception as e:
+            logger.error(f"⭕ Không thể mở embedding cache, dùng embeddings không cache: {e}")
+            return underlying
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self._key(t) for t in texts]
+        conn = self._connect()
+        found: Dict[str, tuple] = {}
+        try:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector, last_access FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update({row[0]: (row[1], row[2]) for row in rows})
+            now = time.time()
+            stale = [k for k, (_, last_access) in found.items() if now - last_access > self.touch_interval]
+            if stale:
+                conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in stale])
+        except sqlite3.Error as e:
+            logger.info(f"⭕ Lỗi đọc embedding cache: {e}")
+        result = [
+            np.frombuffer(found[k][0], dtype=np.float32).tolist() if k in found else None
+            for k in keys
+        ]
+        hit_count = sum(1 for r in result if r is not None)
+        with self._lock:
+            self.hits += hit_count
+            self.misses += len(result) - hit_count
+        return result
+
+    def _store(self, texts: List[str], vectors: List[List[float]]) -> None:
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (self._key(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        try:
+            self._connect().executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+        except sqlite3.Error as e:
+            logger.info(f"⭕ Lỗi ghi embedding cache: {e}")
+            return
+        with self._lock:
+            self._writes_since_prune += len(rows)
+            need_prune = self._writes_since_prune >= self.prune_every
+            if need_prune:
+                self._writes_since_prune = 0
+        if need_prune:
+            self.prune()
+
+    def prune(self) -> int:
+        """Xóa các bản ghi cũ nhất khi vượt max_entries, trả về số bản ghi đã xóa."""
+        conn = self._connect()
+        try:
+            (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            return overflow
+        except sqlite3.Error as e:
+            logger.info(f"⭕ Lỗi dọn embedding cache: {e}")
+            return 0
+
+    def _embed_with_cache(self, texts: List[str], embed_fn) -> List[List[float]]:
+        cached = self._lookup(texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            vectors = embed_fn([texts[i] for i in missing])
+            for i, v in zip(missing, vectors):
+                cached[i] = v
+            self._store([texts[i] for i in missing], vectors)
+        return cached
+
+    async def _aembed_with_cache(self, texts: List[str], aembed_fn) -> List[List[float]]:
+        cached = await asyncio.to_thread(self._lookup, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            vectors = await aembed_fn([texts[i] for i in missing])
+            for i, v in zip(missing, vectors):
+                cached[i] = v
+            await asyncio.to_thread(self._store, [texts[i] for i in missing], vectors)
+        return cached
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_with_cache([text], lambda t: [self.underlying.embed_query(t[0])])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def aembed(t):
+            return [await self.underlying.aembed_query(t[0])]
+        return (await self._aembed_with_cache([text], aembed))[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not self.cache_documents:
+            return self.underlying.embed_documents(texts)
+        return self._embed_with_cache(texts, self.underlying.embed_documents)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not self.cache_documents:
+            return await self.underlying.aembed_documents(texts)
+        return await self._aembed_with_cache(texts, self.underlying.aembed_documents)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
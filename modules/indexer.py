@@ -1,5 +1,12 @@
 
 from typing import Any, Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+import hashlib
+import json
+import random
+import time
+import unicodedata
 from langchain_milvus import Milvus, BM25BuiltInFunction
 from langchain_openai import OpenAIEmbeddings
 
@@ -7,23 +14,69 @@ from pymilvus import MilvusClient, DataType, Function, FunctionType
 
 
 from langchain_core.documents import Document
+from openai import APIConnectionError, APITimeoutError, RateLimitError
 
 import logging
 
-from modules.parser import convert_html_to_markdown_v3
+from modules.chunker import (
+  ARTICLE_ID_FIELD, CHUNK_COUNT_FIELD, CHUNK_INDEX_FIELD, DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, article_id_of,
+  chunk_id, is_chunk_id, make_splitter, split_article,
+)
+from modules.collection_alias import resolve_alias
+from modules.embedding_cache import CachedEmbeddings
+from modules.metrics import EMBED_MS, EMBED_RETRIES, HTML_CONVERT_MS
+from modules.parser import convert_html_to_markdown_v4, convert_many_html_to_markdown
+from modules.retrieval_filters import FILTER_FIELDS
+from modules.vector_index import (
+  add_scalar_indexes, add_vector_index, ensure_scalar_indexes, rebuild_vector_index, vector_index_config,
+)
 
 logger = logging.getLogger("db_sync_nđh")
 
-def create_vectorstore( URI: str ,collection_name: str , API_KEY : str = None ):
-  """Create a vector store using Milvus and HuggingFace embeddings."""
-  if API_KEY is not None:
-    embeddings = OpenAIEmbeddings(
-        openai_api_key=API_KEY,
-        model="text-embedding-3-large",
-        dimensions=1024,
-    )
-  else:
+# Lỗi tạm thời của API embedding, gặp thì chờ rồi thử lại (exponential backoff)
+RETRYABLE_EMBEDDING_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError)
+
+# Trường vô hướng chứa fingerprint nội dung của bài viết (trong Milvus và cột cùng tên ở via_ndh.data_ndh)
+FINGERPRINT_FIELD = "fingerprint"
+TIMESTAMP_FIELDS = ("created_at", "updated_at", "published_time")
+
+def normalize_metadata_value(key: str, value: Any) -> Any:
+  # cùng quy ước so sánh với vdb_ndh_sync.isupdate: bỏ múi giờ của timestamp, so article_json theo nội dung JSON
+  if key in TIMESTAMP_FIELDS and value:
+    return datetime.fromisoformat(value).replace(tzinfo=None).isoformat()
+  if key == "article_json" and isinstance(value, str) and value:
+    return json.loads(value)
+  return value
+
+def document_fingerprint(page_content: str, metadata: dict, layout: str = "") -> str:
+  """sha256 của Markdown đã chuẩn hóa (NFC, bỏ khoảng trắng cuối dòng) + metadata của bài viết.
+
+  `layout` mô tả cách bài được chia chunk (rỗng = lưu nguyên bài): đổi cấu hình chunk làm đổi fingerprint
+  nên lần so khớp toàn bộ kế tiếp sẽ ghi lại bài theo cấu hình mới.
+  """
+  text = "\n".join(line.rstrip() for line in unicodedata.normalize("NFC", page_content).strip().splitlines())
+  normalized = {
+    key: normalize_metadata_value(key, value)
+    for key, value in metadata.items() if key != FINGERPRINT_FIELD
+  }
+  payload = json.dumps([text, normalized, layout] if layout else [text, normalized],
+                       ensure_ascii=False, sort_keys=True, default=str)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def build_embeddings( API_KEY : str = None, embedding_cache: dict = None ):
+  """Create the OpenAI embeddings, wrapped by the on-disk embedding cache when enabled."""
+  if API_KEY is None:
     logger.error("API_KEY must be provided.")
+  embeddings = OpenAIEmbeddings(
+      openai_api_key=API_KEY,
+      model="text-embedding-3-large",
+      dimensions=1024,
+  )
+  return CachedEmbeddings.from_config(embeddings, embedding_cache)
+
+def create_vectorstore( URI: str ,collection_name: str , API_KEY : str = None, embedding_cache: dict = None ):
+  """Create a vector store using Milvus and OpenAI embeddings."""
+  embeddings = build_embeddings(API_KEY, embedding_cache)
   vector_store = Milvus(
       auto_id=True,
       embedding_function=embeddings,
@@ -32,16 +85,34 @@ def create_vectorstore( URI: str ,collection_name: str , API_KEY : str = None ):
       connection_args={"uri": URI},
       collection_name = collection_name
   )
-  logger.info(f"connected to Milvus at {URI} - {collection_name}")
+  # collection_name có thể là alias (rebuild_collection.py đổi đích alias khi build lại collection)
+  target = resolve_alias(vector_store.client, collection_name)
+  logger.info(f"connected to Milvus at {URI} - {collection_name}" + (f" -> {target}" if target else ""))
   return vector_store
 
 class IndexService:
-    def __init__(self, URI: str, collection_name: str , API_KEY: str = None):
+    def __init__(self, URI: str, collection_name: str , API_KEY: str = None, embedding_cache: dict = None,
+                 convert_workers: int = 1, convert_chunksize: int = 16,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                 vector_index: dict = None):
         self.uri = URI
         self.collection_name= collection_name
         self.api_key = API_KEY
+        # process pool chuyển HTML -> Markdown, dùng lại giữa các lần đồng bộ; các process được fork ngay ở đây,
+        # trước khi mở kết nối gRPC tới Milvus (fork một process đang có kênh gRPC dễ gây treo)
+        self.convert_workers = convert_workers
+        self.convert_chunksize = convert_chunksize
+        self._convert_pool: ProcessPoolExecutor | None = self._start_convert_pool()
+        self._scalar_field_names: List[str] | None = None
+        # chunk_size = 0: lưu nguyên bài thành một bản ghi (khóa chính = id bài viết)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._splitter = make_splitter(chunk_size, chunk_overlap) if chunk_size else None
+        self.layout = f"chunk:{chunk_size}/{chunk_overlap}" if chunk_size else ""
+        # index của trường vector dày (mục vector_db.index trong config)
+        self.vector_index = vector_index_config(vector_index)
         self.create_vector_store_if_no_exist()
-        self.vector_store = create_vectorstore(URI,collection_name , API_KEY)
+        self.vector_store = create_vectorstore(URI,collection_name , API_KEY, embedding_cache)
     
     def create_vector_store_if_no_exist(self):
         # Khởi tạo client
@@ -156,6 +227,27 @@ class IndexService:
                 nullable=True,
                 description="dữ liệu JSON bài viết"
             )
+            # Chunk của bài viết (để trống với bản ghi nguyên bài)
+            schema.add_field(
+                field_name=ARTICLE_ID_FIELD,
+                datatype=DataType.INT64,
+                nullable=True,
+                description="id bài viết chứa chunk"
+            )
+            for field in (CHUNK_INDEX_FIELD, CHUNK_COUNT_FIELD):
+                schema.add_field(
+                    field_name=field,
+                    datatype=DataType.INT32,
+                    nullable=True,
+                    description=f"{field} của chunk trong bài viết"
+                )
+            schema.add_field(
+                field_name=FINGERPRINT_FIELD,
+                datatype=DataType.VARCHAR,
+                max_length=64,
+                nullable=True,
+                description="sha256 nội dung + metadata, dùng để phát hiện bài viết thay đổi"
+            )
 
             # Định nghĩa function BM25 cho trường "text" → "sparse"
             bm25_function = Function(
@@ -168,12 +260,9 @@ class IndexService:
 
             # Chuẩn bị index
             index_params = client.prepare_index_params()
-            index_params.add_index(
-                field_name="vector",
-                index_name="vector_flat_idx",
-                index_type="FLAT",
-                metric_type="COSINE",
-            )
+            add_vector_index(index_params, self.vector_index)
+            # index vô hướng cho các trường lọc metadata của /retrieval
+            add_scalar_indexes(index_params, FILTER_FIELDS)
             index_params.add_index(
                 field_name="sparse",
                 index_name="sparse_idx",
@@ -192,17 +281,48 @@ class IndexService:
             logger.error(f"⭕ Lỗi: không thể tạo collection '{self.collection_name}': {e}")
 
 
+    def rebuild_vector_index(self, force: bool = False) -> bool:
+        """Build lại index vector của collection hiện có theo `self.vector_index` nếu đang khác cấu hình,
+        đồng thời bổ sung index vô hướng của các trường lọc metadata nếu còn thiếu."""
+        ensure_scalar_indexes(self.vector_store.client, self.collection_name, FILTER_FIELDS)
+        return rebuild_vector_index(self.vector_store.client, self.collection_name, self.vector_index, force=force)
+
     def load_html_to_markdown(self, html_data: str, metadata: dict) -> Document:
         """Load HTML and chunk it into smaller pieces."""
+        return self._build_document(convert_html_to_markdown_v4(html_data), metadata)
+
+    def load_many_html_to_markdown(self, items: List[Tuple[str, dict]]) -> List[Document]:
+        """Như `load_html_to_markdown` cho nhiều bài (html, metadata), chuyển đổi song song
+        trên process pool với `convert_workers` process."""
+        with HTML_CONVERT_MS.time():
+            markdowns = convert_many_html_to_markdown(
+                [html_data for html_data, _ in items],
+                chunksize=self.convert_chunksize,
+                executor=self._get_convert_pool() if len(items) > self.convert_chunksize else None,
+            )
+        return [self._build_document(markdown, metadata) for markdown, (_, metadata) in zip(markdowns, items)]
+
+    def _start_convert_pool(self) -> ProcessPoolExecutor | None:
+        if self.convert_workers <= 1:
+            return None
+        pool = ProcessPoolExecutor(max_workers=self.convert_workers)
+        # ProcessPoolExecutor chỉ fork khi nhận việc: giao mỗi process một việc rỗng để fork đủ ngay bây giờ
+        list(pool.map(abs, range(self.convert_workers)))
+        return pool
+
+    def _get_convert_pool(self) -> ProcessPoolExecutor | None:
+        return self._convert_pool
+
+    def _build_document(self, markdown: str, metadata: dict) -> Document:
         title = metadata.get("title", "")
         header = metadata.get('header', "")
         author = metadata.get('author', "không xác định")
-        markdown_data = f"# {title}\n\n" + f"## {header}\n\n" + f"Tác giả: {author}\n\n" + convert_html_to_markdown_v3(html_data)
+        markdown_data = f"# {title}\n\n" + f"## {header}\n\n" + f"Tác giả: {author}\n\n" + markdown
         document = Document(
                             page_content=markdown_data,
-                            metadata=metadata
+                            metadata={**metadata, FINGERPRINT_FIELD: document_fingerprint(markdown_data, metadata, self.layout)}
                     )
-        return document 
+        return document
     # test
     def get_by_id(self, id: int ) -> Document: 
         try:
@@ -220,8 +340,221 @@ class IndexService:
                     )
         except Exception as e:
             logger.info(f"⭕ không thể lấy được bản ghi trong vector store theo ID, lỗi cụ thể: {e}")
-        
+
+    def get_many(self, ids: List[int], output_fields: List[str] | None = None,
+                 batch_size: int = 1000) -> Dict[int, Document]:
+        """Lấy nhiều bản ghi theo khóa chính, mỗi lần gọi Milvus một trang `batch_size` id.
+
+        Chỉ lấy các trường vô hướng (mặc định: mọi trường trừ vector) nên không kéo về vector 1024 chiều.
+        Trả về dict id -> Document (page_content lấy từ "text" nếu có trong output_fields);
+        id không có trong collection hoặc thuộc trang bị lỗi sẽ không có trong kết quả.
+        """
+        fields = list(output_fields) if output_fields else self._scalar_fields()
+        documents: Dict[int, Document] = {}
+        for start in range(0, len(ids), batch_size):
+            batch = [int(i) for i in ids[start:start + batch_size]]
+            try:
+                rows = self.vector_store.client.get(
+                    collection_name=self.collection_name, ids=batch, output_fields=fields
+                )
+            except Exception as e:
+                logger.info(f"⭕ không thể lấy {len(batch)} bản ghi trong vector store (từ id={batch[0]}), lỗi cụ thể: {e}")
+                continue
+            for row in rows:
+                row = dict(row)
+                documents[row["id"]] = Document(page_content=row.pop("text", ""), metadata=row)
+        return documents
+
+    def get_articles(self, article_ids: List[int], output_fields: List[str] | None = None,
+                     batch_size: int = 1000) -> Dict[int, Document]:
+        """Như `get_many` nhưng theo id bài viết: trả về dict article_id -> bản ghi đại diện của bài
+        (chunk đầu tiên, hoặc bản ghi nguyên bài). Tra theo cách lưu hiện tại trước, bài không thấy thì
+        tra tiếp theo cách lưu còn lại để nhận ra bài được ghi trước khi đổi cấu hình chunk."""
+        if output_fields:
+            output_fields = list(dict.fromkeys([*output_fields, "id"]))
+        lookups = [lambda a: chunk_id(a, 0), lambda a: a]
+        if not self.chunk_size:
+            lookups.reverse()
+        found: Dict[int, Document] = {}
+        remaining = [int(a) for a in article_ids]
+        for to_pk in lookups:
+            if not remaining:
+                break
+            rows = self.get_many([to_pk(a) for a in remaining], output_fields=output_fields, batch_size=batch_size)
+            found.update({article_id_of(pk): doc for pk, doc in rows.items()})
+            remaining = [a for a in remaining if a not in found]
+        return found
+
+    def is_current_layout(self, document: Document) -> bool:
+        """Bản ghi trong Milvus có được lưu đúng cách hiện tại (chia chunk hay nguyên bài) không."""
+        return is_chunk_id(document.metadata["id"]) == bool(self.chunk_size)
+
+    def split_documents(self, documents: List[Document]) -> List[List[Document]]:
+        """Các bản ghi sẽ ghi vào Milvus cho từng bài viết (nguyên bài khi tắt chia chunk)."""
+        if self._splitter is None:
+            return [[doc] for doc in documents]
+        return [split_article(doc, self._splitter) for doc in documents]
+
+    def _scalar_fields(self) -> List[str]:
+        """Tên các trường không phải vector của collection (đọc schema một lần rồi nhớ lại)."""
+        if self._scalar_field_names is None:
+            vector_types = {
+                DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR, DataType.FLOAT16_VECTOR,
+                DataType.BFLOAT16_VECTOR, DataType.SPARSE_FLOAT_VECTOR,
+            }
+            description = self.vector_store.client.describe_collection(self.collection_name)
+            self._scalar_field_names = [
+                field["name"] for field in description["fields"] if field["type"] not in vector_types
+            ]
+        return self._scalar_field_names
+
     def store_chunks(self, chunks: list[Document]):
         """Store chunks in the vector store."""
         self.vector_store.add_documents(chunks)
-    
\ No newline at end of file
+
+    def _embed_batch(self, texts: list[str], max_retries: int = 5, base_delay: float = 1.0) -> list[list[float]]:
+        """Embed một batch, tự chờ và thử lại khi bị rate limit / lỗi mạng tạm thời."""
+        for attempt in range(max_retries + 1):
+            try:
+                with EMBED_MS.time(op="documents"):
+                    return self.vector_store.embeddings.embed_documents(texts)
+            except RETRYABLE_EMBEDDING_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                EMBED_RETRIES.inc()
+                delay = min(60.0, base_delay * 2 ** attempt) * (1 + random.random())
+                logger.info(f"⏳ Embedding bị giới hạn/lỗi tạm thời ({type(e).__name__}), thử lại sau {delay:.1f}s")
+                time.sleep(delay)
+
+    def _insert_embedded(self, documents: list[Document], vectors: list[list[float]], upsert: bool = False) -> int:
+        """Bulk insert (hoặc upsert) các document đã có embedding; sparse BM25 do Milvus tự sinh từ `text`."""
+        rows = [
+            {**doc.metadata, "text": doc.page_content, "vector": vector}
+            for doc, vector in zip(documents, vectors)
+        ]
+        if upsert:
+            result = self.vector_store.client.upsert(collection_name=self.collection_name, data=rows)
+            return result.get("upsert_count", len(rows)) if isinstance(result, dict) else len(rows)
+        result = self.vector_store.client.insert(collection_name=self.collection_name, data=rows)
+        return result.get("insert_count", len(rows)) if isinstance(result, dict) else len(rows)
+
+    def store_documents_batched(self, documents: list[Document], batch_size: int = 64,
+                                max_workers: int = 4, max_retries: int = 5, upsert: bool = False) -> Dict[str, Any]:
+        """Đẩy nhiều document vào Milvus: chia batch, embed song song (giới hạn `max_workers`
+        lời gọi đồng thời) và insert hàng loạt từng batch ngay khi embed xong.
+        `upsert=True` ghi đè các bản ghi đã có cùng id (dùng khi cập nhật bài viết).
+
+        Returns thống kê: inserted, failed, failed_ids, seconds, docs_per_sec.
+        """
+        start = time.perf_counter()
+        inserted, failed = 0, 0
+        failed_ids = []
+        batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed") as pool:
+            futures = {
+                pool.submit(self._embed_batch, [doc.page_content for doc in batch], max_retries): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    inserted += self._insert_embedded(batch, future.result(), upsert=upsert)
+                    logger.info(f"📥  VectorStore {inserted}/{len(documents)}")
+                except Exception as e:
+                    failed += len(batch)
+                    ids = [doc.metadata.get("id") for doc in batch]
+                    failed_ids.extend(ids)
+                    logger.info(f"⭕ Lỗi khi đẩy batch vào Vector Store (ids={ids}): {e}")
+        seconds = time.perf_counter() - start
+        docs_per_sec = inserted / seconds if seconds > 0 else 0.0
+        if documents:
+            logger.info(f"📈 Đã đẩy {inserted}/{len(documents)} document vào Vector Store trong {seconds:.1f}s "
+                        f"({docs_per_sec:.1f} docs/s, lỗi: {failed})")
+        return {"inserted": inserted, "failed": failed, "failed_ids": failed_ids,
+                "seconds": seconds, "docs_per_sec": docs_per_sec}
+    
+
+    def _delete_by_article(self, items: List[Tuple[int, int]], clause, batch_size: int, what: str) -> List[int]:
+        """Xóa theo lô `batch_size` bài, mỗi lô một biểu thức `clause(article_id, n)` nối bằng "or".
+        Trả về id các bài xóa lỗi."""
+        failed: List[int] = []
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            expr = " or ".join(clause(a, n) for a, n in batch)
+            try:
+                self.vector_store.client.delete(collection_name=self.collection_name, filter=expr)
+            except Exception as e:
+                failed.extend(a for a, _ in batch)
+                logger.info(f"⭕ Lỗi khi xóa {what} của {len(batch)} bài viết (từ id={batch[0][0]}): {e}")
+        return failed
+
+    def _delete_stale(self, article_chunk_counts: List[Tuple[int, int]], batch_size: int = 100) -> List[int]:
+        """Xóa các bản ghi cũ không còn thuộc cách lưu hiện tại của bài: chunk thừa khi bài ngắn đi,
+        bản ghi nguyên bài khi chuyển sang chia chunk (và ngược lại). Trả về id các bài xóa lỗi.
+
+        Biểu thức xóa loại trừ các id của cách lưu hiện tại (chunk 0..n-1, hoặc id bài khi lưu nguyên bài)
+        nên gọi được ngay sau khi các bản ghi mới đã ghi xong mà không đụng tới chúng."""
+        if self.chunk_size:
+            clause = lambda a, n: f"(id == {a} or (id >= {chunk_id(a, n)} and id < {chunk_id(a + 1, 0)}))"
+        else:
+            clause = lambda a, _: f"(id >= {chunk_id(a, 0)} and id < {chunk_id(a + 1, 0)})"
+        return self._delete_by_article(article_chunk_counts, clause, batch_size, "bản ghi cũ")
+
+    def delete_articles(self, article_ids: List[int], batch_size: int = 100) -> List[int]:
+        """Xóa mọi bản ghi (nguyên bài và mọi chunk) của các bài viết, theo lô `batch_size` bài.
+        Trả về id các bài xóa lỗi."""
+        return self._delete_by_article(
+            [(int(a), 0) for a in article_ids],
+            lambda a, _: f"(id == {a} or (id >= {chunk_id(a, 0)} and id < {chunk_id(a + 1, 0)}))",
+            batch_size, "bản ghi",
+        )
+
+    def scan_article_ids(self, batch_size: int = 10000) -> set:
+        """Tập id bài viết đang có trong collection: quét khóa chính theo trang bằng query_iterator
+        (chỉ trường id, không tra từng bài), chunk được quy về id bài viết."""
+        article_ids = set()
+        iterator = self.vector_store.client.query_iterator(
+            collection_name=self.collection_name, batch_size=batch_size, output_fields=["id"]
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                article_ids.update(article_id_of(row["id"]) for row in rows)
+        finally:
+            iterator.close()
+        return article_ids
+
+    def store_articles(self, documents: list[Document], batch_size: int = 64, max_workers: int = 4,
+                       max_retries: int = 5, replace: bool = False) -> Dict[str, Any]:
+        """Ghi các bài viết (document tạo bởi `load_html_to_markdown`) vào Milvus, chia chunk nếu bật `chunk_size`.
+
+        Chunk đầu của mỗi bài (mang fingerprint mà vdb_ndh_sync dùng để so khớp) được ghi sau cùng, chỉ khi
+        mọi chunk còn lại của bài đã ghi thành công, nên bài ghi dở luôn bị coi là chưa đồng bộ và được làm lại.
+        `replace=True` (cập nhật bài đã có): upsert, rồi chỉ với các bài đã ghi xong chunk đầu mới xóa các bản
+        ghi cũ không còn dùng của bài, để ghi lỗi giữa chừng không bao giờ làm bài mất cả bản ghi cũ lẫn mới.
+
+        Returns thống kê theo bài viết: inserted, failed, failed_ids, chunks, seconds, docs_per_sec.
+        """
+        start = time.perf_counter()
+        article_chunks = self.split_documents(documents)
+        failed = set()
+        rest = [chunk for chunks in article_chunks for chunk in chunks[1:]]
+        if rest:
+            report = self.store_documents_batched(rest, batch_size, max_workers, max_retries, upsert=replace)
+            failed.update(article_id_of(pk) for pk in report["failed_ids"])
+        heads = [chunks[0] for chunks in article_chunks if article_id_of(chunks[0].metadata["id"]) not in failed]
+        report = self.store_documents_batched(heads, batch_size, max_workers, max_retries, upsert=replace)
+        failed.update(article_id_of(pk) for pk in report["failed_ids"])
+        written = [
+            (article_id_of(chunks[0].metadata["id"]), len(chunks)) for chunks in article_chunks
+            if article_id_of(chunks[0].metadata["id"]) not in failed
+        ]
+        if replace and written:
+            failed.update(self._delete_stale(written))
+        seconds = time.perf_counter() - start
+        inserted = len(documents) - len(failed)
+        return {"inserted": inserted, "failed": len(failed), "failed_ids": sorted(failed),
+                "chunks": sum(len(chunks) for chunks in article_chunks), "seconds": seconds,
+                "docs_per_sec": inserted / seconds if seconds > 0 else 0.0}
@@ -1,12 +1,84 @@
 # modules/llm_invoker.py
 from langchain_core.messages import BaseMessage
 from langchain_openai import ChatOpenAI 
-from typing import List
+from typing import Any, Dict, List, Optional
+import asyncio
+import threading
+import httpx
 import logging
 import random
 
+from modules.tracing import span
+
 logger = logging.getLogger("ChatbotNDH")
 
+# Giới hạn số lời gọi LLM chạy đồng thời trong process (None = không giới hạn)
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def set_llm_concurrency_limit(limit: Optional[int]) -> None:
+    global _llm_semaphore
+    _llm_semaphore = asyncio.Semaphore(limit) if limit else None
+
+
+class ChatModelPool:
+    """Giữ các client ChatOpenAI dùng lâu dài theo tên model.
+
+    Tất cả client dùng chung một httpx transport keep-alive nên các lời gọi sinh SQL
+    và vòng retry tái sử dụng kết nối/TLS session thay vì mở mới mỗi request.
+    """
+    def __init__(self, llm_cfg: Dict[str, Any]):
+        self.llm_cfg = llm_cfg
+        self.default_model = llm_cfg['model_4_1']
+        # chỉ cho phép override sang các model đã khai báo trong config (model_*)
+        self.allowed_models = {v for k, v in llm_cfg.items() if k.startswith("model_") and v}
+        limits = httpx.Limits(
+            max_connections=llm_cfg.get('max_connections', 50),
+            max_keepalive_connections=llm_cfg.get('max_keepalive_connections', 20),
+            keepalive_expiry=llm_cfg.get('keepalive_expiry', 60),
+        )
+        timeout = httpx.Timeout(llm_cfg.get('timeout', 60))
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self._models: Dict[str, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+        set_llm_concurrency_limit(llm_cfg.get('max_concurrency'))
+
+    def _create(self, model_name: str) -> ChatOpenAI:
+        kwargs: Dict[str, Any] = {}
+        if self.llm_cfg.get('openai_api_key'):
+            kwargs['api_key'] = self.llm_cfg['openai_api_key']
+        return ChatOpenAI(
+            model_name=model_name,
+            temperature=self.llm_cfg['temperature'],
+            streaming=self.llm_cfg['streaming'],
+            max_retries=self.llm_cfg.get('max_retries', 2),
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+            **kwargs,
+        )
+
+    def get(self, model_name: Optional[str] = None, temperature: Optional[float] = None):
+        """Lấy client cho model (mặc định `model_4_1`), có thể override temperature theo request."""
+        if model_name and model_name not in self.allowed_models:
+            logger.info(f"Model '{model_name}' không có trong config, dùng model mặc định {self.default_model}")
+            model_name = None
+        model_name = model_name or self.default_model
+        llm = self._models.get(model_name)
+        if llm is None:
+            with self._lock:
+                llm = self._models.get(model_name)
+                if llm is None:
+                    llm = self._create(model_name)
+                    self._models[model_name] = llm
+        if temperature is not None and temperature != llm.temperature:
+            return llm.bind(temperature=temperature)
+        return llm
+
+    async def aclose(self) -> None:
+        await self.http_async_client.aclose()
+        self.http_client.close()
+
 # async def invoke_llm_streamingly(llm: ChatOpenAI, messages: List[BaseMessage]) -> AsyncGenerator[str, None]:
 #     try:
 #         async for token_chunk in llm.astream(messages):
@@ -19,11 +91,21 @@ logger = logging.getLogger("ChatbotNDH")
 #         yield random.choice(ERRORS)
 
 async def invoke_llm_for_full_response(llm: ChatOpenAI,messages: List[BaseMessage]) -> str:
-    try:
-        response = await llm.ainvoke(messages)
-        if hasattr(response, 'content'):
-            return response.content.strip()
-        return str(response).strip()
-    except Exception as e:
-        logger.exception(f"Error calling LLM for full response: {e}")
-        return ""
\ No newline at end of file
+    with span("invoke_llm_for_full_response", model=getattr(llm, "model_name", None)) as llm_span:
+        try:
+            if _llm_semaphore is not None:
+                async with _llm_semaphore:
+                    response = await llm.ainvoke(messages)
+            else:
+                response = await llm.ainvoke(messages)
+            # số token của lời gọi (langchain điền usage_metadata từ phản hồi OpenAI)
+            usage = getattr(response, "usage_metadata", None) or {}
+            llm_span.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"),
+                         total_tokens=usage.get("total_tokens"))
+            if hasattr(response, 'content'):
+                return response.content.strip()
+            return str(response).strip()
+        except Exception as e:
+            logger.exception(f"Error calling LLM for full response: {e}")
+            llm_span.set(error=str(e))
+            return ""
\ No newline at end of file
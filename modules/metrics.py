@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("ChatbotNDH")
+
+# Biên bucket (ms) mặc định cho histogram độ trễ: từ lần tra cache vài ms tới lời gọi LLM cả phút
+DEFAULT_MS_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+# collector: hàm gọi lúc xuất metrics, trả về [(tên, kiểu, mô tả, [(nhãn, giá trị), ...]), ...]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+# họ metric: (tên, kiểu, mô tả, [(tên mẫu, nhãn, giá trị), ...]); histogram có các mẫu _bucket / _sum / _count
+Family = Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: cần đúng các nhãn {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues, **extra: str) -> Dict[str, str]:
+        return {**dict(zip(self.labelnames, key)), **extra}
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng (số lần retry, số bài đã đồng bộ...)."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Giá trị tức thời (tốc độ đồng bộ của lần chạy gần nhất...)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị theo bucket cộng dồn (le), kèm _sum và _count như histogram của Prometheus."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_MS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # mỗi bộ nhãn: [số mẫu theo bucket (không cộng dồn, phần tử cuối là +Inf), tổng]
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Đo thời gian (ms) của khối lệnh, ghi nhận cả khi khối lệnh ném lỗi."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", self._labels(key, le=_format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", self._labels(key), total))
+            samples.append((f"{self.name}_count", self._labels(key), cumulative))
+        return samples
+
+
+class Registry:
+    """Tập metrics của process; `render()` xuất theo định dạng text của Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} đã được khai báo với kiểu / nhãn khác")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_MS_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Collector) -> None:
+        """Thêm hàm sinh metrics lúc xuất (vd đọc stats() của các cache thay vì đếm lại ở từng chỗ)."""
+        self._collectors.append(collector)
+
+    def families(self) -> List[Family]:
+        """Mọi họ metric hiện có: (tên, kiểu, mô tả, [(tên mẫu, nhãn, giá trị), ...])."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families: List[Family] = [
+            (metric.name, metric.kind, metric.documentation, metric.samples()) for metric in metrics
+        ]
+        for collector in self._collectors:
+            try:
+                families.extend(
+                    (name, kind, documentation, [(name, labels, value) for labels, value in values])
+                    for name, kind, documentation, values in collector()
+                )
+            except Exception as e:
+                logger.info(f"⭕ Lỗi khi thu thập metrics: {e}")
+        return families
+
+    def render(self, extra_families: Iterable[Family] = ()) -> str:
+        """Định dạng text của Prometheus; mẫu của `extra_families` (vd của job khác) được gộp vào họ cùng tên."""
+        merged: Dict[str, Family] = {}
+        for name, kind, documentation, samples in [*self.families(), *extra_families]:
+            if name in merged:
+                merged[name][3].extend(samples)
+            else:
+                merged[name] = (name, kind, documentation, list(samples))
+        lines: List[str] = []
+        for name, kind, documentation, samples in merged.values():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{sample}{_format_labels(labels)} {_format_value(value)}" for sample, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path: str) -> None:
+        """Ghi các họ metric ra file JSON (ghi file tạm rồi os.replace), dùng cho các job đồng bộ chạy ở
+        process riêng: /metrics của retrieval_app đọc lại các file này bằng `load_snapshots`."""
+        file_path = Path(path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(self.families(), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, file_path)
+
+
+REGISTRY = Registry()
+
+
+def load_snapshots(directory: Optional[str]) -> List[Family]:
+    """Các họ metric do job khác ghi ở `<directory>/<job>.json`, mỗi mẫu được gắn thêm nhãn process=<job>
+    để không trùng với mẫu cùng tên của process đang chạy."""
+    if not directory or not Path(directory).is_dir():
+        return []
+    families: List[Family] = []
+    for file_path in sorted(Path(directory).glob("*.json")):
+        try:
+            snapshot = json.loads(file_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.info(f"⭕ Không đọc được file metrics {file_path}: {e}")
+            continue
+        families.extend(
+            (name, kind, documentation,
+             [(sample, {**labels, "process": file_path.stem}, value) for sample, labels, value in samples])
+            for name, kind, documentation, samples in snapshot
+        )
+    return families
+
+
+def export_snapshot(directory: Optional[str], job: str) -> None:
+    """Ghi metrics của process hiện tại ra `<directory>/<job>.json` (không làm hỏng job nếu ghi lỗi)."""
+    if not directory:
+        return
+    try:
+        REGISTRY.write_snapshot(str(Path(directory) / f"{job}.json"))
+    except OSError as e:
+        logger.info(f"⭕ Không ghi được file metrics của {job}: {e}")
+
+
+# Metrics theo từng chặng xử lý
+REQUEST_MS = REGISTRY.histogram("ndh_request_ms", "Thời gian xử lý request API (ms)", ("endpoint", "status"))
+EMBED_MS = REGISTRY.histogram("ndh_embed_ms", "Thời gian tạo embedding (ms)", ("op",))
+EMBED_RETRIES = REGISTRY.counter("ndh_embed_retry_total", "Số lần thử lại lời gọi embedding do lỗi tạm thời")
+MILVUS_SEARCH_MS = REGISTRY.histogram("ndh_milvus_search_ms", "Thời gian hybrid search trên Milvus (ms)")
+LLM_SQL_GEN_MS = REGISTRY.histogram("ndh_llm_sql_gen_ms", "Thời gian LLM sinh câu SQL (ms)", ("stage",))
+SQL_EXEC_MS = REGISTRY.histogram("ndh_sql_exec_ms", "Thời gian thực thi SQL trên PostgreSQL (ms)", ("status",))
+SQL_RETRIES = REGISTRY.counter("ndh_sql_retry_total", "Số lần sinh lại SQL sau khi câu trước lỗi / không có dữ liệu")
+HTML_CONVERT_MS = REGISTRY.histogram("ndh_html_convert_ms", "Thời gian chuyển một lô HTML -> Markdown (ms)")
+SYNC_DOCS = REGISTRY.counter("ndh_sync_docs_total", "Số bài viết được các job đồng bộ xử lý", ("sync", "result"))
+SYNC_DOCS_PER_SEC = REGISTRY.gauge("ndh_sync_docs_per_sec", "Tốc độ ghi vector store của lần đồng bộ gần nhất", ("sync",))
+SYNC_RUN_MS = REGISTRY.histogram("ndh_sync_run_ms", "Thời gian một lần chạy job đồng bộ (ms)", ("sync",),
+                                 buckets=(1000, 5000, 15000, 60000, 300000, 900000, 3600000, 10800000))
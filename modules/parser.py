@@ -1,8 +1,19 @@
 import bs4
-from markdownify import markdownify as md
+from concurrent.futures import Executor, ProcessPoolExecutor
+from markdownify import MarkdownConverter, markdownify as md
+from typing import List, Optional
 import urllib.parse
 
 
+MAX_URL_LENGTH = 300
+
+# markdownify đổi cách render khi thẻ nằm trong các thẻ này (danh sách lồng, ô bảng, tiêu đề, code...),
+# nên thẻ có tổ tiên thuộc nhóm này vẫn được chuyển đổi tách rời như v3 để giữ nguyên kết quả.
+_CONTEXT_SENSITIVE_TAGS = frozenset({
+    'ul', 'ol', 'li', 'td', 'th', 'pre', 'code', 'kbd', 'samp',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+})
+
 
 def convert_html_to_markdown_v3(html_string: str, base_domain: str = "https://nguoidonghanh.viettel.vn") -> str:
     """
@@ -105,4 +116,170 @@ def convert_html_to_markdown_v3(html_string: str, base_domain: str = "https://ng
         if part not in final_output:
             final_output.append(part)
             
-    return "\n\n".join(final_output)
\ No newline at end of file
+    return "\n\n".join(final_output)
+
+
+def _encode_url(url: str) -> str:
+    if not url:
+        return ""
+    scheme, netloc, path, params, query, fragment = urllib.parse.urlparse(url)
+    path = urllib.parse.quote(path)
+    return urllib.parse.urlunparse((scheme, netloc, path, params, query, fragment))
+
+
+class _InPlaceMarkdownConverter(MarkdownConverter):
+    """
+    markdownify chạy thẳng trên cây BeautifulSoup đã parse (không str() rồi parse lại),
+    đồng thời nhớ kết quả của các thẻ p/div đích: div ngoài đã chuyển đổi div con bên trong
+    nên khi tới lượt div con chỉ cần lấy lại kết quả.
+    """
+    def __init__(self, memo_ids: set, **options):
+        super().__init__(**options)
+        self._memo_ids = memo_ids
+        self._memo = {}
+
+    def process_tag(self, node, parent_tags=None):
+        text = self._memo.get(id(node))
+        if text is None:
+            text = super().process_tag(node, parent_tags=parent_tags)
+            if id(node) in self._memo_ids:
+                self._memo[id(node)] = text
+        return text
+
+    def convert_element(self, element) -> str:
+        # tương đương md(str(element)).strip(): thẻ là con duy nhất của "[document]"
+        return self.process_tag(element, parent_tags={'[document]'}).strip()
+
+
+def convert_html_to_markdown_v4(html_string: str, base_domain: str = "https://nguoidonghanh.viettel.vn") -> str:
+    """
+    Bản nhanh hơn của `convert_html_to_markdown_v3`, cho kết quả giống hệt:
+
+    - Duyệt cây một lần để gom thẻ a / img / p, table, div (v3 gọi find_all ba lần).
+    - Chuyển đổi thẻ trực tiếp trên cây thay vì md(str(element)) (serialize + parse lại từng đoạn),
+      div lồng nhau dùng lại kết quả đã tính khi chuyển div cha.
+    - Loại trùng bằng dict thay vì quét list O(n²).
+
+    Args:
+        html_string: Chuỗi HTML đầu vào.
+        base_domain: Tên miền để thêm vào trước các đường dẫn tương đối.
+
+    Returns:
+        Chuỗi đã được định dạng Markdown.
+    """
+    soup = bs4.BeautifulSoup(html_string, 'lxml')
+
+    links, images, elements = [], [], []
+    for tag in soup.find_all(True):
+        if tag.name == 'a':
+            links.append(tag)
+        elif tag.name == 'img':
+            images.append(tag)
+        elif tag.name in ('p', 'table', 'div'):
+            elements.append(tag)
+
+    # --- BƯỚC 1: TIỀN XỬ LÝ - giống v3 ---
+    modified_parents = {}
+    for a_tag in links:
+        href = a_tag.get('href')
+        if href and len(href) > MAX_URL_LENGTH:
+            modified_parents[id(a_tag.parent)] = a_tag.parent
+            a_tag.unwrap()
+
+    for img in images:
+        src = img.get('src')
+        if src and len(src) <= MAX_URL_LENGTH:
+            if not src.startswith('/'):
+                continue
+            full_url = urllib.parse.urljoin(base_domain, src)
+            if len(full_url) <= MAX_URL_LENGTH:
+                img['src'] = full_url
+                continue
+        # không có src hoặc URL quá dài: bỏ hẳn thẻ img
+        modified_parents[id(img.parent)] = img.parent
+        img.decompose()
+
+    # get_text(strip=True) của v3 chạy trên cây chưa gộp text nên lấy trước khi smooth() bên dưới
+    element_texts = {}
+    for element in elements:
+        if element.name != 'table':
+            element_texts[id(element)] = element.get_text(strip=True)
+        elif 'table-image' in element.get('class', []):
+            caption_td = element.find('td', class_='image-caption')
+            element_texts[id(element)] = caption_td.get_text(strip=True) if caption_td else None
+
+    # còn md(str(element)) của v3 parse lại HTML nên các đoạn text liền kề sau unwrap/decompose
+    # được gộp làm một; gộp tương tự để markdownify xử lý khoảng trắng giống hệt.
+    for parent in modified_parents.values():
+        parent.smooth()
+
+    # --- BƯỚC 2: CHUYỂN ĐỔI SANG MARKDOWN ---
+    in_place = {
+        id(element) for element in elements
+        if element.name != 'table'
+        and not any(parent.name in _CONTEXT_SENSITIVE_TAGS for parent in element.parents)
+    }
+    converter = _InPlaceMarkdownConverter(in_place)
+    markdown_parts = []
+
+    for element in elements:
+        if element.name == 'table':
+            if 'table-image' not in element.get('class', []):
+                continue
+            img_tag = element.find('img')
+            if img_tag:
+                alt_text = img_tag.get('caption', img_tag.get('alt', '')).strip()
+                markdown_parts.append(f"![{alt_text}]({_encode_url(img_tag.get('src', ''))})")
+                caption_text = element_texts[id(element)]
+                if caption_text is not None:
+                    markdown_parts.append(caption_text)
+            continue
+
+        element_text = element_texts[id(element)]
+        img_in_element = element.find('img')
+        if img_in_element:
+            alt_text = img_in_element.get('caption', img_in_element.get('alt', '')).strip()
+            src = _encode_url(img_in_element.get('src', ''))
+            if src:
+                markdown_parts.append(f"![{alt_text}]({src})")
+            if element_text and (not markdown_parts or markdown_parts[-1] != element_text):
+                if element_text != '\xa0':
+                    markdown_parts.append(element_text)
+        elif element_text or element.find(True):
+            if element_text == '\xa0':
+                continue
+            if id(element) in in_place:
+                p_markdown = converter.convert_element(element)
+            else:
+                p_markdown = md(str(element)).strip()
+            if p_markdown:
+                markdown_parts.append(p_markdown)
+
+    return "\n\n".join(dict.fromkeys(markdown_parts))
+
+
+def convert_many_html_to_markdown(
+    html_list: List[str],
+    max_workers: Optional[int] = None,
+    chunksize: int = 16,
+    executor: Optional[Executor] = None,
+) -> List[str]:
+    """
+    Chuyển đổi nhiều bài viết HTML sang Markdown song song bằng process pool
+    (BeautifulSoup + markdownify tốn CPU nên thread không tận dụng được nhiều core).
+
+    Args:
+        html_list: Danh sách chuỗi HTML, kết quả trả về giữ đúng thứ tự.
+        max_workers: Số process; <= 1 thì chạy tuần tự trong process hiện tại.
+        chunksize: Số bài gửi cho mỗi process mỗi lần, giảm chi phí IPC với bài ngắn.
+        executor: Pool có sẵn để tái sử dụng giữa các lần gọi (nếu có thì bỏ qua max_workers).
+
+    Returns:
+        Danh sách chuỗi Markdown.
+    """
+    if executor is None and (not max_workers or max_workers <= 1 or len(html_list) <= chunksize):
+        return [convert_html_to_markdown_v4(html) for html in html_list]
+    if executor is not None:
+        return list(executor.map(convert_html_to_markdown_v4, html_list, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(convert_html_to_markdown_v4, html_list, chunksize=chunksize))
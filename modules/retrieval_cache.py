@@ -0,0 +1,127 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from modules.cache import TTLCache, normalize_text
+
+logger = logging.getLogger("ChatbotNDH")
+
+DEFAULT_GENERATION_FILE = "cache/retrieval_cache.generation"
+
+SearchResult = List[Tuple[Document, float]]
+
+
+def invalidate_retrieval_cache(generation_file: str = DEFAULT_GENERATION_FILE) -> None:
+    """Báo cho mọi process đang phục vụ /retrieval rằng dữ liệu bài viết đã thay đổi.
+
+    Các job đồng bộ chạy ở process riêng nên không xóa trực tiếp được cache trong bộ nhớ
+    của API; thay vào đó ghi một "generation" mới ra file, cache sẽ tự xóa khi thấy file đổi.
+    """
+    path = Path(generation_file)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(str(time.time_ns()), encoding="utf-8")
+        os.replace(tmp_path, path)
+        logger.info(f"🧹 Đã đánh dấu làm mới cache /retrieval ({path})")
+    except Exception as e:
+        logger.info(f"⭕ Không thể làm mới cache /retrieval: {e}")
+
+
+class RetrievalCache:
+    """Cache kết quả /retrieval theo (câu hỏi chuẩn hóa, top_k, score_threshold).
+
+    - Tầng exact: tra dict, không cần embedding.
+    - Tầng near-hit (tùy chọn): khi câu hỏi khác chữ nhưng embedding có cosine >= near_hit_threshold
+      với một câu đã cache cùng top_k/score_threshold thì dùng lại kết quả, bỏ qua Milvus.
+    - Cache bị xóa toàn bộ khi file generation do job đồng bộ ghi thay đổi.
+    """
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 600,
+        near_hit_threshold: Optional[float] = None,
+        generation_file: str = DEFAULT_GENERATION_FILE,
+        generation_check_interval: float = 1.0,
+    ):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.near_hit_threshold = near_hit_threshold
+        self.generation_file = generation_file
+        self.generation_check_interval = generation_check_interval
+        self.near_hits = 0
+        self._generation = self._read_generation()
+        self._next_generation_check = time.monotonic() + generation_check_interval
+
+    @classmethod
+    def from_config(cls, cache_cfg: Dict[str, Any]) -> Optional["RetrievalCache"]:
+        if not cache_cfg or not cache_cfg.get("enabled", False):
+            return None
+        return cls(
+            max_entries=cache_cfg.get("max_entries", 1000),
+            ttl_seconds=cache_cfg.get("ttl_seconds", 600),
+            near_hit_threshold=cache_cfg.get("near_hit_threshold"),
+            generation_file=cache_cfg.get("generation_file", DEFAULT_GENERATION_FILE),
+            generation_check_interval=cache_cfg.get("generation_check_interval", 1.0),
+        )
+
+    def _read_generation(self):
+        try:
+            stat = os.stat(self.generation_file)
+            return stat.st_mtime_ns, stat.st_ino
+        except FileNotFoundError:
+            return None
+
+    def _check_generation(self) -> None:
+        now = time.monotonic()
+        if now < self._next_generation_check:
+            return
+        self._next_generation_check = now + self.generation_check_interval
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._cache.clear()
+            logger.info("🧹 Dữ liệu bài viết đã thay đổi, xóa cache /retrieval")
+
+    @staticmethod
+    def make_key(query: str, top_k: int, score_threshold: float, extra: Sequence = ()) -> tuple:
+        return (normalize_text(query), int(top_k), float(score_threshold or 0), *extra)
+
+    def get(self, key: tuple) -> Optional[SearchResult]:
+        self._check_generation()
+        entry = self._cache.get(key)
+        return entry[1] if entry is not None else None
+
+    def get_similar(self, key: tuple, embedding: Sequence[float]) -> Optional[SearchResult]:
+        """Tìm kết quả của câu hỏi gần giống (cùng các tham số ngoài câu hỏi) theo cosine embedding."""
+        if not self.near_hit_threshold or embedding is None:
+            return None
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vec)
+        if not query_norm:
+            return None
+        best_score, best_result = 0.0, None
+        for cached_key, (cached_vec, cached_result) in self._cache.items():
+            if cached_vec is None or cached_key[1:] != key[1:]:
+                continue
+            score = float(np.dot(query_vec, cached_vec) / (query_norm * np.linalg.norm(cached_vec)))
+            if score > best_score:
+                best_score, best_result = score, cached_result
+        if best_result is not None and best_score >= self.near_hit_threshold:
+            self.near_hits += 1
+            return best_result
+        return None
+
+    def set(self, key: tuple, result: SearchResult, embedding: Optional[Sequence[float]] = None) -> None:
+        vec = np.asarray(embedding, dtype=np.float32) if embedding is not None and self.near_hit_threshold else None
+        self._cache.set(key, (vec, result))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "near_hits": self.near_hits}
@@ -0,0 +1,46 @@
+import json
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Union
+
+# Trường có index vô hướng (INVERTED) để lọc metadata ngay trong Milvus
+FILTER_FIELDS = ("category_name", "author", "published_time", "is_hot", "is_top", "is_important")
+FLAG_FIELDS = ("is_hot", "is_top", "is_important")
+
+
+def _quote(value: str) -> str:
+    # chuỗi JSON (dấu nháy kép, escape \\ và ") cũng là literal chuỗi hợp lệ trong biểu thức Milvus
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def _in_or_eq(field: str, values: Union[str, Iterable[str]]) -> Optional[str]:
+    values = [values] if isinstance(values, str) else [v for v in values if v]
+    if not values:
+        return None
+    if len(values) == 1:
+        return f"{field} == {_quote(values[0])}"
+    return f"{field} in [{', '.join(_quote(v) for v in values)}]"
+
+
+def build_filter_expr(category_name: Union[str, List[str], None] = None, author: Optional[str] = None,
+                      published_from: Optional[date] = None, published_to: Optional[date] = None,
+                      is_hot: Optional[bool] = None, is_top: Optional[bool] = None,
+                      is_important: Optional[bool] = None) -> Optional[str]:
+    """Dịch các điều kiện lọc của /retrieval thành biểu thức boolean của Milvus (None = không lọc).
+
+    published_time lưu dạng chuỗi ISO nên khoảng ngày được so sánh theo thứ tự chuỗi;
+    `published_to` tính trọn ngày (< ngày hôm sau).
+    """
+    clauses: List[str] = []
+    if category_name:
+        clauses.append(_in_or_eq("category_name", category_name))
+    if author:
+        clauses.append(_in_or_eq("author", author))
+    if published_from:
+        clauses.append(f"published_time >= {_quote(published_from.isoformat())}")
+    if published_to:
+        clauses.append(f"published_time < {_quote((published_to + timedelta(days=1)).isoformat())}")
+    for field, flag in zip(FLAG_FIELDS, (is_hot, is_top, is_important)):
+        if flag is not None:
+            clauses.append(f"{field} == {int(bool(flag))}")
+    clauses = [clause for clause in clauses if clause]
+    return " and ".join(clauses) if clauses else None
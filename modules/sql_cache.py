@@ -0,0 +1,92 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from modules.cache import TTLCache, normalize_text
+
+logger = logging.getLogger("ChatbotNDH")
+
+
+class SqlPlanCache:
+    """Cache các câu SQL đã chạy thành công, khóa theo câu hỏi tiếng Việt đã chuẩn hóa.
+
+    - Tra exact theo (bảng, câu hỏi chuẩn hóa) trước.
+    - Nếu bật `similarity_threshold` và có embeddings: tra tiếp theo cosine của embedding câu hỏi,
+      chỉ dùng lại SQL khi độ tương đồng rất cao (vd "top 5" và "top 10" phải là hai câu khác nhau).
+    - Loại bỏ theo LRU + TTL (câu SQL cũ có thể không còn đúng khi dữ liệu/schema thay đổi).
+    """
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 86400,
+                 similarity_threshold: Optional[float] = None, embeddings=None):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.similarity_threshold = similarity_threshold if embeddings is not None else None
+        self.embeddings = embeddings
+        self.semantic_hits = 0
+
+    @classmethod
+    def from_config(cls, cache_cfg: Dict[str, Any], embeddings=None) -> Optional["SqlPlanCache"]:
+        if not cache_cfg or not cache_cfg.get("enabled", False):
+            return None
+        return cls(
+            max_entries=cache_cfg.get("max_entries", 2000),
+            ttl_seconds=cache_cfg.get("ttl_seconds", 86400),
+            similarity_threshold=cache_cfg.get("similarity_threshold"),
+            embeddings=embeddings,
+        )
+
+    @staticmethod
+    def make_key(question: str, table_name: str) -> tuple:
+        return (table_name, normalize_text(question))
+
+    async def lookup(self, question: str, table_name: str) -> Tuple[Optional[str], Optional[List[float]], Optional[tuple]]:
+        """Trả về (sql, embedding câu hỏi, khóa cache khớp).
+
+        embedding được trả lại để dùng khi `store` (tránh embed 2 lần), khóa khớp dùng cho `invalidate`.
+        """
+        key = self.make_key(question, table_name)
+        entry = self._cache.get(key)
+        if entry is not None:
+            return entry["sql"], entry["embedding"], key
+        if not self.similarity_threshold:
+            return None, None, None
+        try:
+            embedding = await self.embeddings.aembed_query(key[1])
+        except Exception as e:
+            logger.info(f"⭕ Không thể embed câu hỏi cho SQL cache: {e}")
+            return None, None, None
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vec)
+        best_score, best_key, best_sql = 0.0, None, None
+        for cached_key, cached in self._cache.items():
+            if cached_key[0] != table_name or cached["embedding"] is None or not query_norm:
+                continue
+            cached_vec = cached["embedding"]
+            score = float(np.dot(query_vec, cached_vec) / (query_norm * np.linalg.norm(cached_vec)))
+            if score > best_score:
+                best_score, best_key, best_sql = score, cached_key, cached["sql"]
+        if best_sql is not None and best_score >= self.similarity_threshold:
+            self.semantic_hits += 1
+            logger.info(f"SQL cache: dùng lại SQL của câu hỏi tương tự (cosine={best_score:.3f})")
+            return best_sql, embedding, best_key
+        return None, embedding, None
+
+    def store(self, question: str, table_name: str, sql: str, embedding: Optional[List[float]] = None) -> None:
+        vec = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+        self._cache.set(self.make_key(question, table_name), {"sql": sql, "embedding": vec})
+
+    def invalidate(self, key: tuple) -> None:
+        self._cache.pop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        # hit tính cả exact lẫn semantic; miss của tầng exact có thể thành semantic hit
+        hits = stats["hits"] + self.semantic_hits
+        misses = stats["misses"] - self.semantic_hits
+        total = hits + misses
+        return {
+            **stats,
+            "hits": hits,
+            "misses": misses,
+            "semantic_hits": self.semantic_hits,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+        }
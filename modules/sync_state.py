@@ -0,0 +1,34 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Sequence
+
+logger = logging.getLogger("ChatbotNDH")
+
+
+def content_hash(values: Sequence[Any]) -> str:
+    """Hash ổn định của một bản ghi (datetime, JSON... được chuyển thành chuỗi trước khi băm)."""
+    payload = json.dumps(list(values), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def load_sync_state(path: str) -> Dict[str, Any]:
+    """Đọc trạng thái (watermark, lần đồng bộ toàn bộ gần nhất...) của job đồng bộ, chưa có thì trả {}."""
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.info(f"⭕ Không đọc được trạng thái đồng bộ {path}, coi như chạy lần đầu: {e}")
+        return {}
+
+
+def save_sync_state(path: str, state: Dict[str, Any]) -> None:
+    """Ghi trạng thái ra file tạm rồi os.replace để không bao giờ để lại file ghi dở."""
+    file_path = Path(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    os.replace(tmp_path, file_path)
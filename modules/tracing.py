@@ -0,0 +1,267 @@
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+logger = logging.getLogger("ChatbotNDH")
+
+DEFAULT_OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+
+
+class Span:
+    """Một chặng xử lý trong request: tên, thời điểm bắt đầu / kết thúc (ns), thuộc tính và trạng thái lỗi."""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+            "start": self.start_ns / 1e9, "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes, "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Trả về khi tracing tắt hoặc request không được lấy mẫu: mọi thao tác đều bỏ qua."""
+    trace_id = None
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+# span đang chạy của request hiện tại; contextvars đi theo cả await lẫn asyncio.to_thread
+_current_span: ContextVar[Any] = ContextVar("ndh_current_span", default=None)
+
+
+class SpanExporter:
+    """Gom span đã kết thúc vào hàng đợi có giới hạn, thread nền xuất theo lô để request không phải chờ I/O.
+    Hàng đợi đầy thì bỏ span (đếm ở `dropped`) thay vì chặn request."""
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 256, flush_interval: float = 2.0):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="span_exporter", daemon=True)
+        self._worker.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch: List[Span] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    logger.info(f"⭕ Không xuất được {len(batch)} span: {e}")
+
+    def write(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Xuất nốt các span còn trong hàng đợi rồi dừng thread nền."""
+        self._stop.set()
+        self._worker.join(timeout)
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Mỗi span một dòng JSON (trace_id, span_id, parent_id, name, start, duration_ms, attributes, error)."""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def write(self, spans: List[Span]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in spans)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Gửi span tới OpenTelemetry Collector qua OTLP/HTTP (JSON), vd http://localhost:4318/v1/traces."""
+
+    def __init__(self, endpoint: str = DEFAULT_OTLP_ENDPOINT, service_name: str = "via-ndh", **kwargs):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._client = httpx.Client(timeout=5.0)
+        super().__init__(**kwargs)
+
+    def _encode(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "via-ndh.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                    "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                } for span in spans],
+            }],
+        }]}
+
+    def write(self, spans: List[Span]) -> None:
+        self._client.post(self.endpoint, json=self._encode(spans)).raise_for_status()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        super().shutdown(timeout)
+        self._client.close()
+
+
+_exporter: Optional[SpanExporter] = None
+_sample_ratio = 1.0
+
+
+def configure_tracing(tracing_cfg: Optional[Dict[str, Any]]) -> None:
+    """Bật tracing theo mục `tracing` của config (tắt nếu không có hoặc enabled = false)."""
+    global _exporter, _sample_ratio
+    shutdown_tracing()
+    if not tracing_cfg or not tracing_cfg.get("enabled", False):
+        return
+    kwargs = {
+        "max_queue": tracing_cfg.get("max_queue", 10000),
+        "batch_size": tracing_cfg.get("batch_size", 256),
+        "flush_interval": tracing_cfg.get("flush_interval", 2.0),
+    }
+    exporter = tracing_cfg.get("exporter", "jsonl")
+    if exporter == "otlp":
+        _exporter = OtlpHttpSpanExporter(
+            tracing_cfg.get("otlp_endpoint", DEFAULT_OTLP_ENDPOINT),
+            service_name=tracing_cfg.get("service_name", "via-ndh"), **kwargs,
+        )
+    elif exporter == "jsonl":
+        _exporter = JsonlSpanExporter(tracing_cfg.get("jsonl_path", "logs/traces.jsonl"), **kwargs)
+    else:
+        raise ValueError(f"tracing.exporter không hợp lệ: {exporter} (chọn 'jsonl' hoặc 'otlp')")
+    _sample_ratio = float(tracing_cfg.get("sample_ratio", 1.0))
+    logger.info(f"🔭 Tracing bật: exporter={exporter}, sample_ratio={_sample_ratio}")
+
+
+def shutdown_tracing() -> None:
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        if _exporter.dropped:
+            logger.info(f"⚠️  Tracing đã bỏ {_exporter.dropped} span do hàng đợi đầy")
+        _exporter = None
+
+
+def current_span():
+    """Span đang chạy (NOOP_SPAN nếu không có) để gắn thêm thuộc tính, vd số token của lời gọi LLM."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    return current_span().trace_id
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Any]:
+    """Mở một span con của span hiện tại (hoặc span gốc của request, với `trace_id` cho trước nếu có).
+
+    Tracing tắt / request không được lấy mẫu (`tracing.sample_ratio`) thì trả NOOP_SPAN và không tạo span con.
+    """
+    parent = _current_span.get()
+    if _exporter is None or parent is NOOP_SPAN or (parent is None and random.random() >= _sample_ratio):
+        token = _current_span.set(NOOP_SPAN) if parent is None else None
+        try:
+            yield NOOP_SPAN
+        finally:
+            if token is not None:
+                _current_span.reset(token)
+        return
+    current = Span(name, parent.trace_id if parent else (trace_id or new_trace_id()),
+                   parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(current)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator bọc hàm (đồng bộ hoặc async) trong một span mang tên hàm."""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("ChatbotNDH")
+
+VECTOR_FIELD = "vector"
+
+# Tham số build mặc định của từng loại index cho trường vector dày
+INDEX_BUILD_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "FLAT": {},
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024},
+}
+# Tham số tìm kiếm mặc định tương ứng (FLAT không có tham số nào)
+INDEX_SEARCH_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "FLAT": {},
+    "HNSW": {"ef": 64},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16},
+}
+# Không có mục vector_db.index: giữ FLAT như trước (Milvus Lite cũng chỉ hỗ trợ FLAT / IVF_FLAT);
+# config.yaml.example chọn HNSW cho Milvus server
+DEFAULT_INDEX_TYPE = "FLAT"
+DEFAULT_METRIC = "COSINE"
+
+
+def scalar_index_name(field_name: str) -> str:
+    return f"{field_name}_idx"
+
+
+def add_scalar_indexes(index_params, field_names) -> None:
+    """Index INVERTED cho các trường vô hướng hay dùng để lọc (so sánh bằng, in, khoảng)."""
+    for field_name in field_names:
+        index_params.add_index(field_name=field_name, index_name=scalar_index_name(field_name), index_type="INVERTED")
+
+
+def ensure_scalar_indexes(client, collection_name: str, field_names) -> list:
+    """Tạo index vô hướng còn thiếu trên collection đã có (bỏ qua trường không có trong schema, vd dynamic field).
+
+    Trả về danh sách trường vừa được tạo index.
+    """
+    schema_fields = {field["name"] for field in client.describe_collection(collection_name)["fields"]}
+    missing = [
+        field_name for field_name in field_names
+        if field_name in schema_fields and not client.list_indexes(collection_name, field_name=field_name)
+    ]
+    if not missing:
+        return []
+    index_params = client.prepare_index_params()
+    add_scalar_indexes(index_params, missing)
+    client.create_index(collection_name, index_params)
+    logger.info(f"🗂️  Đã tạo index vô hướng cho {missing} trên '{collection_name}'")
+    return missing
+
+
+def vector_index_config(index_cfg: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chuẩn hóa mục `vector_db.index` của config: loại index, metric, tham số build và tham số tìm kiếm."""
+    index_cfg = index_cfg or {}
+    index_type = str(index_cfg.get("type", DEFAULT_INDEX_TYPE)).upper()
+    if index_type not in INDEX_BUILD_DEFAULTS:
+        raise ValueError(f"vector_db.index.type không hỗ trợ: {index_type} (chọn một trong {list(INDEX_BUILD_DEFAULTS)})")
+    return {
+        "index_type": index_type,
+        "metric_type": str(index_cfg.get("metric", DEFAULT_METRIC)).upper(),
+        "params": {**INDEX_BUILD_DEFAULTS[index_type], **(index_cfg.get("params") or {})},
+        "search_params": {**INDEX_SEARCH_DEFAULTS[index_type], **(index_cfg.get("search_params") or {})},
+    }
+
+
+def vector_index_name(index_type: str) -> str:
+    return f"{VECTOR_FIELD}_{index_type.lower()}_idx"
+
+
+def add_vector_index(index_params, index_cfg: Dict[str, Any], field_name: str = VECTOR_FIELD) -> None:
+    """Thêm index của trường vector dày vào `index_params` (MilvusClient.prepare_index_params())."""
+    index_params.add_index(
+        field_name=field_name,
+        index_name=vector_index_name(index_cfg["index_type"]),
+        index_type=index_cfg["index_type"],
+        metric_type=index_cfg["metric_type"],
+        params=index_cfg["params"],
+    )
+
+
+def vector_search_params(index_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Tham số nhánh dense của hybrid search khớp với index đang dùng."""
+    return {"metric_type": index_cfg["metric_type"], "params": dict(index_cfg["search_params"])}
+
+
+def describe_vector_index(client, collection_name: str, field_name: str = VECTOR_FIELD) -> Optional[Dict[str, Any]]:
+    """Index hiện có trên trường vector của collection (None nếu chưa có)."""
+    for name in client.list_indexes(collection_name, field_name=field_name):
+        description = client.describe_index(collection_name, name)
+        if description:
+            return {**description, "index_name": name}
+    return None
+
+
+def _same_index(current: Dict[str, Any], index_cfg: Dict[str, Any]) -> bool:
+    if str(current.get("index_type", "")).upper() != index_cfg["index_type"]:
+        return False
+    if str(current.get("metric_type", "")).upper() != index_cfg["metric_type"]:
+        return False
+    # describe_index trả tham số build dạng chuỗi ở cấp ngoài cùng
+    return all(str(current.get(key)) == str(value) for key, value in index_cfg["params"].items())
+
+
+def wait_for_index(client, collection_name: str, index_name: str, timeout: float = 3600, poll: float = 2.0) -> bool:
+    """Chờ Milvus build xong index (pending_index_rows về 0); trả False nếu quá `timeout` giây."""
+    deadline = time.monotonic() + timeout
+    while True:
+        description = client.describe_index(collection_name, index_name) or {}
+        if not description.get("pending_index_rows"):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll)
+
+
+def rebuild_vector_index(client, collection_name: str, index_cfg: Dict[str, Any], force: bool = False,
+                         timeout: float = 3600) -> bool:
+    """Thay index của trường vector bằng index theo `index_cfg` (dữ liệu giữ nguyên, không cần embed lại).
+
+    Collection phải được release trong lúc drop / tạo index nên tìm kiếm trên collection này gián đoạn
+    cho tới khi build xong. Trả về True nếu đã build lại, False nếu index hiện tại đã đúng cấu hình.
+    """
+    current = describe_vector_index(client, collection_name)
+    if current and not force and _same_index(current, index_cfg):
+        logger.info(f"✅ Index vector của '{collection_name}' đã là {index_cfg['index_type']} {index_cfg['params']}")
+        return False
+    start = time.perf_counter()
+    client.release_collection(collection_name)
+    if current:
+        client.drop_index(collection_name, current["index_name"])
+    index_params = client.prepare_index_params()
+    add_vector_index(index_params, index_cfg)
+    client.create_index(collection_name, index_params)
+    if not wait_for_index(client, collection_name, vector_index_name(index_cfg["index_type"]), timeout=timeout):
+        logger.info(f"⭕ Index vector của '{collection_name}' chưa build xong sau {timeout:.0f}s, vẫn load collection")
+    client.load_collection(collection_name)
+    logger.info(
+        f"🔁 Đã build lại index vector của '{collection_name}': "
+        f"{current.get('index_type') if current else 'không có'} -> {index_cfg['index_type']} {index_cfg['params']} "
+        f"trong {time.perf_counter() - start:.1f}s"
+    )
+    return True
@@ -0,0 +1,271 @@
+"""
+Build lại toàn bộ vector store (đổi model embedding, loại index, cấu hình chunk...) mà không gián đoạn /retrieval.
+
+Nạp toàn bộ bài viết từ PostgreSQL vào một collection mới `<vector_db.collection_name>_<thời điểm>` trong khi
+collection đang phục vụ vẫn nhận truy vấn, bù các bài được thêm / xóa trong lúc nạp, kiểm tra số bài và
+recall trên một mẫu tiêu đề so với collection đang chạy, rồi mới đổi alias `vector_db.collection_name`
+sang collection mới. Collection cũ được giữ lại để quay lui (`--drop-old` để xóa).
+
+Chạy:
+    python rebuild_collection.py               # build, kiểm tra, đổi alias
+    python rebuild_collection.py --no-swap     # chỉ build + kiểm tra
+    python rebuild_collection.py --swap-to via_ndh_20250101120000   # trỏ alias về collection có sẵn (quay lui)
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+from pymilvus import MilvusClient
+from psycopg2 import sql
+
+from agents.agent_vector_search import VecterSearchAgent
+from configs.config import load_config
+from configs.logging_config import logging_options, setup_logging
+from modules.article_store import to_index_item
+from modules.chunker import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE
+from modules.collection_alias import live_collection, shadow_collection_name, swap_alias
+from modules.indexer import IndexService, create_vectorstore
+from modules.retrieval_cache import DEFAULT_GENERATION_FILE, invalidate_retrieval_cache
+from modules.sync_state import load_sync_state, save_sync_state
+from modules.vector_index import vector_index_config, vector_search_params
+
+load_dotenv(dotenv_path=Path(__file__).with_name(".env"), override=False)
+
+cfg = load_config()
+logger = setup_logging(logger_name="rebuild_collection", filename_prefix="rebuild_collection", **logging_options(cfg.get("logging")))
+
+POSTGRES_CONFIG = {
+    "host": os.environ["NDH_PG_HOST"],
+    "port": int(os.getenv("NDH_PG_PORT", 5432)),
+    "user": os.environ["NDH_PG_USER"],
+    "password": os.environ["NDH_PG_PW"],
+    "dbname": os.environ["NDH_PG_DB"],
+}
+SCHEMA_NAME = "via_ndh"
+TABLE_NAME = "data_ndh"
+
+INDEXING_CFG = cfg.get("indexing", {})
+REBUILD_CFG = cfg.get("rebuild", {})
+# số bài đọc từ PostgreSQL mỗi lô; collection mới chưa phục vụ truy vấn nên embed được với nhiều worker hơn
+BATCH_SIZE = REBUILD_CFG.get("batch_size", 500)
+EMBED_WORKERS = REBUILD_CFG.get("embed_workers", 8)
+# ngưỡng kiểm tra trước khi đổi alias
+MIN_COUNT_RATIO = REBUILD_CFG.get("min_count_ratio", 0.99)
+SAMPLE_SIZE = REBUILD_CFG.get("sample_size", 100)
+SAMPLE_TOP_K = REBUILD_CFG.get("sample_top_k", 5)
+MAX_RECALL_DROP = REBUILD_CFG.get("max_recall_drop", 0.05)
+
+ARTICLE_ROWS_QUERY = """
+SELECT id, link, category_name, title, header, body, author,
+       is_comment, is_active, is_hot, is_important, is_top, has_video,
+       comment_count, like_count, dislike_count, hit_count,
+       created_at, updated_at, published_time, article_json
+FROM {}.{}
+"""
+
+
+def _index_service(collection_name: str) -> IndexService:
+    return IndexService(
+        cfg["vector_db"].get("uri"),
+        collection_name=collection_name,
+        API_KEY=cfg["llm"].get("openai_api_key"),
+        embedding_cache=cfg.get("embedding_cache"),
+        convert_workers=INDEXING_CFG.get("convert_workers", 1),
+        convert_chunksize=INDEXING_CFG.get("convert_chunksize", 16),
+        chunk_size=INDEXING_CFG.get("chunk_size", DEFAULT_CHUNK_SIZE),
+        chunk_overlap=INDEXING_CFG.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP),
+        vector_index=cfg["vector_db"].get("index"),
+    )
+
+
+def load_articles(service: IndexService, pg_conn, ids: Optional[List[int]] = None,
+                  replace: bool = False) -> Dict[str, int]:
+    """Đọc bài viết từ PostgreSQL theo lô (con trỏ phía server) và ghi vào collection của `service`.
+    `ids` = None: toàn bộ bảng; `replace=True`: upsert (collection đang được các job đồng bộ ghi cùng lúc)."""
+    query = sql.SQL(ARTICLE_ROWS_QUERY).format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME))
+    args = None
+    if ids is not None:
+        query += sql.SQL(" WHERE id = ANY(%s)")
+        args = (ids,)
+    inserted = failed = chunks = 0
+    with pg_conn.cursor(name="rebuild_articles") as pg_cur:
+        pg_cur.itersize = BATCH_SIZE
+        pg_cur.execute(query, args)
+        cols = None
+        while True:
+            rows = pg_cur.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            cols = cols or [desc[0] for desc in pg_cur.description]
+            documents = service.load_many_html_to_markdown([to_index_item(dict(zip(cols, row))) for row in rows])
+            report = service.store_articles(
+                documents,
+                batch_size=INDEXING_CFG.get("batch_size", 64),
+                max_workers=EMBED_WORKERS,
+                max_retries=INDEXING_CFG.get("max_retries", 5),
+                replace=replace,
+            )
+            inserted += report["inserted"]
+            failed += report["failed"]
+            chunks += report["chunks"]
+            logger.info(f"📦 Collection mới: {inserted} bài ({chunks} bản ghi), lỗi: {failed}")
+    pg_conn.commit()
+    return {"inserted": inserted, "failed": failed, "chunks": chunks}
+
+
+def _article_ids(pg_conn) -> set:
+    with pg_conn.cursor() as pg_cur:
+        pg_cur.execute(sql.SQL("SELECT id FROM {}.{};").format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)))
+        return {row[0] for row in pg_cur}
+
+
+def catch_up(service: IndexService, pg_conn, replace: bool = False) -> Dict[str, int]:
+    """Bù các bài được thêm / xóa ở PostgreSQL trong lúc nạp (hiệu tập id, không tra từng bài).
+    Bài bị sửa trong lúc nạp được vdb_ndh_sync so khớp lại sau khi đổi alias.
+    `replace=True` khi collection đã nằm sau alias (db_ndh_sync có thể đang ghi cùng bài)."""
+    pg_ids = _article_ids(pg_conn)
+    stored = service.scan_article_ids()
+    missing = sorted(pg_ids - stored)
+    extra = sorted(stored - pg_ids)
+    report = (load_articles(service, pg_conn, missing, replace=replace) if missing
+              else {"inserted": 0, "failed": 0, "chunks": 0})
+    failed = service.delete_articles(extra) if extra else []
+    logger.info(f"🔁 Bù thay đổi trong lúc nạp: thêm {report['inserted']}/{len(missing)} bài, "
+                f"xóa {len(extra) - len(failed)}/{len(extra)} bài")
+    return {"added": report["inserted"], "removed": len(extra) - len(failed)}
+
+
+def _sample_articles(pg_conn, size: int) -> List[Tuple[int, str]]:
+    with pg_conn.cursor() as pg_cur:
+        pg_cur.execute(
+            sql.SQL("SELECT id, title FROM {}.{} WHERE title <> '' ORDER BY random() LIMIT %s;").format(
+                sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)
+            ),
+            (size,),
+        )
+        return list(pg_cur.fetchall())
+
+
+def sample_recall(collection_name: str, samples: List[Tuple[int, str]], top_k: int) -> Tuple[float, int]:
+    """(tỉ lệ mẫu (id, tiêu đề) mà tìm theo tiêu đề trả về đúng bài trong top_k, số lần tìm bị lỗi),
+    cùng cách tìm với /retrieval. Gọi thẳng hybrid_search (không như `retrieve`, không nuốt lỗi) để
+    collection hỏng không bị nhầm thành recall 0."""
+    if not samples:
+        return 0.0, 0
+    retrieval_cfg = cfg.get("retrieval", {})
+    hybrid_cfg = retrieval_cfg.get("hybrid", {})
+    agent = VecterSearchAgent(
+        create_vectorstore(cfg["vector_db"]["uri"], collection_name, cfg["llm"]["openai_api_key"],
+                           embedding_cache=cfg.get("embedding_cache")),
+        chunk_fetch_factor=retrieval_cfg.get("chunk_fetch_factor", 3),
+        vector_search_params=vector_search_params(vector_index_config(cfg["vector_db"].get("index"))),
+        fusion=hybrid_cfg.get("fusion", "weighted"),
+        weights=hybrid_cfg.get("weights"),
+        rrf_k=hybrid_cfg.get("rrf_k", 60),
+        leg_top_k=hybrid_cfg.get("top_k"),
+    )
+    hits = errors = 0
+    try:
+        for article_id, title in samples:
+            try:
+                results = agent.hybrid_search(title, agent.embeddings.embed_query(title), top_k)
+            except Exception as e:
+                errors += 1
+                logger.info(f"⭕ Lỗi khi tìm thử trên '{collection_name}' (bài {article_id}): {e}")
+                continue
+            hits += article_id in {doc.metadata.get("id") for doc, _ in results}
+    finally:
+        agent.close()
+    return hits / len(samples), errors
+
+
+def validate(live: Optional[str], shadow: IndexService, pg_conn) -> Tuple[bool, Dict[str, Any]]:
+    """Kiểm tra collection mới trước khi đổi alias: số bài so với PostgreSQL (>= `rebuild.min_count_ratio`)
+    và recall theo tiêu đề trên `rebuild.sample_size` bài ngẫu nhiên không thấp hơn collection đang chạy
+    quá `rebuild.max_recall_drop`. Có lần tìm thử nào lỗi (ở collection nào cũng vậy) thì không đạt."""
+    expected = len(_article_ids(pg_conn))
+    stored = len(shadow.scan_article_ids())
+    samples = _sample_articles(pg_conn, SAMPLE_SIZE)
+    shadow_recall, shadow_errors = sample_recall(shadow.collection_name, samples, SAMPLE_TOP_K)
+    live_recall, live_errors = sample_recall(live, samples, SAMPLE_TOP_K) if live else (None, 0)
+    report: Dict[str, Any] = {
+        "expected": expected, "stored": stored,
+        "shadow_recall": shadow_recall, "live_recall": live_recall,
+        "search_errors": shadow_errors + live_errors,
+    }
+    ok = stored >= MIN_COUNT_RATIO * expected and not report["search_errors"]
+    if report["live_recall"] is not None:
+        ok = ok and report["shadow_recall"] >= report["live_recall"] - MAX_RECALL_DROP
+    logger.info(
+        f"🧪 Kiểm tra '{shadow.collection_name}': {stored}/{expected} bài, recall@{SAMPLE_TOP_K} "
+        f"{report['shadow_recall']:.3f} (đang chạy: "
+        f"{'-' if report['live_recall'] is None else format(report['live_recall'], '.3f')}), "
+        f"lỗi tìm thử: {report['search_errors']} -> {'đạt' if ok else 'KHÔNG đạt'}"
+    )
+    return ok, report
+
+
+def _after_swap(client: MilvusClient, previous: Optional[str], drop_old: bool) -> None:
+    # lần chạy kế tiếp của vdb_ndh_sync so khớp toàn bộ với collection mới (bắt các bài sửa trong lúc nạp)
+    vdb_state_file = cfg.get("vdb_sync", {}).get("state_file", "cache/vdb_sync_state.json")
+    state = load_sync_state(vdb_state_file)
+    if state.pop("last_full_sync", None):
+        save_sync_state(vdb_state_file, state)
+    invalidate_retrieval_cache(cfg.get("retrieval_cache", {}).get("generation_file", DEFAULT_GENERATION_FILE))
+    if previous and drop_old:
+        client.drop_collection(previous)
+        logger.info(f"🗑️  Đã xóa collection cũ '{previous}'")
+    elif previous:
+        logger.info(f"💾 Giữ collection cũ '{previous}' để quay lui (rebuild_collection.py --swap-to {previous})")
+
+
+def rebuild(swap: bool = True, drop_old: bool = False) -> bool:
+    alias = cfg["vector_db"]["collection_name"]
+    shadow_name = shadow_collection_name(alias)
+    start = time.perf_counter()
+    # tạo trước mọi kết nối Milvus: IndexService fork các process chuyển HTML ngay khi khởi tạo
+    shadow = _index_service(shadow_name)
+    client = MilvusClient(uri=cfg["vector_db"]["uri"])
+    live = live_collection(client, alias)
+    logger.info(f"🏗️  Build collection mới '{shadow_name}' (đang phục vụ: {live or 'chưa có'})")
+    with psycopg2.connect(**POSTGRES_CONFIG) as pg_conn:
+        report = load_articles(shadow, pg_conn)
+        catch_up(shadow, pg_conn)
+        client.flush(shadow_name)
+        logger.info(f"⏱️  Nạp {report['inserted']} bài ({report['chunks']} bản ghi) trong {time.perf_counter() - start:.1f}s")
+        ok, _ = validate(live, shadow, pg_conn)
+    if not ok:
+        logger.info(f"⭕ Collection mới không đạt kiểm tra, giữ alias '{alias}' -> {live}; '{shadow_name}' được giữ lại để xem xét")
+        return False
+    if not swap:
+        logger.info(f"✅ '{shadow_name}' đạt kiểm tra, chưa đổi alias (--no-swap)")
+        return True
+    _, previous = swap_alias(client, alias, shadow_name)
+    # db_ndh_sync vẫn ghi bài mới vào collection cũ trong lúc kiểm tra (vài phút): bù lại lần nữa
+    # với collection mới, lúc này đã nằm sau alias nên các bài mới từ đây được ghi thẳng vào nó
+    with psycopg2.connect(**POSTGRES_CONFIG) as pg_conn:
+        catch_up(shadow, pg_conn, replace=True)
+    _after_swap(client, previous, drop_old)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build lại vector store trên collection mới rồi đổi alias")
+    parser.add_argument("--no-swap", action="store_true", help="chỉ build và kiểm tra, không đổi alias")
+    parser.add_argument("--drop-old", action="store_true", help="xóa collection cũ sau khi đổi alias")
+    parser.add_argument("--swap-to", metavar="COLLECTION", help="chỉ trỏ alias sang collection có sẵn (quay lui)")
+    args = parser.parse_args()
+    if args.swap_to:
+        milvus_client = MilvusClient(uri=cfg["vector_db"]["uri"])
+        changed, previous = swap_alias(milvus_client, cfg["vector_db"]["collection_name"], args.swap_to)
+        # alias đã trỏ sẵn tới collection này: không xóa / reset gì (collection "trước đó" chính là collection đang phục vụ)
+        if changed:
+            _after_swap(milvus_client, previous, args.drop_old)
+        raise SystemExit(0)
+    raise SystemExit(0 if rebuild(swap=not args.no_swap, drop_old=args.drop_old) else 1)
@@ -1,26 +1,46 @@
 from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
+from datetime import date
+import re
+import time
 
 from agents.agent_sql_search import SqlAgent
 from agents.agent_vector_search import VecterSearchAgent
 from modules.indexer import create_vectorstore
+from modules.vector_index import vector_index_config, vector_search_params
+from modules.retrieval_cache import RetrievalCache
+from modules.retrieval_filters import build_filter_expr
+from modules.embedding_cache import CachedEmbeddings
+from modules.metrics import CONTENT_TYPE, REGISTRY, REQUEST_MS, load_snapshots
+from modules.tracing import configure_tracing, new_trace_id, shutdown_tracing, span
 
 from configs.config import load_config
-from configs.logging_config import setup_logging
+from configs.logging_config import logging_options, setup_logging
 
-logger = setup_logging(logger_name= 'ChatbotNDH',filename_prefix='ChatbotNDH')
 cfg = load_config()
+logger = setup_logging(logger_name= 'ChatbotNDH',filename_prefix='ChatbotNDH', **logging_options(cfg.get("logging")))
 
 # Pydantic models for request and response wwith vector search
 class RetrievalSetting(BaseModel):
     top_k: int = 2
     score_threshold: float = 0
 
+class RetrievalFilters(BaseModel):
+    """Điều kiện lọc metadata, được đẩy xuống Milvus thay vì để LLM tự loại kết quả không liên quan."""
+    category_name: Optional[Union[str, List[str]]] = None
+    author: Optional[str] = None
+    published_from: Optional[date] = None   # tính từ đầu ngày
+    published_to: Optional[date] = None     # tính hết ngày
+    is_hot: Optional[bool] = None
+    is_top: Optional[bool] = None
+    is_important: Optional[bool] = None
+
 class RetrievalRequest(BaseModel):
     knowledge_id: str
     query: str
     retrieval_setting: RetrievalSetting
+    filters: Optional[RetrievalFilters] = None
 
 class RecordMetadata(BaseModel):
     published_time: str
@@ -53,13 +73,50 @@ app = FastAPI(title="Retrieval API")
 sql_agent = SqlAgent()
 
 try:
-    vector_store = create_vectorstore( URI=cfg["vector_db"]["uri"], collection_name= cfg["vector_db"]["collection_name"], API_KEY= cfg["llm"]["openai_api_key"])
-    retriever = VecterSearchAgent(vector_store)
+    vector_store = create_vectorstore( URI=cfg["vector_db"]["uri"], collection_name= cfg["vector_db"]["collection_name"], API_KEY= cfg["llm"]["openai_api_key"],
+                                       embedding_cache=cfg.get("embedding_cache"))
+    retrieval_cfg = cfg.get("retrieval", {})
+    retriever = VecterSearchAgent(
+        vector_store,
+        search_workers=retrieval_cfg.get("search_workers", 8),
+        max_pending=retrieval_cfg.get("max_pending", 64),
+        cache=RetrievalCache.from_config(cfg.get("retrieval_cache", {})),
+        chunk_fetch_factor=retrieval_cfg.get("chunk_fetch_factor", 3),
+        vector_search_params=vector_search_params(vector_index_config(cfg["vector_db"].get("index"))),
+        fusion=retrieval_cfg.get("hybrid", {}).get("fusion", "weighted"),
+        weights=retrieval_cfg.get("hybrid", {}).get("weights"),
+        rrf_k=retrieval_cfg.get("hybrid", {}).get("rrf_k", 60),
+        leg_top_k=retrieval_cfg.get("hybrid", {}).get("top_k"),
+    )
 except Exception as e:
     vector_store = None
     retriever = None
 
 
+def _cache_metrics():
+    """Số lần trúng / trượt của các cache, đọc từ stats() lúc /metrics được gọi."""
+    stats = {}
+    if retriever is not None and retriever.cache is not None:
+        retrieval_stats = retriever.cache.stats()
+        # near hit (câu hỏi gần giống) cũng là một lần trúng cache dù tầng exact đã tính là trượt
+        stats["retrieval"] = {"hits": retrieval_stats["hits"] + retrieval_stats["near_hits"],
+                              "misses": retrieval_stats["misses"] - retrieval_stats["near_hits"]}
+    if sql_agent.sql_cache is not None:
+        stats["sql"] = sql_agent.sql_cache.stats()
+    if isinstance(getattr(vector_store, "embeddings", None), CachedEmbeddings):
+        stats["embedding"] = vector_store.embeddings.stats()
+    return [
+        ("ndh_cache_hits_total", "counter", "Số lần trúng cache",
+         [({"cache": name}, s["hits"]) for name, s in stats.items()]),
+        ("ndh_cache_misses_total", "counter", "Số lần trượt cache",
+         [({"cache": name}, s["misses"]) for name, s in stats.items()]),
+    ]
+
+REGISTRY.register_collector(_cache_metrics)
+# metrics do các job đồng bộ (process riêng) ghi ra file, được gộp vào /metrics
+METRICS_SNAPSHOT_DIR = cfg.get("metrics", {}).get("snapshot_dir", "cache/metrics")
+
+
 def verify_api_key(authorization: str = Header(None)) -> bool:
     """Verify the API key from Authorization header"""
     if not authorization:
@@ -87,7 +144,17 @@ async def retrieval_endpoint(
     # Verify API key
     if not verify_api_key(authorization):
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
-    
+    start = time.perf_counter()
+    status = "error"
+    try:
+        response = await _retrieval(request)
+        status = "ok"
+        return response
+    finally:
+        REQUEST_MS.observe((time.perf_counter() - start) * 1000, endpoint="/retrieval", status=status)
+
+
+async def _retrieval(request: RetrievalRequest) -> RetrievalResponse:
     # Check if retriever is initialized
     if retriever is None:
         logger.info("Lỗi: chưa khởi tạo vector store retrieval")
@@ -95,22 +162,15 @@ async def retrieval_endpoint(
     
     try:
         # Perform retrieval
-        results = retriever.retrieve(
+        results = await retriever.aretrieve(
             query=request.query, 
-            top_k=request.retrieval_setting.top_k
+            top_k=request.retrieval_setting.top_k,
+            score_threshold=request.retrieval_setting.score_threshold,
+            filter=build_filter_expr(**request.filters.model_dump()) if request.filters else None,
         )
         logger.info("============== VECTOR SEARCH RETRIEVAL PROCESS ==============")
-        # Filter results by score threshold
-        filtered_results = []
-        if request.retrieval_setting.score_threshold:
-            filtered_results = [
-                (doc, score) for doc, score in results 
-                if score >= request.retrieval_setting.score_threshold
-            ]
-        else: 
-            filtered_results = [
-                (doc, score) for doc, score in results 
-            ]
+        # Kết quả đã được lọc theo score_threshold trong retriever
+        filtered_results = results
         
         # Convert results to response format
         records = []
@@ -168,6 +228,8 @@ async def retrieval_endpoint(
 # Pydantic models for request and response wwith SQL retrieval
 class SqlRetrievalRequest(BaseModel):
     query: str
+    model: Optional[str] = None          # override model (phải có trong config llm.model_*)
+    temperature: Optional[float] = None  # override temperature cho request này
 
 class SQLRetrievalResponse(BaseModel):
     status: str
@@ -177,32 +239,69 @@ class SQLRetrievalResponse(BaseModel):
     table_description: str
     column_descriptions : str
 
+# X-Request-ID dạng 32 ký tự hex được dùng luôn làm trace id, để nối với trace của service gọi tới
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
 @app.post("/sql_retrieval", response_model=SQLRetrievalResponse)
 async def retrieval_endpoint(
     request: SqlRetrievalRequest,
+    response: Response,
+    x_request_id: Optional[str] = Header(None),
 ):
+    start = time.perf_counter()
+    status = "error"
+    request_id = x_request_id or new_trace_id()
+    response.headers["X-Request-ID"] = request_id
     try:
-        result = await sql_agent.process(request.query, cfg=cfg)
-
-        return SQLRetrievalResponse(    status= result["status"],
-                                        message= result["message"],
-                                        sql_result_summary= result["sql_result_summary"], 
-                                        table_name= result["table_name"],
-                                        table_description= result["table_description"],
-                                        column_descriptions= result[ "column_descriptions" ]
-                                    )
+        trace_id = request_id.lower() if _TRACE_ID_RE.match(request_id.lower()) else None
+        with span("sql_retrieval", trace_id=trace_id, request_id=request_id, model=request.model):
+            result = await sql_agent.process(request.query, cfg=cfg,
+                                             model_name=request.model,
+                                             temperature=request.temperature)
+
+        sql_response = SQLRetrievalResponse(    status= result["status"],
+                                                message= result["message"],
+                                                sql_result_summary= result["sql_result_summary"], 
+                                                table_name= result["table_name"],
+                                                table_description= result["table_description"],
+                                                column_descriptions= result[ "column_descriptions" ]
+                                            )
+        status = "ok"
+        return sql_response
     except Exception as e:
         logger.info(f'Retrieval error: {str(e)}')
         raise HTTPException(status_code=500, detail=f"Retrieval error: {str(e)}")
+    finally:
+        REQUEST_MS.observe((time.perf_counter() - start) * 1000, endpoint="/sql_retrieval", status=status)
     
+@app.on_event("startup")
+async def startup():
+    # span của /sql_retrieval được xuất bởi thread nền (JSON lines hoặc OTLP tới collector)
+    configure_tracing(cfg.get("tracing"))
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sql_agent.aclose()
+    if retriever is not None:
+        retriever.close()
+    shutdown_tracing()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "vector_store_initialized": retriever is not None
+        "vector_store_initialized": retriever is not None,
+        "retrieval_cache": retriever.cache.stats() if retriever is not None and retriever.cache is not None else None,
+        "sql_cache": sql_agent.sql_cache.stats() if sql_agent.sql_cache is not None else None,
+        "embedding_cache": vector_store.embeddings.stats() if isinstance(getattr(vector_store, "embeddings", None), CachedEmbeddings) else None,
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Metrics dạng text Prometheus: độ trễ từng chặng, retry, cache, cùng metrics của các job đồng bộ."""
+    return Response(content=REGISTRY.render(load_snapshots(METRICS_SNAPSHOT_DIR)), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004 )
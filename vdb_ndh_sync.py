@@ -1,10 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-import copy
+import argparse
 import os
 import time
-import json
 import logging
 from typing import Any, Dict, List
 from dotenv import load_dotenv
@@ -12,21 +11,33 @@ from pathlib import Path
 import schedule
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from langchain_core.documents import Document
 
-from configs.logging_config import setup_logging
+from configs.logging_config import logging_options, setup_logging
 from configs.config import load_config
-from modules.indexer import IndexService
+from modules.article_store import to_index_item
+from modules.chunker import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE
+from modules.indexer import FINGERPRINT_FIELD, IndexService, normalize_metadata_value
+from modules.metrics import SYNC_DOCS, SYNC_DOCS_PER_SEC, SYNC_RUN_MS, export_snapshot
+from modules.retrieval_cache import DEFAULT_GENERATION_FILE, invalidate_retrieval_cache
+from modules.sync_state import load_sync_state, save_sync_state
 
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"), override=False)
 
-logger = setup_logging(logger_name="vdb_sync_ndh", filename_prefix="vdb_sync_ndh")
 cfg = load_config()
+logger = setup_logging(logger_name="vdb_sync_ndh", filename_prefix="vdb_sync_ndh", **logging_options(cfg.get("logging")))
 
 indexservice = IndexService(
     cfg["vector_db"].get("uri"),
     collection_name=cfg["vector_db"].get("collection_name"),
     API_KEY=cfg["llm"].get("openai_api_key"),
+    embedding_cache=cfg.get("embedding_cache"),
+    convert_workers=cfg.get("indexing", {}).get("convert_workers", 1),
+    convert_chunksize=cfg.get("indexing", {}).get("convert_chunksize", 16),
+    chunk_size=cfg.get("indexing", {}).get("chunk_size", DEFAULT_CHUNK_SIZE),
+    chunk_overlap=cfg.get("indexing", {}).get("chunk_overlap", DEFAULT_CHUNK_OVERLAP),
+    vector_index=cfg["vector_db"].get("index"),
 )
 
 POSTGRES_CONFIG = {
@@ -39,27 +50,25 @@ POSTGRES_CONFIG = {
 SCHEMA_NAME = "via_ndh"
 TABLE_NAME = "data_ndh"
 
+VDB_SYNC_CFG = cfg.get("vdb_sync", {})
+STATE_FILE = VDB_SYNC_CFG.get("state_file", "cache/vdb_sync_state.json")
+# mặc định giữ lịch cũ (2 ngày); chế độ tăng dần đủ rẻ để chạy dày hơn
+SYNC_INTERVAL_MINUTES = VDB_SYNC_CFG.get("interval_minutes", 2 * 24 * 60)
+FULL_SYNC_INTERVAL_HOURS = VDB_SYNC_CFG.get("full_sync_interval_hours", 7 * 24)
+# metrics của mỗi lần chạy được ghi ra <metrics.snapshot_dir>/vdb_sync.json để /metrics của retrieval_app đọc
+METRICS_SNAPSHOT_DIR = cfg.get("metrics", {}).get("snapshot_dir", "cache/metrics")
+
 def isupdate(doc_a: Document, doc_b: Document ) -> bool:
+    """So sánh đầy đủ nội dung + metadata, chỉ còn dùng cho bản ghi trong vector store chưa có fingerprint."""
     if not doc_a.page_content == doc_b.page_content:
         logger.info(f"nội dung bài viết đã bị thay đổi, đang cập nhật lại nội dung bài viết...")
         return False
-    value1 = doc_a.metadata
-    value2 = doc_b.metadata
-    # value1.pop("article_json")
-    value1['article_json'] = json.loads(value1['article_json'])
-    value1['created_at'] = datetime.fromisoformat(value1['created_at']).replace(tzinfo=None)
-    value1['updated_at'] = datetime.fromisoformat(value1['updated_at']).replace(tzinfo=None)
-    value1['published_time'] = datetime.fromisoformat(value1['published_time']).replace(tzinfo=None)
-    # value2.pop("article_json")
-    value2['article_json'] = json.loads(value2['article_json'])
-    value2['created_at'] = datetime.fromisoformat(value2['created_at']).replace(tzinfo=None)
-    value2['updated_at'] = datetime.fromisoformat(value2['updated_at']).replace(tzinfo=None)
-    value2['published_time'] = datetime.fromisoformat(value2['published_time']).replace(tzinfo=None)
-
-    # So sánh từng key
-    for key in value1:
-        v1 = value1[key]
-        v2 = value2[key]
+    # So sánh từng key (timestamp bỏ múi giờ, article_json so theo nội dung JSON)
+    for key, v1 in doc_a.metadata.items():
+        if key == FINGERPRINT_FIELD:
+            continue
+        v1 = normalize_metadata_value(key, v1)
+        v2 = normalize_metadata_value(key, doc_b.metadata.get(key))
         if v1 != v2:
             if key != "article_json":
                 logger.info(f"Giá trị khác nhau ở key '{key}': {v1} vs {v2}")
@@ -68,92 +77,209 @@ def isupdate(doc_a: Document, doc_b: Document ) -> bool:
             return False
     return True
 
-def vdb_sync():
+def _ensure_tracking_columns(pg_cursor) -> None:
+    """Cột/index cần cho chế độ tăng dần (bảng có thể được tạo trước khi có các cột này)."""
+    table = sql.SQL("{}.{}").format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME))
+    pg_cursor.execute(
+        sql.SQL(
+            "ALTER TABLE {} ADD COLUMN IF NOT EXISTS content_hash TEXT, "
+            "ADD COLUMN IF NOT EXISTS indexed_hash TEXT, "
+            "ADD COLUMN IF NOT EXISTS fingerprint TEXT;"
+        ).format(table)
+    )
+    pg_cursor.execute(
+        sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (updated_at);").format(
+            sql.Identifier(f"{TABLE_NAME}_updated_at_idx"), table
+        )
+    )
+
+
+def _full_sync_due(state: Dict[str, Any]) -> bool:
+    last_full_sync = state.get("last_full_sync")
+    if not state.get("updated_at") or not last_full_sync:
+        return True
+    elapsed = datetime.now() - datetime.fromisoformat(last_full_sync)
+    return elapsed.total_seconds() >= FULL_SYNC_INTERVAL_HOURS * 3600
+
+
+def vdb_sync(full: bool | None = None):
     """
     Đồng bộ dữ liệu cập nhật từ PostgreSQL sang Milvus.
+
+    - Tăng dần (mặc định): chỉ xử lý bản ghi có `updated_at` >= watermark của lần chạy thành công trước,
+      hoặc có `content_hash` (do db_ndh_sync ghi) khác `indexed_hash` (hash đã đẩy sang Milvus), để bắt
+      cả các thay đổi không làm đổi `updated_at` và các bản ghi lần trước cập nhật lỗi.
+    - Toàn bộ: so khớp lại cả bảng; chạy khi `full=True`, khi chưa có watermark hoặc
+      đã quá `vdb_sync.full_sync_interval_hours` kể từ lần so khớp toàn bộ gần nhất.
     """
+    state = load_sync_state(STATE_FILE)
+    if full is None:
+        full = _full_sync_due(state)
+    started_at = datetime.now()
+    logger.info(f"🔄 Bắt đầu đồng bộ vector store ({'toàn bộ' if full else 'tăng dần từ ' + state['updated_at']})")
+
     # 1. Kết nối PostgreSQL
     with psycopg2.connect(**POSTGRES_CONFIG) as pg_conn, pg_conn.cursor() as pg_cursor:
+        _ensure_tracking_columns(pg_cursor)
 
-        # 2. Lấy tất cả bản ghi từ Postgres
+        # 2. Lấy các bản ghi cần so khớp từ Postgres
         query = f"""
         SELECT id, link, category_name, title, header, body, author,
                is_comment, is_active, is_hot, is_important, is_top, has_video,
                comment_count, like_count, dislike_count, hit_count,
-               created_at, updated_at, published_time, article_json
-        FROM {SCHEMA_NAME}.{TABLE_NAME};
+               created_at, updated_at, published_time, article_json, content_hash, fingerprint
+        FROM {SCHEMA_NAME}.{TABLE_NAME}
         """
-        pg_cursor.execute(query)
+        if full:
+            pg_cursor.execute(query)
+        else:
+            pg_cursor.execute(
+                query + " WHERE updated_at >= %s::timestamptz"
+                        " OR (content_hash IS NOT NULL AND content_hash IS DISTINCT FROM indexed_hash)",
+                (state["updated_at"],),
+            )
         # lấy tên cột
         cols = [desc[0] for desc in pg_cursor.description]
         # fetch dưới dạng tuple
         rows = pg_cursor.fetchall()
         # chuyển mỗi row tuple thành dict
         records: List[Dict[str, Any]] = [dict(zip(cols, row)) for row in rows]
-        # 3. Lấy toàn bộ document trong vectorstore
-        all_ids: List[int] = []
-        doc_in_db_mapping: Dict[int, Document] = {}
-        doc_in_vb_mapping: Dict[int, Document | None] = {}
-        
-        for r in records:
-            id = r['id']
-            all_ids.append(id)
-            # tạo document với dữ liệu trong PostgreSQL
-            document_in_db = indexservice.load_html_to_markdown(
-                html_data=r["body"] or "",
-                metadata={
-                    'id': int(id),
-                    'title': r.get('title', ''),
-                    'header': r.get('header', ''),
-                    'author': r.get('author', ''),
-                    'category_name': r.get('category_name', ''),
-                    'link': r.get('link', ''),
-                    'created_at': r['created_at'].isoformat() if r['created_at'] else '',
-                    'updated_at': r['updated_at'].isoformat() if r['updated_at'] else '',
-                    'published_time': r['published_time'].isoformat() if r['published_time'] else '',
-                    'article_json': json.dumps(r.get('article_json'), ensure_ascii=False, indent= 2 ),
-                    **{k: r.get(k) or 0 for k in (
-                        'is_comment', 'is_active', 'is_hot', 'is_important',
-                        'is_top', 'has_video', 'comment_count', 'like_count',
-                        'dislike_count', 'hit_count'
-                    )},
-                },
-            )
-            doc_in_db_mapping[id] = document_in_db
-            # lấy document từ vectorstore
-            vb_docs = indexservice.get_by_id(id)
-            doc_in_vb_mapping[id] = vb_docs if vb_docs else None
+        logger.info(f"🔎 {len(records)} bản ghi cần so khớp với vector store")
+        # 3. Tạo document (kèm fingerprint) từ dữ liệu trong PostgreSQL
+        items = [to_index_item(r) for r in records]
+        # chuyển HTML -> Markdown song song trên process pool
+        documents = indexservice.load_many_html_to_markdown(items)
+        hash_by_id = {r["id"]: r["content_hash"] for r in records}
+
+        # 4. So khớp bằng fingerprint thay vì so từng trường của hai bản ghi
+        # id đã khớp với vector store sau lần chạy này -> fingerprint / id cập nhật lỗi
+        synced: Dict[int, str] = {}
+        failed_ids: List[int] = []
+        candidates: List[Document] = []
+        for r, doc in zip(records, documents):
+            # fingerprint ở PostgreSQL là của bản đã đẩy sang vector store; chế độ toàn bộ thì kiểm tra lại với Milvus
+            if not full and r["fingerprint"] == doc.metadata[FINGERPRINT_FIELD]:
+                synced[r["id"]] = r["fingerprint"]
+            else:
+                candidates.append(doc)
+        fetch_batch_size = VDB_SYNC_CFG.get("fetch_batch_size", 1000)
+        indexed = indexservice.get_articles(
+            [doc.metadata["id"] for doc in candidates], output_fields=[FINGERPRINT_FIELD], batch_size=fetch_batch_size
+        )
+        to_update: List[Document] = []
+        legacy: List[Document] = []
+        missing = 0
+        for doc in candidates:
+            id = doc.metadata["id"]
+            if id not in indexed:
+                # có ở PostgreSQL nhưng không có trong vector store (db_ndh_sync ghi lỗi, bài mất chunk đầu...):
+                # ghi lại cả bài, upsert + xóa bản ghi thừa nên không trùng với các chunk còn sót
+                to_update.append(doc)
+                missing += 1
+                continue
+            indexed_fingerprint = indexed[id].metadata.get(FINGERPRINT_FIELD)
+            if not indexservice.is_current_layout(indexed[id]):
+                to_update.append(doc)  # lưu theo cấu hình chunk cũ: ghi lại toàn bộ bài
+            elif indexed_fingerprint == doc.metadata[FINGERPRINT_FIELD]:
+                synced[id] = indexed_fingerprint
+            elif indexed_fingerprint:
+                to_update.append(doc)
+            else:
+                legacy.append(doc)
+        # bản ghi đẩy sang trước khi có fingerprint: so sánh đầy đủ các trường
+        if legacy:
+            legacy_docs = indexservice.get_articles([doc.metadata["id"] for doc in legacy], batch_size=fetch_batch_size)
+            for doc in legacy:
+                doc_in_vb = legacy_docs.get(doc.metadata["id"])
+                # không đọc lại được bản ghi: ghi lại cả bài thay vì bỏ qua, để bài không bị
+                # chọn lại (content_hash khác indexed_hash) ở mọi lần chạy tăng dần sau
+                if doc_in_vb is not None and isupdate(doc, doc_in_vb):
+                    synced[doc.metadata["id"]] = doc.metadata[FINGERPRINT_FIELD]
+                else:
+                    to_update.append(doc)
 
-        # so khớp xem có cần cập nhật hay không
-        updated = False
+        if missing:
+            logger.info(f"➕ {missing} bản ghi chưa có trong vector store, đang thêm vào...")
         count = 0
-        # copy để không làm mất mát dữ liệu gốc (note phải dùng deepcopy nhé , .copy() ko được đâu )
-        doc_in_db_mapping_copy = copy.deepcopy(doc_in_db_mapping)
-        doc_in_vb_mapping_copy = copy.deepcopy(doc_in_vb_mapping)
-        for id in all_ids:
-            a = doc_in_db_mapping_copy.get(id)
-            b = doc_in_vb_mapping_copy.get(id)
-            if a and b and not isupdate(a, b):
-                updated = True
-                try:
-                    # update dữ liệu vào vector store
-                    indexservice.vector_store.upsert(ids = [ id ], documents= [doc_in_db_mapping.get(id)])
-                    count += 1
-                    logger.info(f"✅ Đã cập nhật bản ghi id={id} trong vector store")
-                except Exception as e:
-                    logger.exception(f"⭕ Lỗi khi cập nhật dữ liệu Vector Store id={id}: {e}")
-        if not updated:
+        if to_update:
+            logger.info(f"✏️ {len(to_update)} bản ghi đã thay đổi, đang cập nhật lại trong vector store...")
+            indexing_cfg = cfg.get("indexing", {})
+            report = indexservice.store_articles(
+                to_update,
+                batch_size=indexing_cfg.get("batch_size", 64),
+                max_workers=indexing_cfg.get("embed_workers", 4),
+                max_retries=indexing_cfg.get("max_retries", 5),
+                replace=True,
+            )
+            count = report["inserted"]
+            failed_ids = report["failed_ids"]
+            SYNC_DOCS.inc(count, sync="vdb_sync", result="updated")
+            SYNC_DOCS.inc(report["failed"], sync="vdb_sync", result="failed")
+            SYNC_DOCS_PER_SEC.set(report["docs_per_sec"], sync="vdb_sync")
+            failed = set(failed_ids)
+            synced.update({
+                doc.metadata["id"]: doc.metadata[FINGERPRINT_FIELD]
+                for doc in to_update if doc.metadata["id"] not in failed
+            })
+        if not count:
             logger.info("🔔 Không có bản ghi mới nào cần cập nhật vào vector store.")
         else:
             logger.info(f"🎉 Đã cập nhật {count} bản ghi trong vector store")
+            invalidate_retrieval_cache(cfg.get("retrieval_cache", {}).get("generation_file", DEFAULT_GENERATION_FILE))
+
+        # Ghi nhận hash/fingerprint đã đồng bộ để lần sau không phải so khớp lại các bản ghi này.
+        # Mọi bản ghi đã đọc đều hoặc nằm trong `synced`, hoặc cập nhật lỗi (failed_ids, giữ watermark để thử lại),
+        # nên truy vấn tăng dần không chọn lại mãi các bản ghi đã khớp với vector store.
+        # (dùng content_hash đã đọc ở trên, không phải giá trị hiện tại vì db_ndh_sync có thể vừa ghi bản mới hơn)
+        if synced:
+            execute_values(
+                pg_cursor,
+                sql.SQL(
+                    "UPDATE {}.{} AS t SET indexed_hash = v.content_hash, fingerprint = v.fingerprint "
+                    "FROM (VALUES %s) AS v(id, content_hash, fingerprint) WHERE t.id = v.id;"
+                ).format(sql.Identifier(SCHEMA_NAME), sql.Identifier(TABLE_NAME)).as_string(pg_conn),
+                [(id, hash_by_id.get(id), fingerprint) for id, fingerprint in synced.items()],
+                page_size=1000,
+            )
+
+    # 5. Chỉ tiến watermark khi không có bản ghi lỗi, bản ghi lỗi sẽ được lấy lại ở lần chạy sau
+    watermarks = [r["updated_at"] for r in records if r["updated_at"]]
+    if failed_ids:
+        logger.info(f"⭕ {len(failed_ids)} bản ghi cập nhật lỗi, giữ nguyên watermark để thử lại: {failed_ids}")
+    elif watermarks:
+        state["updated_at"] = max(watermarks).isoformat()
+    if not state.get("updated_at"):
+        state["updated_at"] = datetime.min.isoformat()
+    if full:
+        state["last_full_sync"] = started_at.isoformat()
+    save_sync_state(STATE_FILE, state)
+    logger.info(f"📌 Watermark updated_at = {state['updated_at']}")
+
+
+def sync_job(full: bool | None = None) -> None:
+    """`vdb_sync` kèm ghi thời gian chạy và metrics của process ra `metrics.snapshot_dir`."""
+    start = time.perf_counter()
+    try:
+        vdb_sync(full)
+    finally:
+        SYNC_RUN_MS.observe((time.perf_counter() - start) * 1000, sync="vdb_sync")
+        export_snapshot(METRICS_SNAPSHOT_DIR, "vdb_sync")
 
 
 # schedule.every(1).days.do(vdb_sync)  # hàng ngày
-schedule.every(2).days.do(vdb_sync)
+schedule.every(SYNC_INTERVAL_MINUTES).minutes.do(sync_job)
 
 
 if __name__ == "__main__":
-    vdb_sync()
+    parser = argparse.ArgumentParser(description="Đồng bộ PostgreSQL sang vector store")
+    parser.add_argument("--full", action="store_true", help="so khớp lại toàn bộ bảng ở lần chạy đầu")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="build lại index vector theo vector_db.index trong config rồi thoát")
+    args = parser.parse_args()
+    if args.rebuild_index:
+        indexservice.rebuild_vector_index()
+        raise SystemExit(0)
+    sync_job(full=True if args.full else None)
     while True:
         schedule.run_pending()
         time.sleep(1)